@@ -1,3 +1,4 @@
+from django.core.signals import setting_changed
 from rest_framework.permissions import AllowAny
 from rest_framework.settings import APISettings
 
@@ -9,11 +10,80 @@ DEFAULTS = {
     "JWT_SERIALIZER": None,
     "TOKEN_SERIALIZER": "rest_framework.authtoken.serializers.TokenSerializer",
     "TOKEN_CREATOR": None,
+    "API_RENDERER_CLASSES": [
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "API_PARSER_CLASSES": [
+        "api.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    "ROLE_CACHE_TIMEOUT": 300,
+    "ENDPOINT_INDEX_TIMEOUT": 300,
+    "BULK_ASSIGN_MAX_ITEMS": 10000,
+    "TIER_CACHE_TIMEOUT": 3600,
+    "TIER_CATALOG_CACHE_TIMEOUT": 300,
+    "MEMBERSHIP_CACHE_TIMEOUT": 300,
+    "MEMBERSHIP_BULK_CHUNK_SIZE": 500,
+    "MEMBERSHIP_BULK_MAX_ITEMS": 100000,
+    "MEMBERSHIP_CANCELLED_STATUS": "cancelled",
+    "MEMBERSHIP_EXPIRED_STATUS": "expired",
+    "COMPLETED_STEPS_PAGE_SIZE": 100,
+    "COMPLETED_STEPS_MAX_PAGE_SIZE": 1000,
+    "COMPLETED_STEPS_STREAM_CHUNK_SIZE": 2000,
+    "ONBOARDING_CACHE_TIMEOUT": 60,
+    "NEXT_STEPS_CHUNK_SIZE": 1000,
+    "NEXT_STEPS_BATCH_MAX_USERS": 10000,
+    "EMAIL_QUEUE_MODE": "database",
+    "EMAIL_DELIVERY_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+    "EMAIL_QUEUE_MAX_ATTEMPTS": 5,
+    "INSTRUMENTATION_ENABLED": False,
+    "INSTRUMENTATION_N_PLUS_ONE_THRESHOLD": 10,
+    "INSTRUMENTATION_SLOW_QUERY_MS": 100,
+    "INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE": 0.1,
+    "SQLITE_PRAGMAS": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -20000,
+        "temp_store": "MEMORY",
+    },
+    "DB_WRITE_RETRY_ATTEMPTS": 5,
+    "DB_WRITE_RETRY_BASE_DELAY": 0.05,
+    "CREDENTIAL_LOCAL_CACHE_TIMEOUT": 30,
+    "CREDENTIAL_LOCAL_CACHE_SIZE": 10000,
+    "CREDENTIAL_NEGATIVE_CACHE_SIZE": 1000,
+    "CREDENTIAL_SHARED_CACHE": False,
+    "CREDENTIAL_CACHE_TIMEOUT": 300,
+    "TENANT_DATABASES": {},
+    "CONFIG_TRANSFER_CHUNK_SIZE": 1000,
+    "CONFIG_IMPORT_MAX_ERRORS": 100,
+    "CONFIG_IMPORT_SPOOL_MAX_MEMORY": 8 * 1024 * 1024,
+    "CHANGE_EVENTS_ENABLED": True,
+    "CHANGE_EVENT_BATCH_SIZE": 500,
+    "CHANGE_EVENT_PAGE_SIZE": 500,
+    "CHANGE_EVENT_MAX_PAGE_SIZE": 5000,
+    "CHANGE_EVENT_RETENTION_DAYS": 7,
+    "CHANGE_EVENT_MAX_ROWS": None,
+    "CHANGE_EVENT_COMPACT_AFTER_HOURS": 24,
+    "STARTUP_BUDGET_MS": None,
+    "STARTUP_BUDGET_RSS_MB": None,
 }
 IMPORT_STRINGS = [
     "REGISTER_SERIALIZER",
     "JWT_SERIALIZER",
     "TOKEN_SERIALIZER",
+    "API_RENDERER_CLASSES",
+    "API_PARSER_CLASSES",
 ]
 
 api_settings = APISettings(USER_SETTINGS, DEFAULTS, IMPORT_STRINGS)
+
+
+def reload_api_settings(*args, setting, **kwargs):
+    if setting == "REST_FRAMEWORK":
+        api_settings.reload()
+
+
+setting_changed.connect(reload_api_settings)
@@ -0,0 +1,213 @@
+from accounts.models import Onboarding, SubscriptionTier
+from allauth.account import app_settings as allauth_account_settings
+from allauth.account.utils import complete_signup
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings as drf_settings
+
+from .api_settings import api_settings
+from .cache import RoleCache
+from .controllers import CustomMembershipController, CustomOnboardingController, CustomRoleController
+from .db import CrossTenantError, ReadReplicaMixin, using_tenant
+from .pagination import decode_cursor, encode_cursor
+from .permissions import HasEndpointPermission
+from .serializers import CompletedOnboardingStepSerializer
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async-native variants of api.views served under ASGI. DRF's
+    APIView dispatches synchronously, so these views wrap the request in a DRF
+    Request themselves: authentication_classes resolve the user (session with
+    DRF's CSRF rule, basic or token), permission_classes plus
+    HasEndpointPermission (unless AllowAny) are checked in the same thread hop, the body is parsed
+    with parser_classes (the API's orjson parser) into self.data, and answers
+    come in the same shapes as api.views.
+    """
+
+    authentication_classes = drf_settings.DEFAULT_AUTHENTICATION_CLASSES
+    parser_classes = api_settings.API_PARSER_CLASSES
+    permission_classes = [IsAuthenticated]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, method, None) if method in self.http_method_names else None
+        if handler is None:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+
+        drf_request = Request(
+            request,
+            parsers=[parser() for parser in self.parser_classes],
+            authenticators=[authenticator() for authenticator in self.authentication_classes],
+        )
+        try:
+            await sync_to_async(self.check_access)(drf_request)
+            self.data = drf_request.data if request.body else {}
+        except exceptions.APIException as e:
+            return self.handle_exception(drf_request, e)
+        request.user, request.auth = drf_request.user, drf_request.auth
+        return await handler(request, *args, **kwargs)
+
+    def check_access(self, request):
+        """APIView.initial() for these views: authenticate, then check every permission."""
+        permissions = [permission() for permission in self.permission_classes]
+        if HasEndpointPermission.guards(self):
+            permissions.append(HasEndpointPermission())
+        for permission in permissions:
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, "message", None))
+
+    @staticmethod
+    def handle_exception(request, exc):
+        response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            # As in APIView: 401 with a challenge when the first authenticator has one, 403 otherwise.
+            header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+            if header:
+                response["WWW-Authenticate"] = header
+            else:
+                response.status_code = 403
+        return response
+
+
+async def tenant_organization_ids(request):
+    """Async api.views.tenant_organization_ids() for the "organization_id" query parameters."""
+    organization_ids = request.GET.getlist("organization_id")
+    if organization_ids or not api_settings.TENANT_DATABASES:
+        return organization_ids
+    return await CustomRoleController.auser_organization_ids(request.user)
+
+
+class AsyncUserRolesView(ReadReplicaMixin, AsyncAPIView):
+    async def get(self, request):
+        user_roles = await RoleCache.aget_roles(request.user)
+        return JsonResponse({"roles": [name for _, name in user_roles],
+                             "role_ids": [role_id for role_id, _ in user_roles]})
+
+
+class AsyncCompletedOnboardingStepsView(ReadReplicaMixin, AsyncAPIView):
+    async def get(self, request):
+        onboarding_name = request.GET.get("onboarding_name")
+        if not onboarding_name:
+            return JsonResponse({"error": "Missing required query parameter: 'onboarding_name'"}, status=400)
+
+        try:
+            cursor = request.GET.get("cursor")
+            cursor = decode_cursor(cursor) if cursor else None
+            limit = int(request.GET.get("limit", api_settings.COMPLETED_STEPS_PAGE_SIZE))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        limit = max(1, min(limit, api_settings.COMPLETED_STEPS_MAX_PAGE_SIZE))
+
+        try:
+            with using_tenant(await tenant_organization_ids(request)):
+                rows, next_cursor = await CustomOnboardingController().aget_completed_steps_page(
+                    onboarding_name, cursor, limit
+                )
+            return JsonResponse({
+                "completed_steps": CompletedOnboardingStepSerializer.represent_rows(rows),
+                "next_cursor": encode_cursor(*next_cursor) if next_cursor else None,
+            })
+        except CrossTenantError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+
+class AsyncOnboardingProgressView(AsyncAPIView):
+    async def get(self, request):
+        onboarding_name = request.GET.get("onboarding_name")
+        if not onboarding_name:
+            return JsonResponse({"error": "Missing required query parameter: 'onboarding_name'"}, status=400)
+
+        try:
+            with using_tenant(await tenant_organization_ids(request)):
+                progress = await CustomOnboardingController().aget_progress(request.user, onboarding_name)
+        except Onboarding.DoesNotExist:
+            return JsonResponse({"error": "Onboarding not found"}, status=404)
+        except CrossTenantError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+        return JsonResponse({
+            "onboarding_name": onboarding_name,
+            "completed_count": progress.completed_count,
+            "required_remaining": progress.required_remaining,
+            "total_steps": progress.total_steps,
+            "current_level": progress.current_level,
+            "percent": progress.percent,
+        })
+
+
+class AsyncCreateMembershipView(AsyncAPIView):
+    async def post(self, request):
+        try:
+            subscription_tier = await SubscriptionTier.objects.aget(id=self.data.get("subscription_tier_id"))
+        except (SubscriptionTier.DoesNotExist, ValueError):
+            return JsonResponse({"error": "Subscription tier not found"}, status=404)
+
+        membership = await CustomMembershipController.acreate_membership(request.user, subscription_tier)
+        return JsonResponse({
+            "message": "Membership created",
+            "membership_id": membership.membership_id
+        }, status=201)
+
+
+class AsyncAssignMembershipRolesView(AsyncAPIView):
+    async def post(self, request):
+        membership = await CustomMembershipController.aget_active_membership(request.user)
+        if not membership:
+            return JsonResponse({"error": "No active membership"}, status=400)
+
+        await CustomMembershipController.aassign_roles_from_tier(membership)
+        return JsonResponse({"message": "Roles assigned successfully"})
+
+
+class AsyncUserSignupWithOnboardingView(AsyncAPIView):
+    """
+    Async signup with onboarding integration. Registration, allauth's signup flow
+    and the onboarding bookkeeping are sync-only (transactions, allauth) and share
+    one transaction, so they run in a single thread hop; the confirmation email
+    itself is handed to QueuedEmailBackend and never waits on SMTP.
+    """
+
+    permission_classes = [AllowAny]
+
+    async def post(self, request):
+        serializer = api_settings.REGISTER_SERIALIZER(data=self.data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=400)
+        user, step = await sync_to_async(self.sign_up)(request, serializer)
+
+        return JsonResponse({
+            "detail": "Verification e-mail sent.",
+            "user_id": user.id,
+            "step": {
+                "id": step.id,
+                "name": step.name,
+                "description": step.description,
+                "level": step.level,
+                "optional": step.optional,
+            },
+        }, status=201)
+
+    @staticmethod
+    def sign_up(request, serializer):
+        # One transaction: the user, the queued confirmation mail and their pending "Verify Email" step.
+        with transaction.atomic():
+            user = serializer.save(request)
+            complete_signup(request, user, allauth_account_settings.EMAIL_VERIFICATION, None)
+            return user, CustomOnboardingController().start_signup_onboarding(user)
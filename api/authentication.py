@@ -0,0 +1,32 @@
+import copy
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import CredentialCache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that looks each token up once per CredentialCache entry
+    instead of joining authtoken_token to the user table on every request.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = CredentialCache.get_or_verify("token", key, self.verify_token)
+        if entry is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        # Cached instances are shared between requests; hand out copies.
+        user = copy.copy(entry["user"])
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return user, copy.copy(entry["token"])
+
+    def verify_token(self, key):
+        model = self.get_model()
+        try:
+            token = model.objects.select_related("user").get(key=key)
+        except model.DoesNotExist:
+            return None
+        return {"token": token, "user": token.user, "tags": [f"user:{token.user_id}"]}, None
@@ -0,0 +1,517 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from accounts.models import MembershipTier, Onboarding, OnboardingStep, Role, RoleTemplate, SubscriptionTier
+from .api_settings import api_settings
+from .db import active_tenant_database, tenant_databases
+
+_request_store = ContextVar("api_request_store", default=None)
+
+
+def request_store():
+    """Dict scoped to the current request, or None outside of RequestCacheMiddleware."""
+    return _request_store.get()
+
+
+class RoleCache:
+    """
+    Resolved roles of a user, cached per request and across processes through
+    the Django cache framework. Endpoint authorization is answered by
+    api.endpoint_index from these roles.
+    """
+
+    roles_prefix = "api:user-roles"
+
+    @classmethod
+    def get_roles(cls, user):
+        """Return [(role_id, role_name), ...] for the user, in one query or none."""
+        return cls._get(cls.roles_prefix, user.pk, cls.resolve_roles)
+
+    @classmethod
+    async def aget_roles(cls, user):
+        """Async get_roles() for ASGI views; shares the same cache entries."""
+        key = f"{cls.roles_prefix}:{user.pk}"
+        store = request_store()
+        if store is not None and key in store:
+            return store[key]
+        value = await cache.aget(key)
+        if value is None:
+            value = [
+                row
+                async for row in Role.objects.filter(pk__in=cls._user_role_ids(user.pk))
+                .order_by("pk")
+                .values_list("id", "name")
+            ]
+            await cache.aset(key, value, api_settings.ROLE_CACHE_TIMEOUT)
+        if store is not None:
+            store[key] = value
+        return value
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+        if not user_ids:
+            return
+        keys = [f"{cls.roles_prefix}:{user_id}" for user_id in user_ids]
+        # Dropped before commit, the entries could be refilled from the old rows.
+        transaction.on_commit(partial(cache.delete_many, keys))
+        store = request_store()
+        if store is not None:
+            for key in keys:
+                store.pop(key, None)
+
+    @staticmethod
+    def _user_role_ids(user_id):
+        UserRole = get_user_model().role.through
+        return UserRole.objects.filter(customuser_id=user_id).values("role_id")
+
+    @classmethod
+    def resolve_roles(cls, user_id):
+        return list(
+            Role.objects.filter(pk__in=cls._user_role_ids(user_id))
+            .order_by("pk")
+            .values_list("id", "name")
+        )
+
+    @staticmethod
+    def _get(prefix, user_id, resolver):
+        key = f"{prefix}:{user_id}"
+        store = request_store()
+        if store is not None and key in store:
+            return store[key]
+        value = cache.get(key)
+        if value is None:
+            value = resolver(user_id)
+            cache.set(key, value, api_settings.ROLE_CACHE_TIMEOUT)
+        if store is not None:
+            store[key] = value
+        return value
+
+
+class TierRoleTemplateCache:
+    """
+    Materialized role templates of a subscription tier: each template's role
+    fields plus the ids of its scopes, custom permissions, serializers and
+    user permissions, cached in the Django cache.
+    """
+
+    prefix = "api:tier-role-templates"
+    relations = (
+        ("scopes", "scope_id", "scope_ids"),
+        ("custom_permissions", "custompermission_id", "custom_permission_ids"),
+        ("serializers", "serializercollection_id", "serializer_ids"),
+        ("user_permissions", "permission_id", "permission_ids"),
+    )
+
+    @classmethod
+    def get(cls, tier_id):
+        key = f"{cls.prefix}:{tier_id}"
+        templates = cache.get(key)
+        if templates is None:
+            templates = cls.resolve(tier_id)
+            cache.set(key, templates, api_settings.TIER_CACHE_TIMEOUT)
+        return templates
+
+    @classmethod
+    def invalidate(cls, *tier_ids):
+        transaction.on_commit(partial(cache.delete_many, [f"{cls.prefix}:{tier_id}" for tier_id in tier_ids]))
+
+    @classmethod
+    def invalidate_templates(cls, *template_ids):
+        """Drop the entries of every tier granting one of the templates."""
+        cls.invalidate(*cls.tier_ids_of(template_ids))
+
+    @staticmethod
+    def tier_ids_of(template_ids):
+        TierTemplate = SubscriptionTier.role_templates.through
+        return set(
+            TierTemplate.objects.filter(roletemplate_id__in=list(template_ids)).values_list(
+                "subscriptiontier_id", flat=True
+            )
+        )
+
+    @classmethod
+    def resolve(cls, tier_id):
+        TierTemplate = SubscriptionTier.role_templates.through
+        template_ids = TierTemplate.objects.filter(subscriptiontier_id=tier_id).values("roletemplate_id")
+        templates = {
+            template["id"]: template
+            for template in RoleTemplate.objects.filter(pk__in=template_ids)
+            .order_by("pk")
+            .values("id", "name", "access_level", "description", "is_admin")
+        }
+        for relation, column, key in cls.relations:
+            for template in templates.values():
+                template[key] = []
+            through = getattr(RoleTemplate, relation).through
+            rows = through.objects.filter(roletemplate_id__in=list(templates)).values_list("roletemplate_id", column)
+            for template_id, related_id in rows:
+                templates[template_id][key].append(related_id)
+        return list(templates.values())
+
+
+class TierCatalogCache:
+    """
+    Pre-rendered JSON catalog of the active subscription tiers with their role
+    templates and payment plans, stored with its strong ETag in the Django cache.
+    api.signals invalidates it after commit on a tier or template change; writes
+    that send no signals (QuerySet.update()) show up once TIER_CATALOG_CACHE_TIMEOUT
+    expires the snapshot.
+    """
+
+    key = "api:tier-catalog"
+
+    @classmethod
+    def get(cls):
+        """Return (etag, body bytes)."""
+        snapshot = cache.get(cls.key)
+        if snapshot is None:
+            snapshot = cls.build()
+            cache.set(cls.key, snapshot, api_settings.TIER_CATALOG_CACHE_TIMEOUT)
+        return snapshot
+
+    @classmethod
+    def invalidate(cls):
+        # Dropped before commit, the catalog could be rebuilt from the old rows.
+        transaction.on_commit(partial(cache.delete, cls.key))
+
+    @staticmethod
+    def build():
+        tiers = list(
+            SubscriptionTier.objects.filter(is_active=True, is_deleted=False)
+            .order_by("id")
+            .values("id", "title", "description1", "description2", "description3", "price", "payment_plans")
+        )
+        TierTemplate = SubscriptionTier.role_templates.through
+        links = TierTemplate.objects.filter(subscriptiontier_id__in=[tier["id"] for tier in tiers]).values_list(
+            "subscriptiontier_id", "roletemplate_id"
+        )
+        template_ids = defaultdict(list)
+        for tier_id, template_id in links:
+            template_ids[tier_id].append(template_id)
+        templates = RoleTemplate.objects.in_bulk(
+            {template_id for ids in template_ids.values() for template_id in ids}
+        )
+        for tier in tiers:
+            tier["role_templates"] = [
+                {
+                    "id": template.pk,
+                    "name": template.name,
+                    "access_level": template.access_level,
+                    "description": template.description,
+                }
+                for template in sorted((templates[pk] for pk in template_ids[tier["id"]]), key=lambda t: t.pk)
+            ]
+
+        payload = json.dumps(tiers, cls=DjangoJSONEncoder, separators=(",", ":"), sort_keys=True)
+        version = hashlib.sha256(payload.encode()).hexdigest()[:32]
+        body = f'{{"version":"{version}","tiers":{payload}}}'.encode()
+        return f'"{version}"', body
+
+
+class MembershipCache:
+    """
+    A user's current membership: the newest (highest id) of their "active"
+    memberships, served by api_membershiptier_user_status_idx. Cached per user as
+    the row's field values in the Django cache, an empty dict meaning "none".
+    api.signals invalidates it after commit whenever a membership is saved or
+    deleted; QuerySet.update() callers must call invalidate() themselves.
+    """
+
+    prefix = "api:user-membership"
+
+    @staticmethod
+    def current_membership_queryset(user_id):
+        return MembershipTier.objects.filter(user_id=user_id, subscription_status="active").order_by("-id")
+
+    @classmethod
+    def get(cls, user):
+        """Return the user's current MembershipTier, with .user set to the given user, or None."""
+        key = f"{cls.prefix}:{user.pk}"
+        values = cache.get(key)
+        if values is None:
+            values = cls.dump(cls.current_membership_queryset(user.pk).first())
+            cache.set(key, values, api_settings.MEMBERSHIP_CACHE_TIMEOUT)
+        return cls.load(values, user)
+
+    @classmethod
+    async def aget(cls, user):
+        key = f"{cls.prefix}:{user.pk}"
+        values = await cache.aget(key)
+        if values is None:
+            values = cls.dump(await cls.current_membership_queryset(user.pk).afirst())
+            await cache.aset(key, values, api_settings.MEMBERSHIP_CACHE_TIMEOUT)
+        return cls.load(values, user)
+
+    @classmethod
+    def invalidate(cls, *user_ids):
+        transaction.on_commit(partial(cache.delete_many, [f"{cls.prefix}:{user_id}" for user_id in user_ids]))
+
+    @staticmethod
+    def dump(membership):
+        if membership is None:
+            return {}
+        return {field.attname: getattr(membership, field.attname) for field in MembershipTier._meta.concrete_fields}
+
+    @staticmethod
+    def load(values, user):
+        if not values:
+            return None
+        membership = MembershipTier.from_db(DEFAULT_DB_ALIAS, list(values), list(values.values()))
+        membership.user = user
+        return membership
+
+
+class OnboardingDefinition:
+    """
+    An onboarding with its steps ordered by (level, id), indexed by name and level,
+    and laid out for completion bitmaps: bit i of a bitmap stands for steps[i].
+    """
+
+    def __init__(self, onboarding, steps):
+        self.onboarding = onboarding
+        self.steps = steps
+        self.steps_by_name = {step.name: step for step in steps}
+        self.steps_by_level = defaultdict(list)
+        for step in steps:
+            step.onboarding = onboarding
+            self.steps_by_level[step.level].append(step)
+        self.required_count = sum(1 for step in steps if not step.optional)
+
+        self.step_bits = {step.pk: 1 << index for index, step in enumerate(steps)}
+        self.required_mask = sum(self.step_bits[step.pk] for step in steps if not step.optional)
+        # (level, mask of its steps, mask of its required steps) in ascending level order
+        self.levels = [
+            (
+                level,
+                sum(self.step_bits[step.pk] for step in level_steps),
+                sum(self.step_bits[step.pk] for step in level_steps if not step.optional),
+            )
+            for level, level_steps in sorted(self.steps_by_level.items())
+        ]
+
+    def steps_of(self, bitmap):
+        steps = []
+        while bitmap:
+            lowest = bitmap & -bitmap
+            steps.append(self.steps[lowest.bit_length() - 1])
+            bitmap ^= lowest
+        return steps
+
+    def next_steps(self, done):
+        """
+        Where a user whose completed steps are the bits of `done` stands. Levels
+        unlock in order: every level up to the first one with required steps left
+        is open, optional steps never hold a level back. Returns current_level
+        (that first level, None once all required steps are done), next_steps
+        (open required steps left), optional_steps (open optional steps left) and
+        remaining_required (required steps left at any level).
+        """
+        unlocked = 0
+        current_level = None
+        for level, level_mask, required_mask in self.levels:
+            unlocked |= level_mask
+            if done & required_mask != required_mask:
+                current_level = level
+                break
+        pending = unlocked & ~done
+        return {
+            "current_level": current_level,
+            "next_steps": self.steps_of(pending & self.required_mask),
+            "optional_steps": self.steps_of(pending & ~self.required_mask),
+            "remaining_required": (self.required_mask & ~done).bit_count(),
+        }
+
+    def get_step(self, step_name):
+        try:
+            return self.steps_by_name[step_name]
+        except KeyError:
+            raise OnboardingStep.DoesNotExist(f"Onboarding step '{step_name}' not found.") from None
+
+
+class OnboardingDefinitionCache:
+    """
+    In-process cache of OnboardingDefinition by (tenant alias, onboarding name).
+    Each entry is tagged with a version kept in the Django cache; invalidate()
+    drops this process's entries at once and bumps the version when the
+    transaction commits, so other processes reload on their next get. Entries
+    also expire after ONBOARDING_CACHE_TIMEOUT seconds, which bounds staleness
+    after writes that do not invalidate (QuerySet.update()).
+    """
+
+    version_key = "api:onboarding-definitions:version"
+    _definitions = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, onboarding_name):
+        key = (active_tenant_database() or DEFAULT_DB_ALIAS, onboarding_name)
+        # Read the version before the rows, so a bump in between leaves the entry stale.
+        version = cache.get(cls.version_key)
+        entry = cls._definitions.get(key)
+        if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+            return entry[2]
+        onboarding = Onboarding.objects.get(name=onboarding_name)
+        steps = list(OnboardingStep.objects.filter(onboarding=onboarding).order_by("level", "id"))
+        definition = OnboardingDefinition(onboarding, steps)
+        with cls._lock:
+            cls._definitions[key] = (
+                time.monotonic() + api_settings.ONBOARDING_CACHE_TIMEOUT,
+                version,
+                definition,
+            )
+        return definition
+
+    @classmethod
+    def invalidate(cls, onboarding=None):
+        """
+        Drop the entries of one onboarding, or every entry when onboarding is None,
+        in this process now and in every process once the transaction commits.
+        """
+        with cls._lock:
+            if onboarding is None:
+                cls._definitions.clear()
+            else:
+                alias = onboarding._state.db if onboarding._state.db in tenant_databases() else DEFAULT_DB_ALIAS
+                for key, (_, _, definition) in list(cls._definitions.items()):
+                    if key == (alias, onboarding.name) or (
+                        key[0] == alias and definition.onboarding.pk == onboarding.pk
+                    ):
+                        del cls._definitions[key]
+        transaction.on_commit(partial(cache.set, cls.version_key, uuid.uuid4().hex, None))
+
+
+class LRUCache:
+    """Thread-safe in-process cache holding at most max_size entries, each expiring after its timeout."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete_where(self, predicate):
+        """Drop every entry whose value matches predicate(value)."""
+        with self._lock:
+            for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CredentialCache:
+    """
+    Verified API keys and tokens, keyed by an HMAC-SHA256 digest of the presented
+    credential, so a hit needs neither the password hasher nor the database.
+    Entries live in an in-process LRU for CREDENTIAL_LOCAL_CACHE_TIMEOUT seconds,
+    which bounds revocation lag in other processes. With CREDENTIAL_SHARED_CACHE
+    they are also kept in the Django cache for CREDENTIAL_CACHE_TIMEOUT seconds.
+    Each entry lists tags ("api-key:<id>", "organization:<id>", "user:<id>") that
+    invalidate() drops once the current transaction commits: shared entries record
+    the version of each tag when they were stored, and invalidate() replaces the
+    versions. api.signals calls it on revoke and delete; QuerySet.update() callers
+    must call it themselves. Invalid credentials are only cached locally, in a
+    separate CREDENTIAL_NEGATIVE_CACHE_SIZE LRU, so guessing cannot evict valid
+    entries.
+    """
+
+    prefix = "api:credential"
+    _local = LRUCache(api_settings.CREDENTIAL_LOCAL_CACHE_SIZE)
+    _negative = LRUCache(api_settings.CREDENTIAL_NEGATIVE_CACHE_SIZE)
+
+    @staticmethod
+    def digest(kind, credential):
+        return hmac.new(
+            settings.SECRET_KEY.encode(), f"{kind}:{credential}".encode(), hashlib.sha256
+        ).hexdigest()
+
+    @classmethod
+    def get_or_verify(cls, kind, credential, verify):
+        """
+        Return the cached entry of a credential, or None when it is invalid. On a
+        miss verify(credential) is called and must return (entry dict with a "tags"
+        list, timeout or None) or None.
+        """
+        digest = cls.digest(kind, credential)
+        entry = cls._local.get(digest)
+        if entry is not None:
+            return entry
+        if cls._negative.get(digest, False):
+            return None
+
+        local_timeout = api_settings.CREDENTIAL_LOCAL_CACHE_TIMEOUT
+        if api_settings.CREDENTIAL_SHARED_CACHE:
+            stored = cache.get(f"{cls.prefix}:{digest}")
+            if stored is not None and cls.tag_versions(stored["versions"]) == stored["versions"]:
+                cls._local.set(digest, stored["entry"], local_timeout)
+                return stored["entry"]
+
+        verified = verify(credential)
+        if verified is None:
+            cls._negative.set(digest, True, local_timeout)
+            return None
+        entry, timeout = verified
+        cls._local.set(digest, entry, min(local_timeout, timeout or local_timeout))
+        if api_settings.CREDENTIAL_SHARED_CACHE:
+            shared_timeout = min(api_settings.CREDENTIAL_CACHE_TIMEOUT, timeout or api_settings.CREDENTIAL_CACHE_TIMEOUT)
+            versions = cls.tag_versions(entry["tags"], create=True)
+            cache.set(f"{cls.prefix}:{digest}", {"entry": entry, "versions": versions}, shared_timeout)
+        return entry
+
+    @classmethod
+    def tag_versions(cls, tags, create=False):
+        """Current version of each tag, None if it has none; create=True gives them one."""
+        keys = {f"{cls.prefix}-tag:{tag}": tag for tag in tags}
+        if create:
+            for key in keys:
+                cache.add(key, uuid.uuid4().hex, None)
+        found = cache.get_many(list(keys))
+        return {tag: found.get(key) for key, tag in keys.items()}
+
+    @classmethod
+    def invalidate(cls, *tags):
+        transaction.on_commit(partial(cls._invalidate, set(tags)))
+
+    @classmethod
+    def _invalidate(cls, tags):
+        cls._local.delete_where(lambda entry: not tags.isdisjoint(entry["tags"]))
+        cls._negative.clear()
+        if api_settings.CREDENTIAL_SHARED_CACHE:
+            cache.set_many({f"{cls.prefix}-tag:{tag}": uuid.uuid4().hex for tag in tags}, None)
+
+    @classmethod
+    def clear_local(cls):
+        cls._local.clear()
+        cls._negative.clear()
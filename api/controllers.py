@@ -1,10 +1,912 @@
-from accounts.controllers import MembershipController, RoleController
-from accounts.models import MembershipTier, SubscriptionTier, RoleTemplate
+import hashlib
+import json
+from collections import defaultdict
+from functools import partial
+from itertools import islice
+
+from accounts.controllers import MembershipController, RoleController, OnboardingController
+from accounts.models import (
+    MembershipTier, SubscriptionTier, RoleTemplate, Role, Organization, Branch, CompletedOnboardingStep,
+    Onboarding, OnboardingStep,
+)
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .api_settings import api_settings
+from .cache import (
+    CredentialCache, MembershipCache, OnboardingDefinitionCache, RoleCache, TierCatalogCache, TierRoleTemplateCache,
+)
+from .db import CrossTenantError, retry_on_locked, tenant_database_for, using_tenant
+from .endpoint_index import endpoint_index
+from .events import change_event, record_changes
+from .models import OnboardingProgress, RoleSignature
+from .parsers import json_loads
+from .renderers import json_bytes
+
+
+def m2m_columns(model, relation):
+    """Return (through model, owner id column, related id column) of a many-to-many field."""
+    descriptor = getattr(model, relation)
+    field = descriptor.field
+    return descriptor.through, field.m2m_field_name() + "_id", field.m2m_reverse_field_name() + "_id"
+
+
+class CustomRoleController(RoleController):
+    # (Role relation, RoleTemplate relation it is copied from, key of its ids in TierRoleTemplateCache entries)
+    template_relations = (
+        ("scopes", "scopes", "scope_ids"),
+        ("custom_permissions", "custom_permissions", "custom_permission_ids"),
+        ("serializers", "serializers", "serializer_ids"),
+        ("permissions", "user_permissions", "permission_ids"),
+    )
+    template_fields = ("access_level", "description", "is_admin")
+
+    @retry_on_locked
+    def update_user_roles(self, user, roles):
+        result = super().update_user_roles(user, roles)
+        RoleCache.invalidate(user.pk)
+        record_changes([change_event("user_roles", user.pk, "updated", role_ids=[role.pk for role in roles])])
+        return result
+
+    def get_or_create_role(self, *args, **kwargs):
+        role = super().get_or_create_role(*args, **kwargs)
+        self.save_role_signatures([role])
+        return role
+
+    def create_role_base_on_template(self, template, **kwargs):
+        role = super().create_role_base_on_template(template=template, **kwargs)
+        self.save_role_signatures([role], template_ids={role.pk: template.pk})
+        record_changes([change_event("role", role.pk, "created", template_id=template.pk)])
+        return role
+
+    def update_role_base_on_template(self, role, template, **kwargs):
+        role = super().update_role_base_on_template(role=role, template=template, **kwargs)
+        self.save_role_signatures([role], template_ids={role.pk: template.pk})
+        self.invalidate_role_holders([role.pk])
+        record_changes([change_event("role", role.pk, "updated", template_id=template.pk)])
+        return role
+
+    @staticmethod
+    def role_signature(name, access_level, organization_ids, branch_ids):
+        canonical = json.dumps([name, access_level, sorted(set(organization_ids)), sorted(set(branch_ids))])
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def find_role(self, name, access_level, organization_ids, branch_ids):
+        """
+        Return the role with exactly these attributes and organization/branch sets,
+        or None. api.signals re-signs roles changed elsewhere once that commits;
+        roles without a signature (created before RoleSignature) are found by
+        get_role() and get their signature written then.
+        """
+        signature = self.role_signature(name, access_level, organization_ids, branch_ids)
+        match = RoleSignature.objects.select_related("role").filter(signature=signature).first()
+        if match:
+            return match.role
+        if not Role.objects.filter(name=name).exists():
+            return None
+        role = self.get_role(
+            name=name,
+            access_level=access_level,
+            organizations=Organization.objects.filter(pk__in=organization_ids),
+            branches=Branch.objects.filter(pk__in=branch_ids),
+        )
+        if role is not None:
+            self.save_role_signatures([role])
+        return role
+
+    @classmethod
+    def save_role_signatures(cls, roles, template_ids=None):
+        """
+        Recompute and upsert the RoleSignature of each role from its current
+        organization/branch links. template_ids maps role pk -> template pk for
+        roles whose source template is known; other roles keep theirs.
+        """
+        template_ids = template_ids or {}
+        role_ids = [role.pk for role in roles]
+        organizations = defaultdict(list)
+        for role_id, org_id in Role.organizations.through.objects.filter(role_id__in=role_ids).values_list(
+            "role_id", "organization_id"
+        ):
+            organizations[role_id].append(org_id)
+        branches = defaultdict(list)
+        for role_id, branch_id in Role.branches.through.objects.filter(role_id__in=role_ids).values_list(
+            "role_id", "branch_id"
+        ):
+            branches[role_id].append(branch_id)
+
+        with_template, without_template = [], []
+        for role in roles:
+            signature = RoleSignature(
+                role_id=role.pk,
+                template_id=template_ids.get(role.pk),
+                signature=cls.role_signature(role.name, role.access_level, organizations[role.pk], branches[role.pk]),
+            )
+            (with_template if role.pk in template_ids else without_template).append(signature)
+
+        for rows, update_fields in ((with_template, ["signature", "template"]), (without_template, ["signature"])):
+            RoleSignature.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=["role"], update_fields=update_fields
+            )
+
+    @classmethod
+    @retry_on_locked
+    def resign_roles(cls, role_ids):
+        """Recompute the signatures of roles saved or relinked outside this controller (see api.signals)."""
+        cls.save_role_signatures(list(Role.objects.filter(pk__in=role_ids)))
+
+    @retry_on_locked
+    def bulk_assign_roles(self, assignments):
+        """
+        Assign many roles in one transaction. Each assignment is a dict with
+        user_id, role_name, access_level and optional organization_ids/branch_ids.
+        Like get_or_create_role(), a role matches on its name, access level and
+        exact organization/branch sets; missing roles are created, unless another
+        role already holds the name. Returns one result dict per assignment, in order.
+        """
+        User = get_user_model()
+        UserRole = User.role.through
+        RoleOrganization = Role.organizations.through
+        RoleBranch = Role.branches.through
+
+        def role_key(item):
+            return (
+                item.get("role_name"),
+                item.get("access_level"),
+                frozenset(item.get("organization_ids") or []),
+                frozenset(item.get("branch_ids") or []),
+            )
+
+        user_ids = {item.get("user_id") for item in assignments}
+        org_ids = {org_id for item in assignments for org_id in item.get("organization_ids") or []}
+        branch_ids = {branch_id for item in assignments for branch_id in item.get("branch_ids") or []}
+        role_names = {item.get("role_name") for item in assignments}
+
+        known_users = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+        known_orgs = set(Organization.objects.filter(pk__in=org_ids).values_list("pk", flat=True))
+        known_branches = set(Branch.objects.filter(pk__in=branch_ids).values_list("pk", flat=True))
+        named_roles = {role.pk: role for role in Role.objects.filter(name__in=role_names)}
+        role_orgs = defaultdict(set)
+        for role_id, org_id in RoleOrganization.objects.filter(role_id__in=named_roles).values_list(
+            "role_id", "organization_id"
+        ):
+            role_orgs[role_id].add(org_id)
+        role_branches = defaultdict(set)
+        for role_id, branch_id in RoleBranch.objects.filter(role_id__in=named_roles).values_list(
+            "role_id", "branch_id"
+        ):
+            role_branches[role_id].add(branch_id)
+        roles = {
+            (role.name, role.access_level, frozenset(role_orgs[role.pk]), frozenset(role_branches[role.pk])): role
+            for role in named_roles.values()
+        }
+        taken_names = {role.name for role in named_roles.values()}
+
+        results = []
+        accepted = []
+        new_roles = {}
+        for index, item in enumerate(assignments):
+            role_name = item.get("role_name")
+            key = role_key(item)
+            error = None
+            if not role_name or not item.get("access_level"):
+                error = "role_name and access_level are required."
+            elif item.get("user_id") not in known_users:
+                error = "User not found."
+            elif not known_orgs.issuperset(item.get("organization_ids") or []):
+                error = "Organization not found."
+            elif not known_branches.issuperset(item.get("branch_ids") or []):
+                error = "Branch not found."
+            elif key not in roles and role_name in taken_names:
+                error = f"Role '{role_name}' exists with another access level, organizations or branches."
+            elif key not in roles and new_roles.setdefault(role_name, key) != key:
+                error = f"Role '{role_name}' requested with conflicting access levels, organizations or branches."
+            if error:
+                results.append({"index": index, "user_id": item.get("user_id"), "status": "error", "error": error})
+            else:
+                results.append(None)
+                accepted.append((index, item))
+
+        with transaction.atomic():
+            role_links, branch_links = [], []
+            for role_name, key in new_roles.items():
+                _, access_level, organization_ids, branch_ids = key
+                role = roles[key] = Role.objects.create(name=role_name, access_level=access_level)
+                role_links.extend(RoleOrganization(role_id=role.pk, organization_id=pk) for pk in organization_ids)
+                branch_links.extend(RoleBranch(role_id=role.pk, branch_id=pk) for pk in branch_ids)
+            RoleOrganization.objects.bulk_create(role_links)
+            RoleBranch.objects.bulk_create(branch_links)
+
+            user_roles = []
+            for index, item in accepted:
+                role = roles[role_key(item)]
+                user_roles.append(UserRole(customuser_id=item["user_id"], role_id=role.pk))
+                results[index] = {
+                    "index": index,
+                    "user_id": item["user_id"],
+                    "status": "assigned",
+                    "role_id": role.pk,
+                    "role_name": role.name,
+                }
+
+            UserRole.objects.bulk_create(user_roles, ignore_conflicts=True)
+            self.save_role_signatures([roles[key] for key in new_roles.values()])
+            record_changes(
+                change_event("user_roles", item["user_id"], "assigned", role_ids=[roles[role_key(item)].pk])
+                for _, item in accepted
+            )
+
+        RoleCache.invalidate(*{item["user_id"] for _, item in accepted})
+        # Bulk-inserted organization links skip m2m_changed (see api.signals).
+        linked_orgs = {link.organization_id for link in role_links}
+        if linked_orgs:
+            CredentialCache.invalidate(*(f"organization:{org_id}" for org_id in linked_orgs))
+        return results
+
+    @staticmethod
+    def bulk_create_roles(specs):
+        """
+        Create roles from dicts of Role field values, skipping names already taken
+        by a group or role; returns the created roles in spec order. Django cannot
+        bulk_create multi-table models, so the auth_group rows go in one INSERT and
+        each accounts_role row is saved raw, without re-saving its parent.
+        """
+        taken = set(Group.objects.filter(name__in=[spec["name"] for spec in specs]).values_list("name", flat=True))
+        specs = [spec for spec in specs if spec["name"] not in taken]
+        groups = Group.objects.bulk_create([Group(name=spec["name"]) for spec in specs])
+        roles = []
+        for group, spec in zip(groups, specs):
+            role = Role(group_ptr=group, **spec)
+            role.save_base(raw=True, force_insert=True)
+            roles.append(role)
+        return roles
+
+    @classmethod
+    def link_template_relations(cls, pairs):
+        """Bulk-insert the template's related ids for each (role, template entry) pair."""
+        for relation, _, key in cls.template_relations:
+            through, source, target = m2m_columns(Role, relation)
+            through.objects.bulk_create(
+                [
+                    through(**{source: role.pk, target: related_id})
+                    for role, template in pairs
+                    for related_id in template[key]
+                ],
+                ignore_conflicts=True,
+            )
+
+    @retry_on_locked
+    def create_roles_from_templates(self, templates, role_names):
+        """
+        Bulk counterpart of create_role_base_on_template() for TierRoleTemplateCache
+        entries: each new role gets the template's template_fields and relations,
+        its signature and a "created" change event, i.e. exactly what
+        apply_template_diff() keeps in sync. Roles that already exist under the
+        given name are reused; names held by a plain group are skipped. Returns the
+        roles in template order.
+        """
+        existing = {role.name: role for role in Role.objects.filter(name__in=role_names)}
+        missing = {name: template for template, name in zip(templates, role_names) if name not in existing}
+
+        with transaction.atomic():
+            created = self.bulk_create_roles([
+                {"name": name, **{field: template[field] for field in self.template_fields}}
+                for name, template in missing.items()
+            ])
+            pairs = [(role, missing[role.name]) for role in created]
+            self.link_template_relations(pairs)
+            self.save_role_signatures(created, template_ids={role.pk: template["id"] for role, template in pairs})
+            record_changes(
+                change_event("role", role.pk, "created", template_id=template["id"]) for role, template in pairs
+            )
+
+        roles = {**existing, **{role.name: role for role in created}}
+        return [roles[name] for name in role_names if name in roles]
+
+    @staticmethod
+    def _apply_link_diff(through, source, target, owner_id, current_ids, desired_ids):
+        """Insert/delete only the links that differ; returns (added, removed) counts."""
+        added = set(desired_ids) - set(current_ids)
+        removed = set(current_ids) - set(desired_ids)
+        if added:
+            through.objects.bulk_create(
+                [through(**{source: owner_id, target: related_id}) for related_id in added], ignore_conflicts=True
+            )
+        if removed:
+            through.objects.filter(**{source: owner_id, f"{target}__in": removed}).delete()
+        return len(added), len(removed)
+
+    @retry_on_locked
+    def apply_template_diff(self, role, template, role_name=None, organizations=None, branches=None):
+        """
+        Bring a role in line with its template by writing only what changed:
+        role fields, template relations (each diffed in one query) and, when given,
+        the organization/branch links. Returns {name: {"added": n, "removed": n}}
+        for changed relations; caches are left alone when nothing changed.
+        """
+        changes = {}
+        changed_fields = [field for field in self.template_fields if getattr(role, field) != getattr(template, field)]
+        if role_name and role.name != role_name:
+            changed_fields.append("name")
+            role.name = role_name
+        for field in changed_fields:
+            if field != "name":
+                setattr(role, field, getattr(template, field))
+
+        with transaction.atomic():
+            if changed_fields:
+                role.save(update_fields=changed_fields)
+
+            for relation, template_relation, _ in self.template_relations:
+                through, source, target = m2m_columns(Role, relation)
+                template_through, template_source, template_target = m2m_columns(RoleTemplate, template_relation)
+                # 0 = linked to the template, 1 = linked to the role
+                rows = template_through.objects.filter(**{template_source: template.pk}).annotate(
+                    side=Value(0)
+                ).values_list("side", template_target).union(
+                    through.objects.filter(**{source: role.pk}).annotate(side=Value(1)).values_list("side", target),
+                    all=True,
+                )
+                desired, current = set(), set()
+                for side, related_id in rows:
+                    (current if side else desired).add(related_id)
+                added, removed = self._apply_link_diff(through, source, target, role.pk, current, desired)
+                if added or removed:
+                    changes[relation] = {"added": added, "removed": removed}
+
+            for relation, related in (("organizations", organizations), ("branches", branches)):
+                if related is None:
+                    continue
+                through, source, target = m2m_columns(Role, relation)
+                current = through.objects.filter(**{source: role.pk}).values_list(target, flat=True)
+                added, removed = self._apply_link_diff(
+                    through, source, target, role.pk, list(current), [obj.pk for obj in related]
+                )
+                if added or removed:
+                    changes[relation] = {"added": added, "removed": removed}
+
+            if changed_fields or "organizations" in changes or "branches" in changes:
+                self.save_role_signatures([role], template_ids={role.pk: template.pk})
+
+        if changed_fields:
+            changes["fields"] = changed_fields
+        if changes:
+            self.invalidate_role_holders([role.pk])
+            record_changes([change_event("role", role.pk, "updated", template_id=template.pk)])
+        return changes
+
+    @staticmethod
+    def user_organization_ids(user):
+        """Ids of the organizations linked to the user's roles."""
+        through, source, target = m2m_columns(Role, "organizations")
+        role_ids = [role_id for role_id, _ in RoleCache.get_roles(user)]
+        return list(through.objects.filter(**{f"{source}__in": role_ids}).values_list(target, flat=True).distinct())
+
+    @staticmethod
+    async def auser_organization_ids(user):
+        """Async user_organization_ids() for ASGI views."""
+        through, source, target = m2m_columns(Role, "organizations")
+        role_ids = [role_id for role_id, _ in await RoleCache.aget_roles(user)]
+        return [
+            organization_id
+            async for organization_id in through.objects.filter(**{f"{source}__in": role_ids})
+            .values_list(target, flat=True)
+            .distinct()
+        ]
+
+    @staticmethod
+    def invalidate_role_holders(role_ids):
+        transaction.on_commit(partial(endpoint_index.forget_roles, list(role_ids)))
+        UserRole = get_user_model().role.through
+        RoleCache.invalidate(
+            *UserRole.objects.filter(role_id__in=role_ids).values_list("customuser_id", flat=True).distinct()
+        )
+
+    def resync_roles_from_template(self, template, chunk_size=500):
+        """
+        Re-apply a template to every role derived from it (RoleSignature.template),
+        writing only per-role deltas in bulk, one transaction per chunk of roles.
+        Returns {"roles": total, "changed": number of roles that changed}.
+        """
+        TierRoleTemplateCache.invalidate_templates(template.pk)
+
+        desired = {}
+        for relation, template_relation, _ in self.template_relations:
+            template_through, template_source, template_target = m2m_columns(RoleTemplate, template_relation)
+            desired[relation] = set(
+                template_through.objects.filter(**{template_source: template.pk}).values_list(
+                    template_target, flat=True
+                )
+            )
+        field_values = {field: getattr(template, field) for field in self.template_fields}
+        field_mismatch = Q()
+        for field, value in field_values.items():
+            field_mismatch |= ~Q(**{field: value})
+
+        role_ids = list(
+            RoleSignature.objects.filter(template=template).order_by("role_id").values_list("role_id", flat=True)
+        )
+        changed_total = 0
+        for start in range(0, len(role_ids), chunk_size):
+            chunk = role_ids[start:start + chunk_size]
+            changed = set()
+            with transaction.atomic():
+                stale_fields = list(Role.objects.filter(field_mismatch, pk__in=chunk).values_list("pk", flat=True))
+                if stale_fields:
+                    Role.objects.filter(pk__in=stale_fields).update(**field_values)
+                    changed.update(stale_fields)
+
+                for relation, related_ids in desired.items():
+                    through, source, target = m2m_columns(Role, relation)
+                    current = defaultdict(set)
+                    link_ids = {}
+                    for link_id, role_id, related_id in through.objects.filter(
+                        **{f"{source}__in": chunk}
+                    ).values_list("pk", source, target):
+                        current[role_id].add(related_id)
+                        link_ids[(role_id, related_id)] = link_id
+                    additions = [
+                        through(**{source: role_id, target: related_id})
+                        for role_id in chunk
+                        for related_id in related_ids - current[role_id]
+                    ]
+                    removals = [
+                        link_ids[(role_id, related_id)]
+                        for role_id in chunk
+                        for related_id in current[role_id] - related_ids
+                    ]
+                    through.objects.bulk_create(additions, ignore_conflicts=True)
+                    if removals:
+                        through.objects.filter(pk__in=removals).delete()
+                    changed.update(getattr(link, source) for link in additions)
+                    changed.update(role_id for role_id in chunk if current[role_id] - related_ids)
+
+                if stale_fields:
+                    self.save_role_signatures(
+                        list(Role.objects.filter(pk__in=stale_fields).only("pk", "name", "access_level"))
+                    )
+
+            if changed:
+                self.invalidate_role_holders(changed)
+                record_changes(change_event("role", role_id, "updated", template_id=template.pk) for role_id in changed)
+            changed_total += len(changed)
+        return {"roles": len(role_ids), "changed": changed_total}
+
+
+class CustomOnboardingController(OnboardingController):
+    completed_step_fields = ("id", "date_completed", "step_status", "user", "onboarding_step")
+
+    def get_onboarding(self, onboarding_name):
+        return OnboardingDefinitionCache.get(onboarding_name).onboarding
+
+    def get_onboarding_step_by_name(self, onboarding, step_name):
+        return OnboardingDefinitionCache.get(onboarding.name).get_step(step_name)
+
+    @retry_on_locked
+    def create_onboarding_step(self, onboarding, step_name, description, level, optional):
+        step = super().create_onboarding_step(
+            onboarding=onboarding,
+            step_name=step_name,
+            description=description,
+            level=level,
+            optional=optional,
+        )
+        OnboardingDefinitionCache.invalidate(onboarding)
+        OnboardingProgress.objects.filter(onboarding=onboarding).update(
+            total_steps=F("total_steps") + 1,
+            required_remaining=F("required_remaining") + (0 if step.optional else 1),
+        )
+        return step
+
+    def get_or_create_shared_step(self, onboarding, step_name, description="", level=1, optional=False):
+        """Return the onboarding's step named step_name, creating it only the first time."""
+        try:
+            return OnboardingDefinitionCache.get(onboarding.name).get_step(step_name)
+        except OnboardingStep.DoesNotExist:
+            return self.create_onboarding_step(
+                onboarding=onboarding,
+                step_name=step_name,
+                description=description,
+                level=level,
+                optional=optional,
+            )
+
+    signup_onboarding_name = "Default Onboarding"
+    verify_email_step = {
+        "step_name": "Verify Email",
+        "description": "Please verify your email to activate your account.",
+        "level": 1,
+        "optional": False,
+    }
+
+    @retry_on_locked
+    def start_signup_onboarding(self, user):
+        """Record a new user's pending "Verify Email" step (shared by every user) and return that step."""
+        onboarding = self.get_onboarding(self.signup_onboarding_name)
+        step = self.get_or_create_shared_step(onboarding=onboarding, **self.verify_email_step)
+        self.set_completed_steps(user, [step], status="pending")
+        return step
+
+    def confirm_signup_email(self, user):
+        """Mark the user's "Verify Email" step done; a no-op where signup onboarding is not set up."""
+        try:
+            definition = OnboardingDefinitionCache.get(self.signup_onboarding_name)
+            step = definition.get_step(self.verify_email_step["step_name"])
+        except (Onboarding.DoesNotExist, OnboardingStep.DoesNotExist):
+            return
+        self.set_completed_steps(user, [step], status="done")
+
+    def set_completed_step(self, user, onboarding_step, status="done"):
+        completed_step, _ = self.set_completed_steps(user, [onboarding_step], status)[0]
+        return completed_step
+
+    @retry_on_locked
+    def set_completed_steps(self, user, onboarding_steps, status="done"):
+        """
+        Idempotently record completions of the given steps for a user with a single
+        INSERT ... ON CONFLICT (user, onboarding_step) DO UPDATE.
+        Returns [(completed_step, created), ...], one per distinct step in input order.
+        """
+        steps = list({step.pk: step for step in onboarding_steps}.values())
+        existing = dict(
+            CompletedOnboardingStep.objects.filter(
+                user=user, onboarding_step_id__in=[step.pk for step in steps]
+            ).values_list("onboarding_step_id", "step_status")
+        )
+        now = timezone.now()
+        completed_steps = [
+            CompletedOnboardingStep(user=user, onboarding_step=step, step_status=status, date_completed=now)
+            for step in steps
+        ]
+        with transaction.atomic(using=router.db_for_write(CompletedOnboardingStep)):
+            CompletedOnboardingStep.objects.bulk_create(
+                completed_steps,
+                update_conflicts=True,
+                unique_fields=["user", "onboarding_step"],
+                update_fields=["step_status", "date_completed"],
+            )
+            self.apply_progress_changes(user, steps, existing, status)
+            step_ids = defaultdict(list)
+            for step in steps:
+                step_ids[step.onboarding_id].append(step.pk)
+            record_changes(
+                (
+                    change_event(
+                        "onboarding_progress", f"{user.pk}:{onboarding_id}", status,
+                        user_id=user.pk, onboarding_id=onboarding_id, step_ids=ids,
+                    )
+                    for onboarding_id, ids in step_ids.items()
+                )
+            )
+        return [
+            (completed_step, completed_step.onboarding_step_id not in existing)
+            for completed_step in completed_steps
+        ]
+
+    def apply_progress_changes(self, user, steps, previous_statuses, status):
+        """Adjust the user's OnboardingProgress rows for steps whose "done" state changed."""
+        done = status == "done"
+        changed = defaultdict(list)
+        for step in steps:
+            if (previous_statuses.get(step.pk) == "done") != done:
+                changed[step.onboarding_id].append(step)
+
+        for onboarding_id, onboarding_steps in changed.items():
+            sign = 1 if done else -1
+            required = sum(1 for step in onboarding_steps if not step.optional)
+            # Counters are unsigned; clamp them should they have drifted.
+            updates = {
+                "completed_count": Greatest(F("completed_count") + sign * len(onboarding_steps), 0),
+                "required_remaining": Greatest(F("required_remaining") - sign * required, 0),
+            }
+            if done:
+                updates["current_level"] = Greatest(F("current_level"), max(step.level for step in onboarding_steps))
+            else:
+                # The highest level still done, read after this transaction's upsert.
+                updates["current_level"] = Coalesce(
+                    Subquery(
+                        CompletedOnboardingStep.objects.filter(
+                            user_id=OuterRef("user_id"),
+                            onboarding_step__onboarding_id=onboarding_id,
+                            step_status="done",
+                        )
+                        .order_by("-onboarding_step__level")
+                        .values("onboarding_step__level")[:1]
+                    ),
+                    0,
+                )
+            if not OnboardingProgress.objects.filter(user=user, onboarding_id=onboarding_id).update(**updates):
+                self.rebuild_progress(onboarding_steps[0].onboarding, user_ids=[user.pk])
+
+    def get_progress(self, user, onboarding_name):
+        """Return the user's OnboardingProgress, unsaved and empty if nothing is recorded yet."""
+        definition = OnboardingDefinitionCache.get(onboarding_name)
+        progress = OnboardingProgress.objects.filter(user=user, onboarding=definition.onboarding).first()
+        if progress is None:
+            progress = OnboardingProgress(
+                user=user,
+                onboarding=definition.onboarding,
+                required_remaining=definition.required_count,
+                total_steps=len(definition.steps),
+            )
+        return progress
+
+    @staticmethod
+    def completion_bitmaps(definition, user_ids):
+        """
+        {user id: bitmap of the definition's steps the user has done}, with one
+        query per NEXT_STEPS_CHUNK_SIZE users.
+        """
+        bitmaps = dict.fromkeys(user_ids, 0)
+        step_bits = definition.step_bits
+        for chunk in batched(bitmaps, api_settings.NEXT_STEPS_CHUNK_SIZE):
+            for user_id, step_id in CompletedOnboardingStep.objects.filter(
+                user_id__in=chunk, onboarding_step_id__in=list(step_bits), step_status="done"
+            ).values_list("user_id", "onboarding_step_id"):
+                bitmaps[user_id] |= step_bits[step_id]
+        return bitmaps
+
+    def get_next_steps(self, onboarding_name, user_ids):
+        """
+        {user id: OnboardingDefinition.next_steps()} for each user, from the cached
+        step layout and the users' completion bitmaps. Users with the same bitmap
+        share one result.
+        """
+        definition = OnboardingDefinitionCache.get(onboarding_name)
+        by_bitmap = {}
+        results = {}
+        for user_id, done in self.completion_bitmaps(definition, user_ids).items():
+            if done not in by_bitmap:
+                by_bitmap[done] = definition.next_steps(done)
+            results[user_id] = by_bitmap[done]
+        return results
+
+    async def aget_progress(self, user, onboarding_name):
+        """Async get_progress() for ASGI views."""
+        definition = await sync_to_async(OnboardingDefinitionCache.get)(onboarding_name)
+        progress = await OnboardingProgress.objects.filter(user=user, onboarding=definition.onboarding).afirst()
+        if progress is None:
+            progress = OnboardingProgress(
+                user=user,
+                onboarding=definition.onboarding,
+                required_remaining=definition.required_count,
+                total_steps=len(definition.steps),
+            )
+        return progress
+
+    @staticmethod
+    def rebuild_progress(onboarding, user_ids=None, batch_size=1000):
+        """
+        Recompute OnboardingProgress rows of an onboarding from its "done" completions,
+        for the given users or for everyone. Returns the number of rows written.
+        """
+        definition = OnboardingDefinitionCache.get(onboarding.name)
+        total_steps = len(definition.steps)
+        step_ids = [step.pk for step in definition.steps]
+        totals = (
+            CompletedOnboardingStep.objects.filter(onboarding_step_id__in=step_ids, step_status="done")
+            .values("user_id")
+            .annotate(
+                completed=Count("id"),
+                required_done=Count("id", filter=Q(onboarding_step__optional=False)),
+                level=Max("onboarding_step__level"),
+            )
+            .order_by()
+        )
+        progress = OnboardingProgress.objects.filter(onboarding=onboarding)
+        if user_ids is not None:
+            totals = totals.filter(user_id__in=user_ids)
+            progress = progress.filter(user_id__in=user_ids)
+
+        def to_progress(user_id, completed=0, required_done=0, level=0):
+            return OnboardingProgress(
+                user_id=user_id,
+                onboarding=onboarding,
+                completed_count=completed,
+                required_remaining=max(definition.required_count - required_done, 0),
+                total_steps=total_steps,
+                current_level=level or 0,
+            )
+
+        def upsert(rows):
+            OnboardingProgress.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["user", "onboarding"],
+                update_fields=["completed_count", "required_remaining", "total_steps", "current_level", "updated_at"],
+            )
+
+        written = 0
+        with transaction.atomic(using=router.db_for_write(OnboardingProgress)):
+            progress.update(
+                completed_count=0,
+                required_remaining=definition.required_count,
+                total_steps=total_steps,
+                current_level=0,
+            )
+            seen = set()
+            rows = []
+            for row in totals.iterator(chunk_size=batch_size):
+                seen.add(row["user_id"])
+                rows.append(to_progress(row["user_id"], row["completed"], row["required_done"], row["level"]))
+                if len(rows) >= batch_size:
+                    upsert(rows)
+                    written += len(rows)
+                    rows = []
+            rows.extend(to_progress(user_id) for user_id in user_ids or [] if user_id not in seen)
+            upsert(rows)
+            written += len(rows)
+        return written
+
+    @staticmethod
+    def compact_completed_steps(chunk_size=500):
+        """
+        Merge duplicate (user, onboarding_step) completions into the latest one (by
+        date_completed, then id), moving organization/branch links onto it.
+        Returns the number of rows removed.
+        """
+        duplicates = (
+            CompletedOnboardingStep.objects.values("user_id", "onboarding_step_id")
+            .annotate(rows=Count("id"))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+        removed = 0
+        while groups := list(duplicates[:chunk_size]):
+            match = Q()
+            for group in groups:
+                match |= Q(user_id=group["user_id"], onboarding_step_id=group["onboarding_step_id"])
+            with transaction.atomic(using=router.db_for_write(CompletedOnboardingStep)):
+                # Keep the latest completion (date_completed, then id) of each group.
+                rows = list(CompletedOnboardingStep.objects.filter(match).order_by(
+                    F("date_completed").asc(nulls_first=True), "id"
+                ).values_list("id", "user_id", "onboarding_step_id"))
+                keep = {(user_id, step_id): pk for pk, user_id, step_id in rows}
+                stale = {
+                    pk: keep[(user_id, step_id)] for pk, user_id, step_id in rows if pk != keep[(user_id, step_id)]
+                }
+                for relation in ("organizations", "branches"):
+                    through, source, target = m2m_columns(CompletedOnboardingStep, relation)
+                    links = through.objects.filter(**{f"{source}__in": list(stale)}).values_list(source, target)
+                    through.objects.bulk_create(
+                        [through(**{source: stale[pk], target: related_id}) for pk, related_id in links],
+                        ignore_conflicts=True,
+                    )
+                    through.objects.filter(**{f"{source}__in": list(stale)}).delete()
+                CompletedOnboardingStep.objects.filter(id__in=list(stale)).delete()
+            removed += len(stale)
+        return removed
+
+    @staticmethod
+    def move_to_tenant(organization_ids, database, chunk_size=1000):
+        """
+        Move the onboardings linked to the organizations, with their steps,
+        completions and progress, from the default alias to the tenant alias
+        `database`, keeping their ids. Organizations added to TENANT_DATABASES no
+        longer see their rows in the default alias, so run this while their
+        onboarding writes are paused, right before deploying the mapping. Raises
+        CrossTenantError when an onboarding is shared with other organizations or
+        its ids are taken in `database`. Returns the rows moved per model.
+        """
+        source = DEFAULT_DB_ALIAS
+        links, link_onboarding, link_organization = m2m_columns(Onboarding, "organizations")
+        links = links.objects.using(source)
+        onboarding_ids = links.filter(**{f"{link_organization}__in": organization_ids}).values(link_onboarding)
+        shared = links.filter(**{f"{link_onboarding}__in": onboarding_ids}).exclude(
+            **{f"{link_organization}__in": organization_ids}
+        )
+        if shared.exists():
+            raise CrossTenantError("Onboardings are shared with organizations that are not moved.")
+
+        # Parents first, so the copies never point at missing rows; deleted in reverse.
+        querysets = [
+            Onboarding.objects.filter(pk__in=onboarding_ids),
+            OnboardingStep.objects.filter(onboarding_id__in=onboarding_ids),
+            CompletedOnboardingStep.objects.filter(onboarding_step__onboarding_id__in=onboarding_ids),
+            OnboardingProgress.objects.filter(onboarding_id__in=onboarding_ids),
+        ]
+        moved_ids = {}
+        with transaction.atomic(using=source), transaction.atomic(using=database):
+            for queryset in querysets:
+                model = queryset.model
+                moved_ids[model] = []
+                last_id = 0
+                while rows := list(queryset.using(source).filter(pk__gt=last_id).order_by("pk")[:chunk_size]):
+                    last_id = rows[-1].pk
+                    ids = [row.pk for row in rows]
+                    if model.objects.using(database).filter(pk__in=ids).exists():
+                        raise CrossTenantError(f"{model._meta.label} rows with these ids already exist in {database}.")
+                    model.objects.using(database).bulk_create(rows)
+                    for field in model._meta.local_many_to_many:
+                        through, source_column, target_column = m2m_columns(model, field.name)
+                        pairs = through.objects.using(source).filter(**{f"{source_column}__in": ids})
+                        through.objects.using(database).bulk_create([
+                            through(**{source_column: owner_id, target_column: related_id})
+                            for owner_id, related_id in pairs.values_list(source_column, target_column)
+                        ])
+                    moved_ids[model] += ids
+            for model, ids in reversed(moved_ids.items()):
+                for chunk in batched(ids, chunk_size):
+                    model.objects.using(source).filter(pk__in=chunk).delete()
+        OnboardingDefinitionCache.invalidate()
+        return {model._meta.label: len(ids) for model, ids in moved_ids.items()}
+
+    @staticmethod
+    def completed_steps_queryset(onboarding_name, cursor=None):
+        queryset = CompletedOnboardingStep.objects.filter(
+            onboarding_step__onboarding__name=onboarding_name
+        ).order_by("date_completed", "id")
+        if cursor is not None:
+            date_completed, pk = cursor
+            queryset = queryset.filter(
+                Q(date_completed__gt=date_completed) | Q(date_completed=date_completed, id__gt=pk)
+            )
+        return queryset
+
+    @staticmethod
+    def attach_completed_step_relations(rows):
+        """Add the organizations/branches id lists to completed step rows, one query per relation."""
+        step_ids = [row["id"] for row in rows]
+        for relation in ("organizations", "branches"):
+            through, source, target = m2m_columns(CompletedOnboardingStep, relation)
+            related = defaultdict(list)
+            links = through.objects.filter(**{f"{source}__in": step_ids}).values_list(source, target)
+            for step_id, related_id in links:
+                related[step_id].append(related_id)
+            for row in rows:
+                row[relation] = related.get(row["id"], [])
+        return rows
+
+    def get_completed_steps_page(self, onboarding_name, cursor=None, limit=100):
+        """
+        Return (rows, next_cursor) for one keyset page ordered by (date_completed, id).
+        next_cursor is None on the last page.
+        """
+        queryset = self.completed_steps_queryset(onboarding_name, cursor)
+        rows = list(queryset.values(*self.completed_step_fields)[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1]["date_completed"], rows[-1]["id"])
+        return self.attach_completed_step_relations(rows), next_cursor
+
+    async def aget_completed_steps_page(self, onboarding_name, cursor=None, limit=100):
+        """Async get_completed_steps_page() for ASGI views."""
+        queryset = self.completed_steps_queryset(onboarding_name, cursor)
+        rows = [row async for row in queryset.values(*self.completed_step_fields)[:limit + 1]]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1]["date_completed"], rows[-1]["id"])
+        step_ids = [row["id"] for row in rows]
+        for relation in ("organizations", "branches"):
+            through, source, target = m2m_columns(CompletedOnboardingStep, relation)
+            related = defaultdict(list)
+            async for step_id, related_id in through.objects.filter(
+                **{f"{source}__in": step_ids}
+            ).values_list(source, target):
+                related[step_id].append(related_id)
+            for row in rows:
+                row[relation] = related.get(row["id"], [])
+        return rows, next_cursor
+
+    def iter_completed_steps(self, onboarding_name, cursor=None, chunk_size=2000):
+        """Yield lists of completed step rows, reading the table with .iterator(chunk_size)."""
+        queryset = self.completed_steps_queryset(onboarding_name, cursor)
+        rows = queryset.values(*self.completed_step_fields).iterator(chunk_size=chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            yield self.attach_completed_step_relations(chunk)
+
 
 class CustomMembershipController(MembershipController):
 
     @classmethod
+    @retry_on_locked
     def create_membership(cls, user, subscription_tier, invite=None, roles=[]):
         membership = MembershipTier.objects.create(
             user=user,
@@ -13,25 +915,127 @@ class CustomMembershipController(MembershipController):
             invite=invite
         )
         membership.roles.set(roles)
+        record_changes([cls.membership_event(membership, "created")])
         return membership
 
     @classmethod
+    @retry_on_locked
     def update_status(cls, membership: MembershipTier, new_status: str):
         membership.subscription_status = new_status
         membership.save()
+        record_changes([cls.membership_event(membership, "status_changed")])
         return membership
-    
+
+    @classmethod
+    def cancel_membership(cls, membership: MembershipTier):
+        result = super().cancel_membership(membership)
+        # The base controller may not save() the instance, which api.signals relies on.
+        MembershipCache.invalidate(membership.user_id)
+        record_changes([cls.membership_event(membership, "status_changed")])
+        return result
+
+    @classmethod
+    def bulk_update_status(cls, memberships, new_status, from_statuses=None, chunk_size=None):
+        """
+        Move memberships (a MembershipTier queryset or ids) to new_status, optionally
+        only those currently in from_statuses. Works through them in pk order with one
+        short transaction and a single status-only UPDATE per chunk, so the write lock
+        is never held for long. Returns the ids of the memberships that changed.
+        """
+        if not isinstance(memberships, QuerySet):
+            memberships = MembershipTier.objects.filter(pk__in=list(memberships))
+        memberships = memberships.exclude(subscription_status=new_status)
+        if from_statuses is not None:
+            memberships = memberships.filter(subscription_status__in=list(from_statuses))
+        chunk_size = chunk_size or api_settings.MEMBERSHIP_BULK_CHUNK_SIZE
+
+        changed = []
+        last_id = 0
+        while chunk := list(
+            memberships.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:chunk_size]
+        ):
+            last_id = chunk[-1]
+            changed.extend(cls._update_status_chunk(memberships.filter(pk__in=chunk), new_status))
+        return changed
+
+    @staticmethod
+    @retry_on_locked
+    def _update_status_chunk(memberships, new_status):
+        with transaction.atomic():
+            rows = list(memberships.select_for_update().values_list("pk", "user_id"))
+            MembershipTier.objects.filter(pk__in=[pk for pk, _ in rows]).update(subscription_status=new_status)
+            record_changes(
+                change_event("membership", pk, "status_changed", user_id=user_id, status=new_status)
+                for pk, user_id in rows
+            )
+        MembershipCache.invalidate(*{user_id for _, user_id in rows})
+        return [pk for pk, _ in rows]
+
+    @classmethod
+    def expire_retired_tier_memberships(cls, chunk_size=None):
+        """Expire active memberships whose subscription tier was deactivated or deleted. Returns their ids."""
+        retired = MembershipTier.objects.filter(
+            Q(subscription_tier__is_active=False) | Q(subscription_tier__is_deleted=True)
+        )
+        return cls.bulk_update_status(
+            retired, api_settings.MEMBERSHIP_EXPIRED_STATUS, from_statuses=["active"], chunk_size=chunk_size
+        )
+
+    @staticmethod
+    def membership_event(membership, action):
+        return change_event(
+            "membership", membership.pk, action, user_id=membership.user_id, status=membership.subscription_status
+        )
+
     @classmethod
     def get_active_membership(cls, user):
-        return MembershipTier.objects.filter(user=user, subscription_status='active').first()
+        """The user's current membership: their newest active one (cached, see MembershipCache)."""
+        return MembershipCache.get(user)
+
+    @classmethod
+    def get_entitlements(cls, user):
+        """Current membership and the role templates its tier grants, or None without one."""
+        membership = cls.get_active_membership(user)
+        if membership is None:
+            return None
+        return {
+            "membership_id": membership.membership_id,
+            "subscription_tier_id": membership.subscription_tier_id,
+            "role_templates": TierRoleTemplateCache.get(membership.subscription_tier_id),
+        }
+
+    @classmethod
+    async def acreate_membership(cls, user, subscription_tier, invite=None, roles=()):
+        # The membership and its role links are written in one transaction, which the async ORM does not offer.
+        return await sync_to_async(cls.create_membership)(user, subscription_tier, invite=invite, roles=list(roles))
+
+    @classmethod
+    async def aupdate_status(cls, membership: MembershipTier, new_status: str):
+        # The status and its change event are written in one transaction, which the async ORM does not offer.
+        return await sync_to_async(cls.update_status)(membership, new_status)
+
+    @classmethod
+    async def aget_active_membership(cls, user):
+        return await MembershipCache.aget(user)
+
+    @classmethod
+    async def aassign_roles_from_tier(cls, membership: MembershipTier):
+        # Role materialization needs transactions, which the async ORM does not offer.
+        await sync_to_async(cls.assign_roles_from_tier)(membership)
     
     @classmethod
+    @retry_on_locked
     def assign_roles_from_tier(cls, membership: MembershipTier):
-        role_templates = membership.subscription_tier.role_templates.all()
-        for template in role_templates:
-            # use RoleController to create role from template
-            role = RoleController().create_role_base_on_template(template, role_name=f"{template.name} - {membership.user.username}")
-            membership.roles.add(role)
+        user = membership.user
+        templates = TierRoleTemplateCache.get(membership.subscription_tier_id)
+        roles = CustomRoleController().create_roles_from_templates(
+            templates,
+            role_names=[f"{template['name']} - {user.username}" for template in templates],
+        )
+        if roles:
+            membership.roles.add(*roles)
+            record_changes([change_event("user_roles", user.pk, "assigned", role_ids=[role.pk for role in roles])])
+        RoleCache.invalidate(user.pk)
 
     @staticmethod
     def create_subscription_tier(
@@ -61,4 +1065,606 @@ class CustomMembershipController(MembershipController):
             templates = RoleTemplate.objects.filter(id__in=role_template_ids)
             tier.role_templates.set(templates)
 
-        return tier        
\ No newline at end of file
+        return tier        
+
+
+class ConfigImportError(ValueError):
+    """An organization configuration stream failed validation; errors holds {"line", "error"} dicts."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid record(s) in the configuration stream.")
+        self.errors = errors
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class OrganizationConfigController:
+    """
+    NDJSON export and import of an organization's configuration: the role
+    templates its roles derive from, the subscription tiers built on them, its
+    roles, and its onboardings with their steps. Each line is one JSON object
+    with a "type"; records refer to each other by name, except role templates,
+    which are referred to by {"name", "access_level", "role_type"} (their unique
+    key, as names repeat across access levels and role types), branches by name
+    within the organization, and scopes/permissions/custom permissions/serializer
+    collections (shared catalog rows) by id.
+
+    Both directions work in keyset chunks of CONFIG_TRANSFER_CHUNK_SIZE rows. An
+    import first validates the whole stream, then makes one pass per record type
+    in dependency order, upserting each chunk with bulk queries in its own
+    transaction. Only record keys are kept between chunks, so the stream must be
+    re-readable (open_lines is called once per pass). Role templates and tiers are
+    shared by every organization: an import only creates the missing ones unless
+    overwrite_catalog is set.
+    """
+
+    version = 2
+    record_types = ("role_template", "subscription_tier", "role", "onboarding", "onboarding_step")
+    required_fields = {
+        "role_template": ("name", "access_level"),
+        "subscription_tier": ("title",),
+        "role": ("name", "access_level"),
+        "onboarding": ("name",),
+        "onboarding_step": ("onboarding", "name"),
+    }
+    template_fields = ("access_level", "role_type", "description", "is_admin")
+    tier_fields = ("description1", "description2", "description3", "price", "is_active", "payment_plans")
+    role_fields = ("description", "is_admin")
+    step_fields = ("description", "level", "optional")
+    # (relation, record key) of the catalog links of templates and roles
+    template_relations = [(relation, key) for _, relation, key in CustomRoleController.template_relations]
+    role_relations = [(relation, key) for relation, _, key in CustomRoleController.template_relations]
+
+    def __init__(self, organization, chunk_size=None, overwrite_catalog=False):
+        self.organization = organization
+        self.chunk_size = chunk_size or api_settings.CONFIG_TRANSFER_CHUNK_SIZE
+        self.overwrite_catalog = overwrite_catalog
+        self.tenant_db = tenant_database_for([organization.pk]) or DEFAULT_DB_ALIAS
+        self.changed_onboarding_ids = set()
+
+    # Export
+
+    def export_ndjson(self):
+        """Yield the organization's configuration as NDJSON lines (bytes)."""
+        for record in self.export_records():
+            yield json_bytes(record) + b"\n"
+
+    def export_records(self):
+        organization = self.organization
+        yield {
+            "type": "header",
+            "version": self.version,
+            "organization": {"id": organization.pk, "name": organization.name},
+            "exported_at": timezone.now(),
+        }
+
+        role_ids = Role.organizations.through.objects.filter(organization_id=organization.pk).values("role_id")
+        template_ids = RoleSignature.objects.filter(role_id__in=role_ids, template__isnull=False).values("template_id")
+        TierTemplate = SubscriptionTier.role_templates.through
+
+        for templates in self.keyset_chunks(
+            RoleTemplate.objects.filter(pk__in=template_ids).values("id", "name", *self.template_fields)
+        ):
+            related = self.related_ids(RoleTemplate, [relation for relation, _ in self.template_relations], templates)
+            for template in templates:
+                yield {
+                    "type": "role_template",
+                    **{key: value for key, value in template.items() if key != "id"},
+                    **{key: related[relation][template["id"]] for relation, key in self.template_relations},
+                }
+
+        for tiers in self.keyset_chunks(
+            SubscriptionTier.objects.filter(
+                pk__in=TierTemplate.objects.filter(roletemplate_id__in=template_ids).values("subscriptiontier_id")
+            ).values("id", "title", *self.tier_fields)
+        ):
+            refs = defaultdict(list)
+            for tier_id, *key in TierTemplate.objects.filter(
+                subscriptiontier_id__in=[tier["id"] for tier in tiers]
+            ).order_by("roletemplate_id").values_list(
+                "subscriptiontier_id", "roletemplate__access_level", "roletemplate__role_type", "roletemplate__name"
+            ):
+                refs[tier_id].append(self.template_ref(*key))
+            for tier in tiers:
+                yield {
+                    "type": "subscription_tier",
+                    **{key: value for key, value in tier.items() if key != "id"},
+                    "role_templates": refs[tier["id"]],
+                }
+
+        for roles in self.keyset_chunks(
+            Role.objects.filter(pk__in=role_ids).values("id", "name", "access_level", *self.role_fields)
+        ):
+            ids = [role["id"] for role in roles]
+            templates = {
+                role_id: self.template_ref(*key)
+                for role_id, *key in RoleSignature.objects.filter(role_id__in=ids, template__isnull=False).values_list(
+                    "role_id", "template__access_level", "template__role_type", "template__name"
+                )
+            }
+            branches = defaultdict(list)
+            for role_id, name in Role.branches.through.objects.filter(
+                role_id__in=ids, branch__organization=organization
+            ).values_list("role_id", "branch__name"):
+                branches[role_id].append(name)
+            related = self.related_ids(Role, [relation for relation, _ in self.role_relations], roles)
+            for role in roles:
+                yield {
+                    "type": "role",
+                    **{key: value for key, value in role.items() if key != "id"},
+                    "template": templates.get(role["id"]),
+                    "branches": branches[role["id"]],
+                    **{key: related[relation][role["id"]] for relation, key in self.role_relations},
+                }
+
+        onboarding_ids = Onboarding.organizations.through.objects.using(self.tenant_db).filter(
+            organization_id=organization.pk
+        ).values("onboarding_id")
+        for onboardings in self.keyset_chunks(
+            Onboarding.objects.using(self.tenant_db).filter(pk__in=onboarding_ids).values("id", "name", "description")
+        ):
+            for onboarding in onboardings:
+                yield {"type": "onboarding", "name": onboarding["name"], "description": onboarding["description"]}
+
+        for steps in self.keyset_chunks(
+            OnboardingStep.objects.using(self.tenant_db).filter(onboarding_id__in=onboarding_ids).values(
+                "id", "onboarding__name", "name", *self.step_fields
+            )
+        ):
+            for step in steps:
+                yield {
+                    "type": "onboarding_step",
+                    "onboarding": step.pop("onboarding__name"),
+                    **{key: value for key, value in step.items() if key != "id"},
+                }
+
+    def keyset_chunks(self, queryset):
+        last_id = 0
+        while rows := list(queryset.filter(pk__gt=last_id).order_by("pk")[:self.chunk_size]):
+            yield rows
+            last_id = rows[-1]["id"]
+
+    @staticmethod
+    def related_ids(model, relations, rows, using=None):
+        """{relation: {owner id: [related ids]}} for the rows (dicts with "id")."""
+        ids = [row["id"] for row in rows]
+        related = {}
+        for relation in relations:
+            through, source, target = m2m_columns(model, relation)
+            related[relation] = {owner_id: [] for owner_id in ids}
+            for owner_id, related_id in through.objects.using(using).filter(**{f"{source}__in": ids}).order_by(
+                target
+            ).values_list(source, target):
+                related[relation][owner_id].append(related_id)
+        return related
+
+    # Import
+
+    def records(self, lines, record_type=None):
+        """Yield (line number, record) from NDJSON lines, optionally only one record type."""
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            record = json_loads(line)
+            if record_type is None or (isinstance(record, dict) and record.get("type") == record_type):
+                yield number, record
+
+    def validate(self, lines):
+        """
+        Check a whole stream without writing. Returns the record count per type or
+        raises ConfigImportError. Template and onboarding references must resolve in
+        the stream or the database, catalog ids and branch names must exist, keys
+        must be unique, and taken role names must belong to the organization's role
+        with the same access level.
+        """
+        errors = []
+        counts = dict.fromkeys(self.record_types, 0)
+        keys = {record_type: set() for record_type in self.record_types}
+        template_refs, onboarding_refs, branch_refs = {}, {}, {}
+        catalog_refs = {key: {} for _, key in self.role_relations}
+        roles = []
+
+        def error(line, message):
+            if len(errors) < api_settings.CONFIG_IMPORT_MAX_ERRORS:
+                errors.append({"line": line, "error": message})
+
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json_loads(line)
+            except ValueError as e:
+                error(number, f"Invalid JSON: {e}")
+                continue
+            record_type = record.get("type") if isinstance(record, dict) else None
+            if record_type == "header":
+                if record.get("version") != self.version:
+                    error(number, f"Unsupported version {record.get('version')!r}.")
+                continue
+            if record_type not in self.required_fields:
+                error(number, f"Unknown record type {record_type!r}.")
+                continue
+            missing = [field for field in self.required_fields[record_type] if not isinstance(record.get(field), str)]
+            if missing:
+                error(number, f"Missing or non-string field(s): {', '.join(missing)}.")
+                continue
+            if record_type == "role_template" and not isinstance(record.get("role_type", ""), (str, type(None))):
+                error(number, "'role_type' must be a string.")
+                continue
+
+            key = self.record_key(record)
+            if key in keys[record_type]:
+                error(number, f"Duplicate {record_type} {key!r}.")
+                continue
+            keys[record_type].add(key)
+            counts[record_type] += 1
+
+            if record_type in ("role_template", "role"):
+                for _, field in self.role_relations:
+                    ids = record.get(field, [])
+                    if not isinstance(ids, list) or not all(isinstance(value, int) for value in ids):
+                        error(number, f"'{field}' must be a list of ids.")
+                        continue
+                    for value in ids:
+                        catalog_refs[field].setdefault(value, number)
+            if record_type == "subscription_tier":
+                refs = record.get("role_templates", [])
+                if isinstance(refs, list) and all(self.is_template_ref(ref) for ref in refs):
+                    for ref in refs:
+                        template_refs.setdefault(self.template_key(ref), number)
+                else:
+                    error(number, "'role_templates' must be a list of role template references.")
+            elif record_type == "role":
+                if record.get("template") is not None:
+                    if self.is_template_ref(record["template"]):
+                        template_refs.setdefault(self.template_key(record["template"]), number)
+                    else:
+                        error(number, "'template' must be a role template reference.")
+                for name in self.names(record, "branches", number, error):
+                    branch_refs.setdefault(name, number)
+                roles.append((number, record))
+                if len(roles) >= self.chunk_size:
+                    self.check_role_names(roles, error)
+                    roles = []
+            elif record_type == "onboarding_step":
+                onboarding_refs.setdefault(record["onboarding"], number)
+        if roles:
+            self.check_role_names(roles, error)
+
+        self.check_references(
+            RoleTemplate.objects.all(), ("access_level", "role_type", "name"), template_refs, keys["role_template"],
+            "role template", error,
+        )
+        self.check_references(
+            Onboarding.objects.using(self.tenant_db).all(), "name", onboarding_refs, keys["onboarding"],
+            "onboarding", error,
+        )
+        self.check_references(
+            Branch.objects.filter(organization=self.organization), "name", branch_refs, set(), "branch", error
+        )
+        for relation, field in self.role_relations:
+            related_model = getattr(Role, relation).field.related_model
+            label = field.removesuffix("_ids").replace("_", " ") + " id"
+            self.check_references(related_model.objects.all(), "pk", catalog_refs[field], set(), label, error)
+
+        if errors:
+            raise ConfigImportError(sorted(errors, key=lambda item: item["line"]))
+        return counts
+
+    @staticmethod
+    def names(record, field, number, error):
+        names = record.get(field, [])
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            error(number, f"'{field}' must be a list of names.")
+            return []
+        return names
+
+    @classmethod
+    def record_key(cls, record):
+        if record["type"] == "role_template":
+            return cls.template_key(record)
+        if record["type"] == "subscription_tier":
+            return record["title"]
+        if record["type"] == "onboarding_step":
+            return (record["onboarding"], record["name"])
+        return record["name"]
+
+    @staticmethod
+    def template_key(ref):
+        """(access_level, role_type, name) of a role_template record or a reference to one: its unique key."""
+        return (ref["access_level"], ref.get("role_type", ""), ref["name"])
+
+    @staticmethod
+    def template_ref(access_level, role_type, name):
+        return {"name": name, "access_level": access_level, "role_type": role_type}
+
+    @staticmethod
+    def is_template_ref(ref):
+        return (
+            isinstance(ref, dict)
+            and isinstance(ref.get("name"), str)
+            and isinstance(ref.get("access_level"), str)
+            and isinstance(ref.get("role_type", ""), (str, type(None)))
+        )
+
+    @staticmethod
+    def template_ids(keys):
+        """{template key: pk} of the existing role templates with these keys."""
+        keys = set(keys)
+        rows = RoleTemplate.objects.filter(name__in={name for _, _, name in keys}).values_list(
+            "access_level", "role_type", "name", "pk"
+        )
+        return {tuple(key): pk for *key, pk in rows if tuple(key) in keys}
+
+    def check_references(self, queryset, field, references, defined, label, error):
+        """field may be a tuple of fields for composite keys; candidates are narrowed by its last field."""
+        unresolved = [value for value in references if value not in defined]
+        found = set()
+        for chunk in batched(unresolved, self.chunk_size):
+            if isinstance(field, tuple):
+                found.update(
+                    queryset.filter(**{f"{field[-1]}__in": [value[-1] for value in chunk]}).values_list(*field)
+                )
+            else:
+                found.update(queryset.filter(**{f"{field}__in": chunk}).values_list(field, flat=True))
+        for value in unresolved:
+            if value not in found:
+                error(references[value], f"Unknown {label} {value!r}.")
+
+    def check_role_names(self, roles, error):
+        """
+        A taken role name (roles are groups) may only be reused by a role linked to
+        this organization with the same access level; the import then updates it.
+        """
+        names = [record["name"] for _, record in roles]
+        taken = set(Group.objects.filter(name__in=names).values_list("name", flat=True))
+        if not taken:
+            return
+        access_levels = {role.name: role.access_level for role in self.own_roles(taken)}
+        for number, record in roles:
+            name = record["name"]
+            if name in taken and access_levels.get(name) != record["access_level"]:
+                error(number, f"Role name {name!r} is taken by a role of another organization or access level.")
+
+    def own_roles(self, names):
+        """The organization's roles with these names (its other organizations' links kept)."""
+        return Role.objects.filter(name__in=list(names), organizations=self.organization)
+
+    def branch_ids(self, names):
+        return dict(
+            Branch.objects.filter(organization=self.organization, name__in=list(names)).values_list("name", "pk")
+        )
+
+    def import_records(self, open_lines):
+        """
+        Validate the stream returned by open_lines(), then write it type by type.
+        Returns {record type: {"created": n, "updated": n}}.
+        """
+        self.validate(open_lines())
+        result = {}
+        for record_type in self.record_types:
+            write = getattr(self, f"write_{record_type}s")
+            created = updated = 0
+            for chunk in batched((record for _, record in self.records(open_lines(), record_type)), self.chunk_size):
+                chunk_created, chunk_updated = write(chunk)
+                created += chunk_created
+                updated += chunk_updated
+            result[record_type] = {"created": created, "updated": updated}
+        TierCatalogCache.invalidate()
+        with using_tenant([self.organization.pk]):
+            OnboardingDefinitionCache.invalidate()
+            # Step totals and levels feed OnboardingProgress; recompute it where users have progress.
+            with_progress = OnboardingProgress.objects.filter(onboarding_id__in=self.changed_onboarding_ids)
+            for onboarding in Onboarding.objects.filter(pk__in=with_progress.values("onboarding_id")):
+                CustomOnboardingController.rebuild_progress(onboarding)
+        return result
+
+    @staticmethod
+    def replace_links(model, relation, owner_ids, pairs, using=None, within=None):
+        """Replace the owners' links with pairs; with `within` (a queryset), only the links to those rows."""
+        through, source, target = m2m_columns(model, relation)
+        links = through.objects.using(using).filter(**{f"{source}__in": owner_ids})
+        if within is not None:
+            links = links.filter(**{f"{target}__in": within.values("pk")})
+        links.delete()
+        through.objects.using(using).bulk_create(
+            [through(**{source: owner_id, target: related_id}) for owner_id, related_id in pairs],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def upsert(model, existing, records, key, build, fields, using=None):
+        """
+        Create the records missing from existing ({key: instance}) and update the
+        others' fields. Returns ({key: instance} for every record, created count).
+        """
+        instances = {}
+        new, stale = [], []
+        for record in records:
+            instance = existing.get(key(record))
+            if instance is None:
+                instance = build(record)
+                new.append(instance)
+            else:
+                for field in fields:
+                    if field in record:
+                        setattr(instance, field, record[field])
+                stale.append(instance)
+            instances[key(record)] = instance
+        model.objects.using(using).bulk_create(new)
+        if stale:
+            model.objects.using(using).bulk_update(stale, fields)
+        return instances, len(new)
+
+    def skip_existing(self, records, existing, key):
+        """Without overwrite_catalog, leave existing shared rows alone: drop their records."""
+        if self.overwrite_catalog:
+            return records, existing
+        return [record for record in records if key(record) not in existing], {}
+
+    @transaction.atomic
+    def write_role_templates(self, records):
+        keys = {self.template_key(record) for record in records}
+        existing = {
+            key: template
+            for template in RoleTemplate.objects.filter(name__in=[record["name"] for record in records])
+            if (key := (template.access_level, template.role_type, template.name)) in keys
+        }
+        written, existing = self.skip_existing(records, existing, key=self.template_key)
+        templates, created = self.upsert(
+            RoleTemplate, existing, written, key=self.template_key,
+            build=lambda record: RoleTemplate(
+                name=record["name"], **{field: record[field] for field in self.template_fields if field in record}
+            ),
+            fields=self.template_fields,
+        )
+        ids = [template.pk for template in templates.values()]
+        for relation, key in self.template_relations:
+            self.replace_links(RoleTemplate, relation, ids, [
+                (templates[self.template_key(record)].pk, related_id)
+                for record in written
+                for related_id in record.get(key, [])
+            ])
+        TierTemplate = SubscriptionTier.role_templates.through
+        TierRoleTemplateCache.invalidate(
+            *TierTemplate.objects.filter(roletemplate_id__in=ids).values_list("subscriptiontier_id", flat=True)
+        )
+        return created, len(written) - created
+
+    @transaction.atomic
+    def write_subscription_tiers(self, records):
+        existing = {
+            tier.title: tier
+            for tier in SubscriptionTier.objects.filter(title__in=[record["title"] for record in records])
+        }
+        written, existing = self.skip_existing(records, existing, key=lambda record: record["title"])
+        tiers, created = self.upsert(
+            SubscriptionTier, existing, written, key=lambda record: record["title"],
+            build=lambda record: SubscriptionTier(
+                title=record["title"], **{field: record[field] for field in self.tier_fields if field in record}
+            ),
+            fields=self.tier_fields,
+        )
+        template_ids = self.template_ids(
+            self.template_key(ref) for record in written for ref in record.get("role_templates", [])
+        )
+        ids = [tier.pk for tier in tiers.values()]
+        self.replace_links(SubscriptionTier, "role_templates", ids, [
+            (tiers[record["title"]].pk, template_ids[self.template_key(ref)])
+            for record in written
+            for ref in record.get("role_templates", [])
+        ])
+        TierRoleTemplateCache.invalidate(*ids)
+        return created, len(written) - created
+
+    @transaction.atomic
+    def write_roles(self, records):
+        role_controller = CustomRoleController()
+        branch_ids = self.branch_ids({name for record in records for name in record.get("branches", [])})
+        template_ids = self.template_ids(
+            self.template_key(record["template"]) for record in records if record.get("template")
+        )
+        existing = {role.name: role for role in self.own_roles(record["name"] for record in records)}
+        missing = [record for record in records if record["name"] not in existing]
+        created = role_controller.bulk_create_roles([
+            {
+                "name": record["name"],
+                "access_level": record["access_level"],
+                **{field: record[field] for field in self.role_fields if field in record},
+            }
+            for record in missing
+        ])
+        roles = {**existing, **{role.name: role for role in created}}
+
+        by_name = {record["name"]: record for record in records}
+        stale = list(existing.values())
+        for role in stale:
+            record = by_name[role.name]
+            for field in self.role_fields:
+                if field in record:
+                    setattr(role, field, record[field])
+        if stale:
+            Role.objects.bulk_update(stale, self.role_fields)
+
+        ids = [role.pk for role in roles.values()]
+        Role.organizations.through.objects.bulk_create(
+            [Role.organizations.through(role_id=role_id, organization_id=self.organization.pk) for role_id in ids],
+            ignore_conflicts=True,
+        )
+        # bulk_create skips m2m_changed, which would drop the organization's API key entries.
+        CredentialCache.invalidate(f"organization:{self.organization.pk}")
+        # Branches of the role's other organizations stay.
+        self.replace_links(Role, "branches", ids, [
+            (roles[record["name"]].pk, branch_ids[name]) for record in records for name in record.get("branches", [])
+        ], within=Branch.objects.filter(organization=self.organization))
+        for relation, key in self.role_relations:
+            self.replace_links(Role, relation, ids, [
+                (roles[record["name"]].pk, related_id) for record in records for related_id in record.get(key, [])
+            ])
+        role_controller.save_role_signatures(list(roles.values()), template_ids={
+            roles[record["name"]].pk: template_ids[self.template_key(record["template"])]
+            for record in records
+            if record.get("template")
+        })
+        if stale:
+            role_controller.invalidate_role_holders([role.pk for role in stale])
+        record_changes(
+            change_event("role", role.pk, action, organization_id=self.organization.pk)
+            for action, changed in (("created", created), ("updated", stale))
+            for role in changed
+        )
+        return len(created), len(stale)
+
+    def write_onboardings(self, records):
+        with transaction.atomic(using=self.tenant_db):
+            existing = {
+                onboarding.name: onboarding
+                for onboarding in Onboarding.objects.using(self.tenant_db).filter(
+                    name__in=[record["name"] for record in records]
+                )
+            }
+            onboardings, created = self.upsert(
+                Onboarding, existing, records, key=lambda record: record["name"],
+                build=lambda record: Onboarding(name=record["name"], description=record.get("description")),
+                fields=("description",), using=self.tenant_db,
+            )
+            through, source, target = m2m_columns(Onboarding, "organizations")
+            through.objects.using(self.tenant_db).bulk_create(
+                [
+                    through(**{source: onboarding.pk, target: self.organization.pk})
+                    for onboarding in onboardings.values()
+                ],
+                ignore_conflicts=True,
+            )
+        return created, len(records) - created
+
+    def write_onboarding_steps(self, records):
+        with transaction.atomic(using=self.tenant_db):
+            onboardings = {
+                onboarding.name: onboarding
+                for onboarding in Onboarding.objects.using(self.tenant_db).filter(
+                    name__in={record["onboarding"] for record in records}
+                )
+            }
+            names = {onboarding.pk: name for name, onboarding in onboardings.items()}
+            existing = {
+                (names[step.onboarding_id], step.name): step
+                for step in OnboardingStep.objects.using(self.tenant_db).filter(
+                    onboarding_id__in=list(names), name__in={record["name"] for record in records}
+                )
+            }
+            _, created = self.upsert(
+                OnboardingStep, existing, records, key=lambda record: (record["onboarding"], record["name"]),
+                build=lambda record: OnboardingStep(
+                    onboarding=onboardings[record["onboarding"]],
+                    name=record["name"],
+                    **{field: record[field] for field in self.step_fields if field in record},
+                ),
+                fields=self.step_fields, using=self.tenant_db,
+            )
+        self.changed_onboarding_ids.update(names)
+        return created, len(records) - created
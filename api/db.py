@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar, copy_context
+
+from asgiref.sync import iscoroutinefunction
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from .api_settings import api_settings
+
+_read_from_replica = ContextVar("api_read_from_replica", default=False)
+_tenant_database = ContextVar("api_tenant_database", default=None)
+
+
+class CrossTenantError(ValueError):
+    """The organizations of a request live in different tenant databases."""
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created receiver applying SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != "sqlite":
+        return
+    read_only = "mode=ro" in str(connection.settings_dict["NAME"])
+    with connection.cursor() as cursor:
+        for pragma, value in api_settings.SQLITE_PRAGMAS.items():
+            if read_only and pragma == "journal_mode":
+                continue
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        if connection.alias in tenant_databases():
+            # Tenant rows reference users, organizations and roles kept in the shared database.
+            cursor.execute("PRAGMA foreign_keys = OFF")
+
+
+@contextmanager
+def read_from_replica():
+    """Route reads made inside the block to the read alias (see api.routers.ReadReplicaRouter)."""
+    token = _read_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def reading_from_replica():
+    return _read_from_replica.get()
+
+
+def tenant_databases():
+    return set(api_settings.TENANT_DATABASES.values())
+
+
+def tenant_database_for(organization_ids):
+    """
+    Alias holding the tenant data of the organizations (TENANT_DATABASES maps
+    organization ids to aliases), or None when that is the default alias shared by
+    unmapped organizations, so the other routers (read replica) still apply.
+    Raises CrossTenantError when they span several aliases.
+    """
+    mapping = api_settings.TENANT_DATABASES
+    aliases = {mapping.get(str(organization_id), DEFAULT_DB_ALIAS) for organization_id in organization_ids}
+    if len(aliases) > 1:
+        raise CrossTenantError("Organizations belong to different tenant databases.")
+    alias = aliases.pop() if aliases else DEFAULT_DB_ALIAS
+    return None if alias == DEFAULT_DB_ALIAS else alias
+
+
+@contextmanager
+def using_tenant(organization_ids):
+    """Route tenant-scoped models used inside the block to the organizations' alias (api.routers.TenantRouter)."""
+    token = _tenant_database.set(tenant_database_for(organization_ids))
+    try:
+        yield
+    finally:
+        _tenant_database.reset(token)
+
+
+def active_tenant_database():
+    """Alias chosen by the enclosing using_tenant() block, None outside one."""
+    return _tenant_database.get()
+
+
+def iter_with_routing(iterable):
+    """
+    Keep the replica and tenant routing of the view for a generator consumed after
+    it returned (streaming responses).
+    """
+    return _iter_in_context(copy_context(), iter(iterable))
+
+
+def _iter_in_context(context, iterator):
+    while True:
+        try:
+            item = context.run(next, iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+class ReadReplicaMixin:
+    """For read-only API views (sync or async): serve every query of the request from the read alias."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._async_dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+    async def _async_dispatch(self, request, *args, **kwargs):
+        with read_from_replica():
+            return await super().dispatch(request, *args, **kwargs)
+
+
+def retry_on_locked(func):
+    """
+    Run a controller write in a transaction (on the default alias and the active
+    tenant alias) and retry it as a whole when SQLite reports "database is
+    locked", backing off exponentially with jitter (DB_WRITE_RETRY_ATTEMPTS,
+    DB_WRITE_RETRY_BASE_DELAY), so a retry never repeats half of a write. Calls
+    made inside an outer atomic block run once within it: that transaction must be
+    retried by its owner. The async ORM has no transactions, so coroutine
+    functions are retried as they are and may only issue a single write.
+    """
+
+    def backoff(attempt):
+        return api_settings.DB_WRITE_RETRY_BASE_DELAY * 2 ** attempt * (1 + random.random())
+
+    if iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            attempts = api_settings.DB_WRITE_RETRY_ATTEMPTS
+            for attempt in range(attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except OperationalError as e:
+                    if "locked" not in str(e) or attempt == attempts - 1:
+                        raise
+                    await asyncio.sleep(backoff(attempt))
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if any(connection.in_atomic_block for connection in connections.all(initialized_only=True)):
+            return func(*args, **kwargs)
+        attempts = api_settings.DB_WRITE_RETRY_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                with write_transaction():
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if "locked" not in str(e) or attempt == attempts - 1:
+                    raise
+                time.sleep(backoff(attempt))
+
+    return wrapper
+
+
+@contextmanager
+def write_transaction():
+    """atomic() on the default alias and, inside using_tenant(), on the tenant alias."""
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic(using=DEFAULT_DB_ALIAS))
+        tenant = active_tenant_database()
+        if tenant:
+            stack.enter_context(transaction.atomic(using=tenant))
+        yield
@@ -0,0 +1,328 @@
+import threading
+import time
+
+from accounts.models import Endpoint, Role, Scope
+from django.core.cache import cache
+
+from .api_settings import api_settings
+from .cache import RoleCache
+
+
+def _segments(url):
+    url = url.split("?", 1)[0].strip("/")
+    return url.split("/") if url else []
+
+
+def _is_parameter(segment):
+    return (segment.startswith("<") and segment.endswith(">")) or (segment.startswith("{") and segment.endswith("}"))
+
+
+class _Node:
+    __slots__ = ("children", "parameter", "bits", "prefix_bits")
+
+    def __init__(self):
+        self.children = {}
+        self.parameter = None
+        self.bits = 0
+        self.prefix_bits = 0
+
+
+class IndexSnapshot:
+    """
+    One compiled build of the index: the endpoint trie, the scope and role bitsets,
+    and the shared version it was built at. Built off to the side and swapped in
+    whole, so readers never see a partial index; take match() and role_bits() of
+    one request from the same snapshot, since bits are reassigned on every build.
+    Incremental updates change it in place under the index lock.
+    """
+
+    def __init__(self, version, lock):
+        self.version = version
+        self.expires_at = time.monotonic() + api_settings.ENDPOINT_INDEX_TIMEOUT
+        self._lock = lock
+        self._root = _Node()
+        self._endpoints = {}
+        self._next_bit = 0
+        self._scope_bits = {}
+        self._role_scopes = {}
+        self._role_bits = {}
+
+    def match(self, path):
+        """Bitset of the endpoints whose url pattern matches path."""
+        matched = 0
+        nodes = [self._root]
+        for segment in _segments(path):
+            next_nodes = []
+            for node in nodes:
+                matched |= node.prefix_bits
+                child = node.children.get(segment)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.parameter is not None:
+                    next_nodes.append(node.parameter)
+            nodes = next_nodes
+            if not nodes:
+                return matched
+        for node in nodes:
+            matched |= node.bits | node.prefix_bits
+        return matched
+
+    def role_bits(self, role_ids):
+        """Bitset of the endpoints reachable through any of the roles."""
+        unknown = [role_id for role_id in role_ids if role_id not in self._role_scopes]
+        if unknown:
+            self._load_roles(unknown)
+        bits = 0
+        for role_id in role_ids:
+            role_bits = self._role_bits.get(role_id)
+            if role_bits is None:
+                role_bits = 0
+                for scope_id in self._role_scopes.get(role_id, ()):
+                    role_bits |= self._scope_bits.get(scope_id, 0)
+                self._role_bits[role_id] = role_bits
+            bits |= role_bits
+        return bits
+
+    def user_bits(self, user):
+        return self.role_bits([role_id for role_id, _ in RoleCache.get_roles(user)])
+
+    def allows(self, user, path):
+        return bool(self.user_bits(user) & self.match(path))
+
+    def load(self):
+        """Load every endpoint, scope and role link (three queries)."""
+        for endpoint_id, url in Endpoint.objects.order_by("id").values_list("id", "url"):
+            self._add_endpoint(endpoint_id, url)
+        for scope_id, endpoint_id in Scope.endpoint.through.objects.values_list("scope_id", "endpoint_id"):
+            self._scope_bits[scope_id] = self._scope_bits.get(scope_id, 0) | self._endpoint_bit(endpoint_id)
+        for role_id, scope_id in Role.scopes.through.objects.values_list("role_id", "scope_id"):
+            self._role_scopes.setdefault(role_id, set()).add(scope_id)
+
+    # Incremental updates, applied through EndpointPermissionIndex under its lock.
+
+    def update_endpoint(self, endpoint_id, url):
+        if endpoint_id in self._endpoints:
+            bit, old_url = self._endpoints[endpoint_id]
+            if old_url == url:
+                return
+            self._walk(old_url, create=False, clear=bit)
+            self._walk(url, set_bit=bit)
+            self._endpoints[endpoint_id] = (bit, url)
+        else:
+            self._add_endpoint(endpoint_id, url)
+
+    def remove_endpoint(self, endpoint_id):
+        if endpoint_id not in self._endpoints:
+            return
+        self.detach_endpoint(endpoint_id)
+        bit, url = self._endpoints.pop(endpoint_id)
+        self._walk(url, create=False, clear=bit)
+
+    def change_scope_endpoints(self, scope_id, endpoint_ids, add):
+        bits = 0
+        for endpoint_id in endpoint_ids:
+            bits |= self._endpoint_bit(endpoint_id)
+        current = self._scope_bits.get(scope_id, 0)
+        self._scope_bits[scope_id] = current | bits if add else current & ~bits
+        self._role_bits = {}
+
+    def detach_endpoint(self, endpoint_id):
+        """Remove an endpoint from every scope."""
+        bit = self._endpoint_bit(endpoint_id)
+        for scope_id in self._scope_bits:
+            self._scope_bits[scope_id] &= ~bit
+        self._role_bits = {}
+
+    def clear_scope(self, scope_id):
+        self._scope_bits.pop(scope_id, None)
+        self._role_bits = {}
+
+    def change_role_scopes(self, role_id, scope_ids, add):
+        if role_id not in self._role_scopes:
+            return
+        if add:
+            self._role_scopes[role_id] |= set(scope_ids)
+        else:
+            self._role_scopes[role_id] -= set(scope_ids)
+        self._role_bits.pop(role_id, None)
+
+    def forget_roles(self, role_ids):
+        for role_id in role_ids:
+            self._role_scopes.pop(role_id, None)
+            self._role_bits.pop(role_id, None)
+
+    def forget_scope_roles(self, scope_id):
+        self.forget_roles([role_id for role_id, scope_ids in list(self._role_scopes.items()) if scope_id in scope_ids])
+
+    def _load_roles(self, role_ids):
+        role_scopes = {role_id: set() for role_id in role_ids}
+        for role_id, scope_id in Role.scopes.through.objects.filter(role_id__in=role_ids).values_list(
+            "role_id", "scope_id"
+        ):
+            role_scopes[role_id].add(scope_id)
+        with self._lock:
+            self._role_scopes.update(role_scopes)
+
+    def _endpoint_bit(self, endpoint_id):
+        entry = self._endpoints.get(endpoint_id)
+        return entry[0] if entry else 0
+
+    def _add_endpoint(self, endpoint_id, url):
+        # Bits of deleted endpoints are never reused, so stale bitsets stay harmless.
+        bit = 1 << self._next_bit
+        self._next_bit += 1
+        self._endpoints[endpoint_id] = (bit, url)
+        self._walk(url, set_bit=bit)
+
+    def _walk(self, url, create=True, set_bit=0, clear=0):
+        segments = _segments(url)
+        prefix = bool(segments) and segments[-1] == "*"
+        if prefix:
+            segments = segments[:-1]
+        node = self._root
+        for segment in segments:
+            if _is_parameter(segment):
+                if node.parameter is None:
+                    if not create:
+                        return
+                    node.parameter = _Node()
+                node = node.parameter
+            else:
+                child = node.children.get(segment)
+                if child is None:
+                    if not create:
+                        return
+                    child = node.children[segment] = _Node()
+                node = child
+        if prefix:
+            node.prefix_bits = (node.prefix_bits | set_bit) & ~clear
+        else:
+            node.bits = (node.bits | set_bit) & ~clear
+
+
+class EndpointPermissionIndex:
+    """
+    Compiled form of role -> scope -> endpoint authorization. Every Endpoint gets a
+    bit; endpoint urls live in a path-segment trie where "<param>"/"{param}"
+    segments match any one segment and a trailing "*" matches everything below.
+    Scopes and roles are reduced to int bitsets, so allows(user, path) is a trie
+    walk and an AND.
+
+    api.signals applies endpoint/scope/role changes to this process's snapshot
+    once they commit and bumps a version kept in the Django cache, so other
+    processes rebuild on their next check. Snapshots are also rebuilt after
+    ENDPOINT_INDEX_TIMEOUT seconds, which bounds staleness after writes that send
+    no signals (QuerySet.update()).
+    """
+
+    version_key = "api:endpoint-index:version"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot = None
+
+    @property
+    def built(self):
+        return self._is_current(self._snapshot)
+
+    def build(self):
+        """Compile a new snapshot from the database and swap it in."""
+        # Read the version before the rows, so a bump in between leaves the snapshot stale.
+        snapshot = IndexSnapshot(cache.get_or_set(self.version_key, time.time_ns, None), self._lock)
+        snapshot.load()
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def expire(self):
+        """Rebuild from the database on next use."""
+        with self._lock:
+            self._snapshot = None
+
+    def snapshot(self):
+        """The current snapshot, rebuilt first (by one thread; the others wait for it) when stale."""
+        snapshot = self._snapshot
+        if self._is_current(snapshot):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if self._is_current(snapshot):
+                return snapshot
+            return self.build()
+
+    def ensure_built(self):
+        self.snapshot()
+
+    def match(self, path):
+        return self.snapshot().match(path)
+
+    def role_bits(self, role_ids):
+        return self.snapshot().role_bits(role_ids)
+
+    def user_bits(self, user):
+        return self.snapshot().user_bits(user)
+
+    def allows(self, user, path):
+        """May the user call path through one of their roles' scopes?"""
+        return self.snapshot().allows(user, path)
+
+    # Incremental updates, called from api.signals once the change commits.
+
+    def update_endpoint(self, endpoint_id, url):
+        self._apply(IndexSnapshot.update_endpoint, endpoint_id, url)
+
+    def remove_endpoint(self, endpoint_id):
+        self._apply(IndexSnapshot.remove_endpoint, endpoint_id)
+
+    def change_scope_endpoints(self, scope_id, endpoint_ids, add):
+        self._apply(IndexSnapshot.change_scope_endpoints, scope_id, endpoint_ids, add)
+
+    def detach_endpoint(self, endpoint_id):
+        """Remove an endpoint from every scope."""
+        self._apply(IndexSnapshot.detach_endpoint, endpoint_id)
+
+    def clear_scope(self, scope_id):
+        self._apply(IndexSnapshot.clear_scope, scope_id)
+
+    def change_role_scopes(self, role_id, scope_ids, add):
+        self._apply(IndexSnapshot.change_role_scopes, role_id, scope_ids, add)
+
+    def forget_roles(self, role_ids):
+        """Drop roles so they are reloaded on next use (after bulk through-table writes)."""
+        self._apply(IndexSnapshot.forget_roles, role_ids)
+
+    def forget_scope_roles(self, scope_id):
+        self._apply(IndexSnapshot.forget_scope_roles, scope_id)
+
+    def _apply(self, change, *args):
+        """
+        Apply change to this process's snapshot, if current, and bump the shared
+        version. The snapshot keeps up with the new version only when no other
+        process bumped it since; otherwise it is rebuilt like everyone else's.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            current = self._is_current(snapshot)
+            if current:
+                change(snapshot, *args)
+            version = self._bump_version()
+            if current and version == snapshot.version + 1:
+                snapshot.version = version
+
+    def _is_current(self, snapshot):
+        return (
+            snapshot is not None
+            and snapshot.expires_at > time.monotonic()
+            and snapshot.version == cache.get(self.version_key)
+        )
+
+    def _bump_version(self):
+        try:
+            return cache.incr(self.version_key)
+        except ValueError:
+            # Evicted: restart from a value no snapshot was built at, so every process rebuilds.
+            cache.set(self.version_key, time.time_ns(), None)
+            return None
+
+
+endpoint_index = EndpointPermissionIndex()
@@ -0,0 +1,138 @@
+import threading
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+
+from .api_settings import api_settings
+from .cache import request_store
+from .db import retry_on_locked
+from .models import ChangeEvent
+
+EVENT_FIELDS = ("id", "topic", "key", "action", "data", "created_at")
+
+_outbox = []
+_outbox_lock = threading.Lock()
+
+
+def change_event(topic, key, action, **data):
+    return ChangeEvent(topic=topic, key=str(key), action=action, data=data)
+
+
+def record_changes(events):
+    """
+    Record ChangeEvents for the writes of the caller's transaction without adding
+    a statement to it: they join this process's outbox when the transaction
+    commits and are dropped with it (or with a rolled-back savepoint). Inside a
+    request (RequestCacheMiddleware) the outbox is written once the response is
+    done, on request_finished; in tasks and commands right after the commit. Ids
+    follow the order events are written in; created_at is the time of the change.
+    """
+    events = list(events)
+    if events and api_settings.CHANGE_EVENTS_ENABLED:
+        transaction.on_commit(partial(_add_to_outbox, events))
+
+
+def _add_to_outbox(events):
+    with _outbox_lock:
+        _outbox.extend(events)
+    if request_store() is None:
+        flush_change_events()
+
+
+def flush_change_events():
+    """
+    Insert the events waiting in this process's outbox, one bulk INSERT per
+    CHANGE_EVENT_BATCH_SIZE events. Returns how many were written; on failure
+    they stay in the outbox for the next flush.
+    """
+    with _outbox_lock:
+        events = _outbox[:]
+        _outbox.clear()
+    if not events:
+        return 0
+    try:
+        _insert_events(events)
+    except Exception:
+        with _outbox_lock:
+            _outbox[:0] = events
+        raise
+    return len(events)
+
+
+@retry_on_locked
+def _insert_events(events):
+    ChangeEvent.objects.bulk_create(events, batch_size=api_settings.CHANGE_EVENT_BATCH_SIZE)
+
+
+def latest_cursor():
+    return ChangeEvent.objects.aggregate(latest=Max("pk"))["latest"] or 0
+
+
+def events_since(cursor=0, topics=None, limit=None):
+    """
+    Up to `limit` events after `cursor` (an event id) in id order, optionally only
+    of some topics. Returns (rows, next cursor, truncated); truncated means events
+    after the cursor were pruned already and the consumer should resync.
+    """
+    limit = limit or api_settings.CHANGE_EVENT_PAGE_SIZE
+    queryset = ChangeEvent.objects.filter(pk__gt=cursor)
+    if topics:
+        queryset = queryset.filter(topic__in=topics)
+    rows = list(queryset.order_by("pk").values(*EVENT_FIELDS)[:limit])
+    oldest = ChangeEvent.objects.order_by("pk").values_list("pk", flat=True).first()
+    truncated = oldest is not None and cursor < oldest - 1
+    return rows, rows[-1]["id"] if rows else cursor, truncated
+
+
+def prune_change_events(retention_days=None, max_rows=None, compact_after_hours=None, chunk_size=5000):
+    """
+    Keep the log bounded: delete events older than retention_days and beyond the
+    newest max_rows, and compact events older than compact_after_hours that a
+    newer event with the same topic and key supersedes. Unset arguments fall back
+    to the CHANGE_EVENT_* settings (None disables that step); compaction orders
+    events by created_at, then id. The newest event is always kept, so feed
+    cursors can tell pruned ids from unused ones. Deletes in id order, chunk_size
+    rows per query; returns the count per step.
+    """
+    retention_days = api_settings.CHANGE_EVENT_RETENTION_DAYS if retention_days is None else retention_days
+    max_rows = api_settings.CHANGE_EVENT_MAX_ROWS if max_rows is None else max_rows
+    if compact_after_hours is None:
+        compact_after_hours = api_settings.CHANGE_EVENT_COMPACT_AFTER_HOURS
+    result = {"expired": 0, "trimmed": 0, "compacted": 0}
+    newest = latest_cursor()
+    if not newest:
+        return result
+
+    events = ChangeEvent.objects.filter(pk__lt=newest)
+    now = timezone.now()
+    if retention_days is not None:
+        result["expired"] = _delete_in_chunks(
+            events.filter(created_at__lt=now - timedelta(days=retention_days)), chunk_size
+        )
+    if max_rows:
+        bound = list(ChangeEvent.objects.order_by("-pk").values_list("pk", flat=True)[max_rows - 1:max_rows])
+        if bound:
+            result["trimmed"] = _delete_in_chunks(events.filter(pk__lt=bound[0]), chunk_size)
+    if compact_after_hours is not None:
+        newer = ChangeEvent.objects.filter(
+            Q(created_at__gt=OuterRef("created_at")) | Q(created_at=OuterRef("created_at"), pk__gt=OuterRef("pk")),
+            topic=OuterRef("topic"),
+            key=OuterRef("key"),
+        )
+        result["compacted"] = _delete_in_chunks(
+            events.filter(created_at__lt=now - timedelta(hours=compact_after_hours)).filter(Exists(newer)),
+            chunk_size,
+        )
+    return result
+
+
+def _delete_in_chunks(queryset, chunk_size):
+    deleted = 0
+    last_id = 0
+    while ids := list(queryset.filter(pk__gt=last_id).order_by("pk").values_list("pk", flat=True)[:chunk_size]):
+        last_id = ids[-1]
+        deleted += ChangeEvent.objects.filter(pk__in=ids).delete()[0]
+    return deleted
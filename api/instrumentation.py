@@ -0,0 +1,149 @@
+import bisect
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from .api_settings import api_settings
+
+slow_query_logger = logging.getLogger("api.slow_queries")
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233)
+
+
+class Histogram:
+    """Fixed-bucket histogram; each bucket counts values <= its bound, the last one is unbounded."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the observed max for the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 3),
+            "buckets": {
+                str(bound): count
+                for bound, count in zip([*self.bounds, "+Inf"], self.counts)
+                if count
+            },
+        }
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_time_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.n_plus_one = Counter()
+
+    def snapshot(self):
+        return {
+            "latency_ms": self.latency_ms.snapshot(),
+            "queries": self.queries.snapshot(),
+            "query_time_ms": self.query_time_ms.snapshot(),
+            "n_plus_one": [
+                {"sql": sql, "requests": requests} for sql, requests in self.n_plus_one.most_common(10)
+            ],
+        }
+
+
+class MetricsRegistry:
+    """In-process metrics per view name, shared by every thread of the worker."""
+
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view_name, latency_ms, recorder):
+        with self._lock:
+            metrics = self._views.get(view_name)
+            if metrics is None:
+                metrics = self._views[view_name] = ViewMetrics()
+            metrics.latency_ms.record(latency_ms)
+            metrics.queries.record(recorder.count)
+            metrics.query_time_ms.record(recorder.total_ms)
+            for sql in recorder.repeated_templates():
+                metrics.n_plus_one[sql[:300]] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {view_name: metrics.snapshot() for view_name, metrics in sorted(self._views.items())}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+class QueryRecorder:
+    """connection.execute_wrapper() hook counting and timing the queries of one request."""
+
+    def __init__(self, view_name=None):
+        self.view_name = view_name
+        self.count = 0
+        self.total_ms = 0.0
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.templates[sql] += 1
+            if (
+                elapsed_ms >= api_settings.INSTRUMENTATION_SLOW_QUERY_MS
+                and random.random() < api_settings.INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE
+            ):
+                slow_query_logger.warning(
+                    "Slow query (%.1f ms) in %s from %s: %s",
+                    elapsed_ms, self.view_name, controller_origin(), sql[:1000],
+                )
+
+    def repeated_templates(self):
+        threshold = api_settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        return [sql for sql, count in self.templates.items() if count > threshold]
+
+
+def controller_origin():
+    """Name the innermost controller method on the current stack, e.g. 'api.controllers.CustomRoleController.get_role'."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.endswith("controllers"):
+            name = getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+            return f"{module}.{name}"
+        frame = frame.f_back
+    return "unknown"
@@ -0,0 +1,112 @@
+import logging
+import pickle
+import queue
+import threading
+
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .api_settings import api_settings
+from .models import QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+_memory_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Email backend that queues messages instead of talking to the mail server on
+    the request path. EMAIL_QUEUE_MODE "database" (the default) stores QueuedEmail
+    rows that send_queued_mail (command or celery task) delivers and retries.
+    "memory" delivers them from a background thread of the current process and is
+    meant for development: messages still queued when the process exits are lost,
+    failed deliveries are handed to the database queue.
+    """
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        for message in email_messages:
+            message.connection = None
+        if api_settings.EMAIL_QUEUE_MODE == "database":
+            queue_in_database(email_messages)
+        else:
+            _ensure_worker()
+            for message in email_messages:
+                _memory_queue.put(message)
+        return len(email_messages)
+
+
+def queue_in_database(email_messages):
+    QueuedEmail.objects.bulk_create([QueuedEmail(message_data=pickle.dumps(message)) for message in email_messages])
+
+
+def delivery_connection():
+    return get_connection(api_settings.EMAIL_DELIVERY_BACKEND, fail_silently=False)
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_deliver_from_memory, name="api-mail-queue", daemon=True)
+            _worker.start()
+
+
+def _deliver_from_memory():
+    while True:
+        messages = [_memory_queue.get()]
+        while True:
+            try:
+                messages.append(_memory_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            deliver_or_queue(messages)
+        finally:
+            close_old_connections()
+
+
+def deliver_or_queue(messages):
+    """Send messages now; should that fail, queue them in the database for send_queued_mail."""
+    try:
+        delivery_connection().send_messages(messages)
+    except Exception:
+        logger.exception("Failed to deliver %d email(s), moving them to the database queue", len(messages))
+        try:
+            queue_in_database(messages)
+        except Exception:
+            logger.exception("Lost %d undeliverable email(s)", len(messages))
+
+
+def send_queued_mail(limit=100):
+    """Deliver up to `limit` pending QueuedEmail rows over one connection. Returns (sent, failed)."""
+    pending = list(
+        QueuedEmail.objects.filter(sent_at__isnull=True, attempts__lt=api_settings.EMAIL_QUEUE_MAX_ATTEMPTS)
+        .order_by("id")[:limit]
+    )
+    if not pending:
+        return 0, 0
+
+    sent, failed = [], []
+    with delivery_connection() as connection:
+        for queued in pending:
+            queued.attempts += 1
+            try:
+                connection.send_messages([pickle.loads(queued.message_data)])
+            except Exception as e:
+                logger.warning("Failed to deliver queued email %s: %s", queued.pk, e)
+                queued.last_error = str(e)
+                failed.append(queued)
+            else:
+                queued.sent_at = timezone.now()
+                sent.append(queued)
+
+    QueuedEmail.objects.bulk_update(sent, ["attempts", "sent_at"])
+    QueuedEmail.objects.bulk_update(failed, ["attempts", "last_error"])
+    return len(sent), len(failed)
@@ -0,0 +1,119 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+
+# (WSGI path, ASGI path) per endpoint; {onboarding} is filled in from --onboarding-name.
+ENDPOINT_PAIRS = {
+    "user-roles": ("/api/user-roles/", "/api/async/user-roles/"),
+    "completed-steps": (
+        "/api/completed-steps/?onboarding_name={onboarding}",
+        "/api/async/completed-steps/?onboarding_name={onboarding}",
+    ),
+    "onboarding-progress": (
+        "/api/onboarding/progress?onboarding_name={onboarding}",
+        "/api/async/onboarding/progress?onboarding_name={onboarding}",
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput of the sync views behind the WSGI handler (one thread per "
+        "in-flight request) with the async views behind the ASGI handler (one event loop) "
+        "at a fixed concurrency, against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, help="User to send requests as (default: first superuser).")
+        parser.add_argument("--concurrency", type=int, default=50, help="In-flight requests per mode.")
+        parser.add_argument("--requests", type=int, default=1000, help="Requests per endpoint and mode.")
+        parser.add_argument(
+            "--endpoint", action="append", choices=sorted(ENDPOINT_PAIRS), help="Endpoint to run (repeatable)."
+        )
+        parser.add_argument("--onboarding-name", default="Default Onboarding")
+        parser.add_argument("--host", help="Host header (default: first ALLOWED_HOSTS entry or localhost).")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.order_by("pk")
+        user = users.filter(pk=options["user_id"]).first() if options["user_id"] else users.filter(
+            is_superuser=True
+        ).first()
+        if user is None:
+            raise CommandError("No user to authenticate as; pass --user-id.")
+
+        concurrency = max(1, options["concurrency"])
+        per_worker = max(1, options["requests"] // concurrency)
+        allowed_hosts = [host for host in settings.ALLOWED_HOSTS if host != "*" and not host.startswith(".")]
+        headers = {"host": options["host"] or (allowed_hosts[0] if allowed_hosts else "localhost")}
+        login = Client(headers=headers)
+        login.force_login(user)
+
+        self.stdout.write(
+            f"{concurrency} concurrent clients x {per_worker} requests, user {user.pk}, "
+            f"database {connections['default'].vendor}"
+        )
+        for name in options["endpoint"] or sorted(ENDPOINT_PAIRS):
+            wsgi_path, asgi_path = (
+                path.format(onboarding=quote(options["onboarding_name"])) for path in ENDPOINT_PAIRS[name]
+            )
+            wsgi = self.run_wsgi(wsgi_path, headers, login.cookies, concurrency, per_worker)
+            asgi = asyncio.run(self.run_asgi(asgi_path, headers, login.cookies, concurrency, per_worker))
+            for mode, (elapsed, latencies, errors) in (("wsgi", wsgi), ("asgi", asgi)):
+                self.stdout.write(
+                    f"{name:<20} {mode}  {len(latencies) / elapsed:9.1f} req/s  "
+                    f"p50 {statistics.median(latencies):8.2f} ms  "
+                    f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:8.2f} ms  "
+                    f"errors {errors}"
+                )
+            self.stdout.write(f"{name:<20} asgi/wsgi throughput x{wsgi[0] / asgi[0]:.2f}")
+
+    @staticmethod
+    def summarize(started, results):
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+        return elapsed, latencies, sum(errors for _, errors in results)
+
+    def run_wsgi(self, path, headers, cookies, concurrency, per_worker):
+        def worker(_):
+            client = Client(headers=headers)
+            client.cookies = cookies
+            latencies, errors = [], 0
+            try:
+                for _ in range(per_worker):
+                    started = time.perf_counter()
+                    response = client.get(path)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    errors += response.status_code >= 400
+            finally:
+                connections.close_all()
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(worker, range(concurrency)))
+        return self.summarize(started, results)
+
+    async def run_asgi(self, path, headers, cookies, concurrency, per_worker):
+        async def worker():
+            client = AsyncClient(headers=headers)
+            client.cookies = cookies
+            latencies, errors = [], 0
+            for _ in range(per_worker):
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append((time.perf_counter() - started) * 1000)
+                errors += response.status_code >= 400
+            return latencies, errors
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return self.summarize(started, results)
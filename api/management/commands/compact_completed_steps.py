@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.controllers import CustomOnboardingController
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge duplicate completed onboarding steps (same user and step) into the latest completion. "
+        "Run before migrating api 0003 on large tables to keep that migration short."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Duplicate groups handled per transaction.")
+
+    def handle(self, *args, **options):
+        removed = CustomOnboardingController.compact_completed_steps(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} duplicate completed steps."))
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.tasks import expire_memberships_task
+
+PERIODIC_TASK_NAME = "api: expire memberships of retired tiers"
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire active memberships whose subscription tier was deactivated or deleted, "
+        "in-process through the celery task. With --schedule, register the task with "
+        "django_celery_beat instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, help="Memberships updated per transaction.")
+        parser.add_argument(
+            "--schedule", type=int, metavar="MINUTES", help="Run the sweeper every MINUTES minutes through celery beat."
+        )
+
+    def handle(self, *args, **options):
+        kwargs = {"chunk_size": options["chunk_size"]}
+        if options["schedule"]:
+            from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+            interval, _ = IntervalSchedule.objects.get_or_create(
+                every=options["schedule"], period=IntervalSchedule.MINUTES
+            )
+            PeriodicTask.objects.update_or_create(
+                name=PERIODIC_TASK_NAME,
+                defaults={"task": expire_memberships_task.name, "interval": interval, "kwargs": json.dumps(kwargs)},
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Scheduled {expire_memberships_task.name} every {options['schedule']} minutes."
+            ))
+            return
+
+        result = expire_memberships_task.apply(kwargs=kwargs).get()
+        self.stdout.write(self.style.SUCCESS(f"Expired {result['expired']} membership(s)."))
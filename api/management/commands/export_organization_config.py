@@ -0,0 +1,28 @@
+import sys
+
+from accounts.models import Organization
+from django.core.management.base import BaseCommand, CommandError
+
+from api.controllers import OrganizationConfigController
+
+
+class Command(BaseCommand):
+    help = "Write an organization's role templates, tiers, roles and onboardings as NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("organization_id", type=int)
+        parser.add_argument("--output", "-o", help="File to write (default: stdout).")
+        parser.add_argument("--chunk-size", type=int, help="Rows read per query.")
+
+    def handle(self, *args, **options):
+        try:
+            organization = Organization.objects.get(pk=options["organization_id"])
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization {options['organization_id']} does not exist.")
+
+        controller = OrganizationConfigController(organization, chunk_size=options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                output.writelines(controller.export_ndjson())
+        else:
+            sys.stdout.buffer.writelines(controller.export_ndjson())
@@ -0,0 +1,51 @@
+from accounts.models import Organization
+from django.core.management.base import BaseCommand, CommandError
+
+from api.controllers import ConfigImportError, OrganizationConfigController
+
+
+class Command(BaseCommand):
+    help = (
+        "Import an NDJSON organization configuration (see export_organization_config): "
+        "validate the whole file, then bulk-write it in chunked transactions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("organization_id", type=int)
+        parser.add_argument("path", help="NDJSON file to import.")
+        parser.add_argument("--chunk-size", type=int, help="Records written per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate the file.")
+        parser.add_argument(
+            "--overwrite-catalog", action="store_true",
+            help="Update existing role templates and subscription tiers (shared by every organization) too.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            organization = Organization.objects.get(pk=options["organization_id"])
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization {options['organization_id']} does not exist.")
+
+        controller = OrganizationConfigController(
+            organization, chunk_size=options["chunk_size"], overwrite_catalog=options["overwrite_catalog"]
+        )
+        with open(options["path"], "rb") as stream:
+
+            def open_lines():
+                stream.seek(0)
+                return stream
+
+            try:
+                if options["dry_run"]:
+                    counts = controller.validate(open_lines())
+                    self.stdout.write(self.style.SUCCESS(f"Valid: {counts}"))
+                    return
+                result = controller.import_records(open_lines)
+            except ConfigImportError as e:
+                raise CommandError(
+                    "\n".join([str(e)] + [f"line {error['line']}: {error['error']}" for error in e.errors])
+                )
+
+        for record_type, counts in result.items():
+            self.stdout.write(f"{record_type:<18} created {counts['created']:>7}  updated {counts['updated']:>7}")
+        self.stdout.write(self.style.SUCCESS(f"Imported configuration into '{organization.name}'."))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.controllers import CustomOnboardingController
+from api.db import CrossTenantError
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the onboarding data of organizations from the default database to their tenant database. "
+        "Cut-over: migrate the tenant alias, pause the organizations' onboarding writes, run this, "
+        "then add the organizations to TENANT_DATABASES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("organization_ids", type=int, nargs="+")
+        parser.add_argument("--database", required=True, help="Tenant alias to move the rows to.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows copied per query.")
+
+    def handle(self, *args, **options):
+        if options["database"] not in settings.DATABASES:
+            raise CommandError(f"Unknown database alias {options['database']!r}.")
+        try:
+            moved = CustomOnboardingController.move_to_tenant(
+                options["organization_ids"], options["database"], chunk_size=options["chunk_size"]
+            )
+        except CrossTenantError as e:
+            raise CommandError(str(e))
+        for label, count in moved.items():
+            self.stdout.write(f"{label}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"Moved onboarding data to {options['database']}."))
@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.tasks import prune_change_events_task
+
+PERIODIC_TASK_NAME = "api: prune change events"
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep the change-event log bounded: drop events past retention or beyond --max-rows and "
+        "compact superseded ones (CHANGE_EVENT_* settings by default). With --schedule, register "
+        "the task with django_celery_beat instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=int, help="Delete events older than this many days.")
+        parser.add_argument("--max-rows", type=int, help="Keep at most this many of the newest events.")
+        parser.add_argument(
+            "--compact-after-hours", type=int,
+            help="Delete events older than this that a newer event for the same topic and key supersedes.",
+        )
+        parser.add_argument(
+            "--schedule", type=int, metavar="MINUTES", help="Run the pruning every MINUTES minutes through celery beat."
+        )
+
+    def handle(self, *args, **options):
+        kwargs = {
+            "retention_days": options["retention_days"],
+            "max_rows": options["max_rows"],
+            "compact_after_hours": options["compact_after_hours"],
+        }
+        if options["schedule"]:
+            from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+            interval, _ = IntervalSchedule.objects.get_or_create(
+                every=options["schedule"], period=IntervalSchedule.MINUTES
+            )
+            PeriodicTask.objects.update_or_create(
+                name=PERIODIC_TASK_NAME,
+                defaults={"task": prune_change_events_task.name, "interval": interval, "kwargs": json.dumps(kwargs)},
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Scheduled {prune_change_events_task.name} every {options['schedule']} minutes."
+            ))
+            return
+
+        result = prune_change_events_task.apply(kwargs=kwargs).get()
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {result['expired']}, trimmed {result['trimmed']} and compacted {result['compacted']} event(s)."
+        ))
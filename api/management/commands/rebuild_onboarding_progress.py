@@ -0,0 +1,25 @@
+from accounts.models import Onboarding
+from django.core.management.base import BaseCommand
+
+from api.controllers import CustomOnboardingController
+
+
+class Command(BaseCommand):
+    help = "Recompute per-user onboarding progress rows from completed steps."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--onboarding", action="append", dest="onboardings", metavar="NAME",
+            help="Onboarding name to rebuild; repeat for several. Defaults to all onboardings.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        onboardings = Onboarding.objects.order_by("id")
+        if options["onboardings"]:
+            onboardings = onboardings.filter(name__in=options["onboardings"])
+
+        for onboarding in onboardings:
+            written = CustomOnboardingController.rebuild_progress(onboarding, batch_size=options["batch_size"])
+            self.stdout.write(f"{onboarding.name}: {written} progress rows rebuilt")
+        self.stdout.write(self.style.SUCCESS("Done."))
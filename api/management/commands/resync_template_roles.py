@@ -0,0 +1,23 @@
+from accounts.models import RoleTemplate
+from django.core.management.base import BaseCommand, CommandError
+
+from api.controllers import CustomRoleController
+
+
+class Command(BaseCommand):
+    help = "Re-apply a role template to every role derived from it, writing only the differences."
+
+    def add_arguments(self, parser):
+        parser.add_argument("template_id", type=int)
+        parser.add_argument("--chunk-size", type=int, default=500, help="Roles per transaction.")
+
+    def handle(self, *args, **options):
+        try:
+            template = RoleTemplate.objects.get(pk=options["template_id"])
+        except RoleTemplate.DoesNotExist:
+            raise CommandError(f"Role template {options['template_id']} does not exist.")
+
+        result = CustomRoleController().resync_roles_from_template(template, chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-synced {result['roles']} roles from '{template.name}'; {result['changed']} changed."
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.mail import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = "Deliver emails queued with EMAIL_QUEUE_MODE 'database'."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=100, help="Maximum emails to send per batch.")
+        parser.add_argument("--drain", action="store_true", help="Keep sending batches until the queue is empty.")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_queued_mail(limit=options["limit"])
+            total_sent += sent
+            total_failed += failed
+            if not options["drain"] or not sent:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Sent {total_sent} email(s), {total_failed} failed."))
@@ -0,0 +1,64 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.api_settings import api_settings
+from api.startup import measure_startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Start a fresh interpreter per settings profile and report the time spent in "
+        "settings, django.setup() and URLconf loading, resident memory afterwards and the "
+        "import cost per installed app. Fails when STARTUP_BUDGET_MS or "
+        "STARTUP_BUDGET_RSS_MB (or --budget-ms/--budget-mb) is exceeded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile", action="append", metavar="SETTINGS_MODULE",
+            help="Settings module to measure (repeatable, default: the current one).",
+        )
+        parser.add_argument("--top", type=int, default=15, help="Import costs to list per profile.")
+        parser.add_argument("--budget-ms", type=float, help="Maximum startup_ms per profile.")
+        parser.add_argument("--budget-mb", type=float, help="Maximum resident memory (MB) per profile.")
+        parser.add_argument("--json", action="store_true", help="Print the full reports as JSON.")
+
+    def handle(self, *args, **options):
+        budget_ms = options["budget_ms"] or api_settings.STARTUP_BUDGET_MS
+        budget_mb = options["budget_mb"] or api_settings.STARTUP_BUDGET_RSS_MB
+        try:
+            reports = [
+                measure_startup(profile)
+                for profile in options["profile"] or [os.environ["DJANGO_SETTINGS_MODULE"]]
+            ]
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(reports, indent=2))
+        else:
+            for report in reports:
+                self.write_report(report, options["top"])
+
+        violations = []
+        for report in reports:
+            if budget_ms and report["startup_ms"] > budget_ms:
+                violations.append(f"{report['settings_module']}: startup {report['startup_ms']:.0f} ms > {budget_ms:g} ms")
+            if budget_mb and report["rss_mb"] > budget_mb:
+                violations.append(f"{report['settings_module']}: RSS {report['rss_mb']:.1f} MB > {budget_mb:g} MB")
+        if violations:
+            raise CommandError("Startup budget exceeded:\n" + "\n".join(violations))
+
+    def write_report(self, report, top):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['settings_module']}: {len(report['installed_apps'])} apps"
+        ))
+        self.stdout.write(
+            f"  settings {report['settings_ms']:.1f} ms, setup {report['setup_ms']:.1f} ms, "
+            f"urls {report['urls_ms']:.1f} ms, startup {report['startup_ms']:.1f} ms "
+            f"(process {report['process_ms']:.1f} ms), RSS {report['rss_mb']:.1f} MB"
+        )
+        for name, ms, is_app in report["imports"][:top]:
+            self.stdout.write(f"  {ms:9.1f} ms  {name}{'' if is_app else ' (package)'}")
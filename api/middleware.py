@@ -0,0 +1,101 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db import connections
+
+from .api_settings import api_settings
+from .async_views import AsyncAPIView
+from .cache import _request_store
+from .instrumentation import QueryRecorder, registry
+from .permissions import HasEndpointPermission
+from .views import BaseAPIView
+
+
+class RequestCacheMiddleware:
+    """Give every request a fresh api.cache.request_store() dict."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _request_store.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _request_store.reset(token)
+
+    async def __acall__(self, request):
+        token = _request_store.set({})
+        try:
+            return await self.get_response(request)
+        finally:
+            _request_store.reset(token)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Opt-in (INSTRUMENTATION_ENABLED) per-view latency, query count/time and N+1
+    histograms, readable through MetricsView, plus a sampled slow-query log.
+    """
+
+    def __init__(self, get_response):
+        if not api_settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._api_query_recorder = recorder
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            started = time.perf_counter()
+            response = self.get_response(request)
+            latency_ms = (time.perf_counter() - started) * 1000
+        if recorder.view_name:
+            registry.record(recorder.view_name, latency_ms, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "view_class", view_func)
+        request._api_query_recorder.view_name = getattr(view, "__name__", repr(view))
+
+
+class EndpointPermissionMiddleware:
+    """
+    HasEndpointPermission for the views that do not check it themselves: the
+    accounts views, the admin and any other Django view, for the session user.
+    api.views and api.async_views check it after their own authentication
+    (tokens, API keys), and views declaring AllowAny stay public, so every request
+    is authorized once, from the compiled endpoint index.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "view_class", None)
+        if view is not None and issubclass(view, (AsyncAPIView, BaseAPIView)):
+            return None
+        if not HasEndpointPermission.guards(view):
+            return None
+        if not HasEndpointPermission().has_permission(request, view):
+            raise PermissionDenied
+        return None
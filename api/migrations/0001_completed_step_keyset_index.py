@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Keyset pagination of completed steps walks (date_completed, id) in order.
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS "api_completedstep_date_id_idx" '
+                'ON "accounts_completedonboardingstep" ("date_completed", "id");',
+            reverse_sql='DROP INDEX IF EXISTS "api_completedstep_date_id_idx";',
+        ),
+    ]
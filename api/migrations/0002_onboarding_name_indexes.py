@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_alter_customuser_managers_remove_customuser_username_and_more"),
+        ("api", "0001_completed_step_keyset_index"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS "api_onboarding_name_idx" ON "accounts_onboarding" ("name");',
+            reverse_sql='DROP INDEX IF EXISTS "api_onboarding_name_idx";',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS "api_onboardingstep_name_idx" '
+                'ON "accounts_onboardingstep" ("onboarding_id", "name");',
+            reverse_sql='DROP INDEX IF EXISTS "api_onboardingstep_name_idx";',
+        ),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, transaction
+from django.db.models import Count, F, Q
+
+
+def compact_duplicates(apps, schema_editor):
+    # Frozen copy of CustomOnboardingController.compact_completed_steps: keep the
+    # latest row (date_completed, then id) per (user, onboarding_step) and move its
+    # siblings' links onto it.
+    CompletedOnboardingStep = apps.get_model("accounts", "CompletedOnboardingStep")
+    duplicates = (
+        CompletedOnboardingStep.objects.values("user_id", "onboarding_step_id")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    while groups := list(duplicates[:500]):
+        match = Q()
+        for group in groups:
+            match |= Q(user_id=group["user_id"], onboarding_step_id=group["onboarding_step_id"])
+        with transaction.atomic(using=schema_editor.connection.alias):
+            rows = list(CompletedOnboardingStep.objects.filter(match).order_by(
+                F("date_completed").asc(nulls_first=True), "id"
+            ).values_list("id", "user_id", "onboarding_step_id"))
+            keep = {(user_id, step_id): pk for pk, user_id, step_id in rows}
+            stale = {pk: keep[(user_id, step_id)] for pk, user_id, step_id in rows if pk != keep[(user_id, step_id)]}
+            for relation, target in (("organizations", "organization_id"), ("branches", "branch_id")):
+                through = getattr(CompletedOnboardingStep, relation).through
+                links = through.objects.filter(completedonboardingstep_id__in=list(stale)).values_list(
+                    "completedonboardingstep_id", target
+                )
+                through.objects.bulk_create(
+                    [through(completedonboardingstep_id=stale[pk], **{target: related_id}) for pk, related_id in links],
+                    ignore_conflicts=True,
+                )
+                through.objects.filter(completedonboardingstep_id__in=list(stale)).delete()
+            CompletedOnboardingStep.objects.filter(id__in=list(stale)).delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("api", "0002_onboarding_name_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            sql='CREATE UNIQUE INDEX IF NOT EXISTS "api_completedstep_user_step_uniq" '
+                'ON "accounts_completedonboardingstep" ("user_id", "onboarding_step_id");',
+            reverse_sql='DROP INDEX IF EXISTS "api_completedstep_user_step_uniq";',
+        ),
+    ]
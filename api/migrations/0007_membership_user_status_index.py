@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_rolesignature"),
+    ]
+
+    operations = [
+        # Serves the current-membership lookup (user, status, latest id) from the index alone.
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS "api_membershiptier_user_status_idx" '
+                'ON "accounts_membershiptier" ("user_id", "subscription_status", "id");',
+            reverse_sql='DROP INDEX IF EXISTS "api_membershiptier_user_status_idx";',
+        ),
+    ]
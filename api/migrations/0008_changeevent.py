@@ -0,0 +1,29 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_membership_user_status_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeEvent",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("topic", models.CharField(max_length=32)),
+                ("key", models.CharField(max_length=64)),
+                ("action", models.CharField(max_length=32)),
+                ("data", models.JSONField(default=dict)),
+                ("created_at", models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["topic", "id"], name="api_changeevent_topic_idx"),
+                    models.Index(fields=["topic", "key", "id"], name="api_changeevent_key_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+import hashlib
+import json
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def role_signature(name, access_level, organization_ids, branch_ids):
+    # Frozen copy of CustomRoleController.role_signature.
+    canonical = json.dumps([name, access_level, sorted(set(organization_ids)), sorted(set(branch_ids))])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def backfill_role_signatures(apps, schema_editor):
+    """Sign every role created before RoleSignature; roles named after a template are linked to it."""
+    Role = apps.get_model("accounts", "Role")
+    RoleTemplate = apps.get_model("accounts", "RoleTemplate")
+    RoleSignature = apps.get_model("api", "RoleSignature")
+    templates = {
+        (name, access_level): template_id
+        for template_id, name, access_level in RoleTemplate.objects.values_list("id", "name", "access_level")
+    }
+    signed = RoleSignature.objects.values("role_id")
+    last_pk = 0
+    while roles := list(
+        Role.objects.filter(pk__gt=last_pk).exclude(pk__in=signed).order_by("pk").values_list(
+            "pk", "name", "access_level"
+        )[:1000]
+    ):
+        last_pk = roles[-1][0]
+        role_ids = [pk for pk, _, _ in roles]
+        links = {}
+        for relation, column in (("organizations", "organization_id"), ("branches", "branch_id")):
+            links[relation] = defaultdict(list)
+            through = getattr(Role, relation).through
+            for role_id, related_id in through.objects.filter(role_id__in=role_ids).values_list("role_id", column):
+                links[relation][role_id].append(related_id)
+        RoleSignature.objects.bulk_create(
+            [
+                RoleSignature(
+                    role_id=pk,
+                    template_id=templates.get((name, access_level)),
+                    signature=role_signature(name, access_level, links["organizations"][pk], links["branches"][pk]),
+                )
+                for pk, name, access_level in roles
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_alter_customuser_managers_remove_customuser_username_and_more"),
+        ("api", "0008_changeevent"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_role_signatures, migrations.RunPython.noop),
+    ]
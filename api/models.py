@@ -1,3 +1,76 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class OnboardingProgress(models.Model):
+    """
+    Denormalized per-user progress through an onboarding, kept up to date by
+    CustomOnboardingController so progress reads are a single indexed row fetch.
+    Only completions with status "done" count.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+    onboarding = models.ForeignKey("accounts.Onboarding", on_delete=models.CASCADE, related_name="+")
+    completed_count = models.PositiveIntegerField(default=0)
+    required_remaining = models.PositiveIntegerField(default=0)
+    total_steps = models.PositiveIntegerField(default=0)
+    current_level = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "onboarding"], name="api_onboardingprogress_user_onboarding_uniq"),
+        ]
+
+    @property
+    def percent(self):
+        if not self.total_steps:
+            return 0.0
+        return round(100 * min(self.completed_count, self.total_steps) / self.total_steps, 1)
+
+
+class QueuedEmail(models.Model):
+    """An outgoing email waiting for delivery by send_queued_mail (EMAIL_QUEUE_MODE "database")."""
+
+    message_data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+
+class RoleSignature(models.Model):
+    """
+    Canonical fingerprint of a role's identity (name, access level and sorted
+    organization/branch ids) kept by CustomRoleController on every role write,
+    and by api.signals after writes made elsewhere, so finding an existing role
+    is a single indexed lookup.
+    """
+
+    role = models.OneToOneField("accounts.Role", on_delete=models.CASCADE, related_name="+")
+    template = models.ForeignKey(
+        "accounts.RoleTemplate", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    signature = models.CharField(max_length=64, unique=True)
+
+
+class ChangeEvent(models.Model):
+    """
+    Append-only log of role, membership and onboarding writes, recorded by
+    api.events.record_changes and inserted once the write commits. The id is the
+    feed cursor; key names what changed within the topic (compaction keeps the
+    newest event per topic and key by created_at).
+    """
+
+    topic = models.CharField(max_length=32)
+    key = models.CharField(max_length=64)
+    action = models.CharField(max_length=32)
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["topic", "id"], name="api_changeevent_topic_idx"),
+            models.Index(fields=["topic", "key", "id"], name="api_changeevent_key_idx"),
+        ]
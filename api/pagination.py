@@ -0,0 +1,35 @@
+import base64
+
+from django.utils.dateparse import parse_datetime
+
+from .renderers import json_bytes
+
+
+def encode_cursor(date_completed, pk):
+    raw = f"{date_completed.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (date_completed, pk) from an encode_cursor() value; raise ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_value, pk = raw.rsplit("|", 1)
+        date_completed = parse_datetime(date_value)
+        pk = int(pk)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if date_completed is None:
+        raise ValueError("Invalid cursor.")
+    return date_completed, pk
+
+
+def stream_json_list(key, chunks):
+    """Yield the bytes of {"<key>": [...]} from an iterable of row lists."""
+    yield f'{{"{key}": ['.encode()
+    first = True
+    for rows in chunks:
+        for row in rows:
+            yield (b"" if first else b",") + json_bytes(row)
+            first = False
+    yield b"]}"
@@ -0,0 +1,32 @@
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser backed by orjson for UTF-8 bodies, falling back to the stdlib parser otherwise."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
+
+
+def json_loads(data):
+    """Parse JSON from bytes or str with orjson when installed, the stdlib otherwise."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,79 @@
+from accounts.models import OrganizationApiKey, Role
+from django.utils import timezone
+from rest_framework.permissions import AllowAny, BasePermission
+from rest_framework.views import APIView
+from rest_framework_api_key.permissions import BaseHasAPIKey
+
+from .cache import CredentialCache
+from .endpoint_index import endpoint_index
+
+
+class HasOrganizationAPIKey(BaseHasAPIKey):
+    """
+    API-key permission for OrganizationApiKey that runs the password hasher once
+    per CredentialCache entry. Sets request.api_key to the cached entry:
+    api_key_id, organization_id and the organization's role_ids. On routes with
+    an organization_id the key must belong to that organization.
+    """
+
+    model = OrganizationApiKey
+
+    def has_permission(self, request, view):
+        key = self.get_key(request)
+        if not key:
+            return False
+        request.api_key = CredentialCache.get_or_verify("api-key", key, self.verify_key)
+        if request.api_key is None:
+            return False
+        organization_id = view.kwargs.get("organization_id")
+        return organization_id is None or str(organization_id) == str(request.api_key["organization_id"])
+
+    def verify_key(self, key):
+        try:
+            api_key = self.model.objects.get_from_key(key)
+        except self.model.DoesNotExist:
+            return None
+        if api_key.has_expired:
+            return None
+
+        timeout = None
+        if api_key.expiry_date is not None:
+            timeout = (api_key.expiry_date - timezone.now()).total_seconds()
+        entry = {
+            "api_key_id": api_key.pk,
+            "organization_id": api_key.organization_id,
+            "role_ids": list(Role.objects.filter(organizations=api_key.organization_id).values_list("pk", flat=True)),
+            "tags": ["api-keys", f"api-key:{api_key.pk}", f"organization:{api_key.organization_id}"],
+        }
+        return entry, timeout
+
+
+class HasEndpointPermission(BasePermission):
+    """
+    Guard the paths registered as Endpoint rows: the request passes when one of
+    the caller's roles (the user's, or the organization's for API keys) has a
+    scope whose endpoints match request.path, answered from one snapshot of the
+    compiled EndpointPermissionIndex. Unregistered paths and superusers always
+    pass. Views that declare AllowAny are not guarded.
+    """
+
+    def has_permission(self, request, view):
+        index = endpoint_index.snapshot()
+        matched = index.match(request.path)
+        if not matched:
+            return True
+        user = request.user
+        if user and user.is_superuser:
+            return True
+        api_key = getattr(request, "api_key", None)
+        if api_key is not None:
+            return bool(index.role_bits(api_key["role_ids"]) & matched)
+        if not user or not user.is_authenticated:
+            return False
+        return bool(index.user_bits(user) & matched)
+
+    @staticmethod
+    def guards(view_class):
+        """Is view_class subject to this check? Not when it declares AllowAny (the DRF default does not count)."""
+        permission_classes = getattr(view_class, "permission_classes", ())
+        return permission_classes is APIView.permission_classes or AllowAny not in permission_classes
@@ -0,0 +1,34 @@
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+# Z suffix for UTC datetimes, like DRF's encoder; dict keys may be ints (e.g. grouped ids).
+ORJSON_OPTIONS = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def json_bytes(data):
+    """Compact JSON bytes of data, with orjson when installed and DRF's encoder otherwise."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+    return _encoder.encode(data).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson, falling back to DRF's stdlib rendering when
+    orjson is missing or an indented (browsable/?indent) response is requested.
+    Types orjson does not know (Decimal, lazy strings, QuerySets...) go through
+    DRF's JSONEncoder.default.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type or "", renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        return json_bytes(data)
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .db import active_tenant_database, reading_from_replica, tenant_databases
+
+REPLICA_DB_ALIAS = "replica"
+
+# Organization-scoped onboarding data; their auto-created M2M tables follow them.
+# Roles and memberships stay shared on purpose: a role is an auth Group that users
+# hold through the user table's M2M, and both roles and memberships are linked to
+# any number of organizations, so no single tenant alias owns them. Tenants stop
+# contending on onboarding writes (the bulk of them); role and membership writes
+# keep the default alias's writer.
+TENANT_MODELS = {
+    ("accounts", "onboarding"),
+    ("accounts", "onboardingstep"),
+    ("accounts", "completedonboardingstep"),
+    ("api", "onboardingprogress"),
+}
+
+
+def is_tenant_model(model):
+    opts = model._meta
+    if opts.auto_created:
+        opts = opts.auto_created._meta
+    return (opts.app_label, opts.model_name) in TENANT_MODELS
+
+
+class TenantRouter:
+    """
+    Send tenant-scoped models (TENANT_MODELS) to the alias chosen by
+    api.db.using_tenant(), or to the alias an instance was loaded from. Outside a
+    using_tenant() block they fall through to the next router, as do the shared
+    models (users, organizations, roles, memberships, templates, tiers,
+    endpoints), which always live in the default alias, also when reached from a
+    tenant row. Tenant aliases carry the full schema so their foreign key columns
+    resolve, but only tenant rows; many-to-many links from tenant rows to shared
+    rows live with the tenant row, so read their through table by id (see
+    CustomOnboardingController.attach_completed_step_relations) rather than the
+    related manager, which would join across databases.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Tenant rows point at shared rows by id; see api.db.apply_sqlite_pragmas.
+        aliases = tenant_databases()
+        if obj1._state.db in aliases or obj2._state.db in aliases:
+            return True
+        return None
+
+    @staticmethod
+    def _db_for(model, hints):
+        instance = hints.get("instance")
+        on_tenant = instance is not None and instance._state.db in tenant_databases()
+        if not is_tenant_model(model):
+            # Shared rows reached from a tenant row (completed_step.user) are never in its alias.
+            return DEFAULT_DB_ALIAS if on_tenant else None
+        if on_tenant:
+            return instance._state.db
+        return active_tenant_database()
+
+
+class ReadReplicaRouter:
+    """
+    Send reads issued under api.db.read_from_replica() (read-only views) to the
+    "replica" alias when it is configured; everything else uses the default alias.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reading_from_replica() and self.replica_available():
+            return REPLICA_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Instances read from the replica must still be saved to the primary.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == REPLICA_DB_ALIAS:
+            return False
+        return None
+
+    @staticmethod
+    def replica_available():
+        # Under the test runner the replica mirrors the default test database on a
+        # separate connection, which cannot see the test case's open transaction.
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            return False
+        return connections[REPLICA_DB_ALIAS].settings_dict["NAME"] != connections[DEFAULT_DB_ALIAS].settings_dict["NAME"]
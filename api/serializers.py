@@ -1,7 +1,46 @@
 from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
 from accounts.models import CompletedOnboardingStep
 
 class CompletedOnboardingStepSerializer(serializers.ModelSerializer):
+    # Fields whose representation of a .values() value is the value itself.
+    passthrough_fields = (
+        serializers.IntegerField,
+        serializers.CharField,
+        serializers.BooleanField,
+        serializers.ChoiceField,
+        RelatedField,
+        ManyRelatedField,
+    )
+    _row_converters = None
+
     class Meta:
         model = CompletedOnboardingStep
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+    @classmethod
+    def represent_rows(cls, rows):
+        """
+        Fast path for CompletedOnboardingStepSerializer(instances, many=True).data
+        that works on .values() rows (foreign keys as ids, organizations/branches as
+        id lists, see CustomOnboardingController.attach_completed_step_relations).
+        No model instances are built and plain fields skip to_representation.
+        """
+        converters = cls.row_converters()
+        return [
+            {
+                name: convert(row[name]) if convert is not None and row[name] is not None else row[name]
+                for name, convert in converters
+            }
+            for row in rows
+        ]
+
+    @classmethod
+    def row_converters(cls):
+        if cls._row_converters is None:
+            cls._row_converters = [
+                (name, None if isinstance(field, cls.passthrough_fields) else field.to_representation)
+                for name, field in cls().fields.items()
+                if not field.write_only
+            ]
+        return cls._row_converters
@@ -0,0 +1,226 @@
+from functools import partial
+
+from accounts.models import Endpoint, MembershipTier, OrganizationApiKey, Role, RoleTemplate, Scope, SubscriptionTier
+from allauth.account.signals import email_confirmed
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .cache import CredentialCache, MembershipCache, RoleCache, TierCatalogCache, TierRoleTemplateCache
+from .controllers import CustomOnboardingController, CustomRoleController
+from .endpoint_index import endpoint_index
+from .events import flush_change_events
+
+
+@receiver(post_save, sender=OrganizationApiKey)
+@receiver(post_delete, sender=OrganizationApiKey)
+def invalidate_api_key(sender, instance, **kwargs):
+    CredentialCache.invalidate(f"api-key:{instance.pk}")
+
+
+@receiver(post_delete, sender=Token)
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_credentials(sender, instance, **kwargs):
+    CredentialCache.invalidate(f"user:{instance.user_id if sender is Token else instance.pk}")
+
+
+@receiver(m2m_changed, sender=Role.organizations.through)
+def invalidate_organization_credentials(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        CredentialCache.invalidate(f"organization:{instance.pk}")
+    elif pk_set:
+        CredentialCache.invalidate(*(f"organization:{organization_id}" for organization_id in pk_set))
+    else:
+        # role.organizations.clear() does not report which organizations were affected.
+        CredentialCache.invalidate("api-keys")
+
+
+@receiver(post_save, sender=Role)
+def resign_saved_role(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(CustomRoleController.resign_roles, [instance.pk]), using=using)
+
+
+@receiver(m2m_changed, sender=Role.organizations.through)
+@receiver(m2m_changed, sender=Role.branches.through)
+def resign_relinked_roles(sender, instance, action, reverse, pk_set, using, **kwargs):
+    # Keeps RoleSignature current when links change in the admin, the accounts views or the base controller.
+    if not reverse:
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return
+        role_ids = [instance.pk]
+    elif action == "pre_clear":
+        # post_clear does not report which roles lost the link.
+        related_field = next(field for field in sender._meta.fields if field.related_model not in (None, Role))
+        role_ids = list(sender.objects.filter(**{related_field.attname: instance.pk}).values_list("role_id", flat=True))
+    elif action in ("post_add", "post_remove"):
+        role_ids = list(pk_set)
+    else:
+        return
+    if role_ids:
+        transaction.on_commit(partial(CustomRoleController.resign_roles, role_ids), using=using)
+
+
+@receiver(m2m_changed, sender=get_user_model().role.through)
+def invalidate_user_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    # Covers the base RoleController, the accounts views and the admin as well.
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            RoleCache.invalidate(instance.pk)
+    elif action == "pre_clear":
+        # post_clear does not report which users lost the role.
+        RoleCache.invalidate(*sender.objects.filter(role_id=instance.pk).values_list("customuser_id", flat=True))
+    elif action in ("post_add", "post_remove") and pk_set:
+        RoleCache.invalidate(*pk_set)
+
+
+@receiver(request_finished)
+def write_change_events(sender, **kwargs):
+    # The change events of the request's committed writes, after the response went out.
+    flush_change_events()
+
+
+@receiver(email_confirmed)
+def complete_verify_email_step(sender, request, email_address, **kwargs):
+    CustomOnboardingController().confirm_signup_email(email_address.user)
+
+
+@receiver(post_save, sender=MembershipTier)
+@receiver(post_delete, sender=MembershipTier)
+def invalidate_membership(sender, instance, **kwargs):
+    # Covers the base controller, webhooks and the admin as well.
+    MembershipCache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=SubscriptionTier)
+@receiver(post_delete, sender=SubscriptionTier)
+@receiver(post_save, sender=RoleTemplate)
+@receiver(post_delete, sender=RoleTemplate)
+def invalidate_tier_catalog(sender, instance, **kwargs):
+    TierCatalogCache.invalidate()
+
+
+@receiver(m2m_changed, sender=SubscriptionTier.role_templates.through)
+def invalidate_tier_templates(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    TierCatalogCache.invalidate()
+    if not reverse:
+        TierRoleTemplateCache.invalidate(instance.pk)
+    elif pk_set:
+        TierRoleTemplateCache.invalidate(*pk_set)
+
+
+@receiver(post_save, sender=RoleTemplate)
+def invalidate_template_tiers(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(TierRoleTemplateCache.invalidate_templates, instance.pk), using=using)
+
+
+@receiver(pre_delete, sender=RoleTemplate)
+def invalidate_deleted_template_tiers(sender, instance, using, **kwargs):
+    # The tier links are gone by post_delete.
+    tier_ids = TierRoleTemplateCache.tier_ids_of([instance.pk])
+    transaction.on_commit(partial(TierRoleTemplateCache.invalidate, *tier_ids), using=using)
+
+
+@receiver(m2m_changed, sender=RoleTemplate.scopes.through)
+@receiver(m2m_changed, sender=RoleTemplate.custom_permissions.through)
+@receiver(m2m_changed, sender=RoleTemplate.serializers.through)
+@receiver(m2m_changed, sender=RoleTemplate.user_permissions.through)
+def invalidate_template_relations(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if not reverse:
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return
+        template_ids = [instance.pk]
+    elif action == "pre_clear":
+        # post_clear does not report which templates lost the link.
+        related_model = instance._meta.concrete_model
+        template_field = next(field for field in sender._meta.fields if field.related_model is RoleTemplate)
+        related_field = next(field for field in sender._meta.fields if field.related_model is related_model)
+        template_ids = list(
+            sender.objects.filter(**{related_field.attname: instance.pk}).values_list(template_field.attname, flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        template_ids = pk_set
+    else:
+        return
+    if template_ids:
+        transaction.on_commit(partial(TierRoleTemplateCache.invalidate_templates, *template_ids), using=using)
+
+
+# The endpoint index is shared by the whole process, so changes are applied once they commit;
+# EndpointPermissionIndex then tells the other processes to rebuild.
+
+@receiver(post_save, sender=Endpoint)
+def index_endpoint(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(endpoint_index.update_endpoint, instance.pk, instance.url), using=using)
+
+
+@receiver(post_delete, sender=Endpoint)
+def unindex_endpoint(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(endpoint_index.remove_endpoint, instance.pk), using=using)
+
+
+@receiver(post_delete, sender=Scope)
+def unindex_scope(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(_unindex_scope, instance.pk), using=using)
+
+
+def _unindex_scope(scope_id):
+    endpoint_index.forget_scope_roles(scope_id)
+    endpoint_index.clear_scope(scope_id)
+
+
+@receiver(post_delete, sender=Role)
+def unindex_role(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(endpoint_index.forget_roles, [instance.pk]), using=using)
+
+
+@receiver(m2m_changed, sender=Scope.endpoint.through)
+def reindex_scope_endpoints(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(
+            partial(_reindex_scope_endpoints, instance.pk, action, reverse, set(pk_set or ())), using=using
+        )
+
+
+def _reindex_scope_endpoints(instance_id, action, reverse, pk_set):
+    add = action == "post_add"
+    if not reverse:
+        if action == "post_clear":
+            endpoint_index.clear_scope(instance_id)
+        else:
+            endpoint_index.change_scope_endpoints(instance_id, pk_set, add)
+    elif action == "post_clear":
+        endpoint_index.detach_endpoint(instance_id)
+    else:
+        for scope_id in pk_set:
+            endpoint_index.change_scope_endpoints(scope_id, [instance_id], add)
+
+
+@receiver(m2m_changed, sender=Role.scopes.through)
+def reindex_role_scopes(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        transaction.on_commit(
+            partial(_reindex_role_scopes, instance.pk, action, reverse, set(pk_set or ())), using=using
+        )
+
+
+def _reindex_role_scopes(instance_id, action, reverse, pk_set):
+    add = action == "post_add"
+    if not reverse:
+        if action == "post_clear":
+            endpoint_index.forget_roles([instance_id])
+        else:
+            endpoint_index.change_role_scopes(instance_id, pk_set, add)
+    elif action == "post_clear":
+        endpoint_index.forget_scope_roles(instance_id)
+    else:
+        for role_id in pk_set:
+            endpoint_index.change_role_scopes(role_id, [instance_id], add)
@@ -0,0 +1,101 @@
+"""
+Startup cost of a settings profile, measured in a fresh interpreter:
+`python -X importtime -m api.startup` with DJANGO_SETTINGS_MODULE set runs
+django.setup() and loads the URLconf, then prints the phase timings and resident
+memory as JSON; measure_startup() runs it and attributes the import time to the
+installed apps. Only stdlib is imported at module level so the child measures
+Django from a cold start.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+\d+\s+\|(\s*)(\S+)\s*$")
+
+
+def resident_memory_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def import_cost_by_app(importtime_output, installed_apps):
+    """
+    Sum the self import time (ms) of every module under the longest matching
+    installed app name, or under its top-level package when no app matches.
+    Returns [(name, ms, is_app)], most expensive first.
+    """
+    apps = sorted(installed_apps, key=len, reverse=True)
+    costs = {}
+    for line in importtime_output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, module = int(match.group(1)), match.group(3)
+        owner = next((app for app in apps if module == app or module.startswith(app + ".")), None)
+        key = (owner, True) if owner else (module.split(".", 1)[0], False)
+        costs[key] = costs.get(key, 0) + self_us
+    return sorted(
+        ((name, round(us / 1000, 3), is_app) for (name, is_app), us in costs.items()),
+        key=lambda cost: cost[1],
+        reverse=True,
+    )
+
+
+def measure_startup(settings_module, python=None):
+    """Start a fresh interpreter on settings_module and return its startup report."""
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings_module}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [python or sys.executable, "-X", "importtime", "-m", "api.startup"],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True,
+    )
+    process_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"{settings_module} failed to start:\n{result.stderr[-2000:]}")
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["process_ms"] = round(process_ms, 3)
+    report["imports"] = import_cost_by_app(result.stderr, report["installed_apps"])
+    return report
+
+
+def _report():
+    started = time.perf_counter()
+    import django
+    from django.conf import settings
+
+    settings.INSTALLED_APPS
+    configured = time.perf_counter()
+    django.setup()
+    populated = time.perf_counter()
+    from django.apps import apps
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+    loaded = time.perf_counter()
+
+    print(json.dumps({
+        "settings_module": os.environ["DJANGO_SETTINGS_MODULE"],
+        "installed_apps": [app_config.name for app_config in apps.get_app_configs()],
+        "settings_ms": round((configured - started) * 1000, 3),
+        "setup_ms": round((populated - configured) * 1000, 3),
+        "urls_ms": round((loaded - populated) * 1000, 3),
+        "startup_ms": round((loaded - started) * 1000, 3),
+        "rss_mb": round(resident_memory_mb(), 1),
+    }))
+
+
+if __name__ == "__main__":
+    _report()
@@ -0,0 +1,24 @@
+from celery import shared_task
+
+from .controllers import CustomMembershipController
+from .events import prune_change_events
+from .mail import send_queued_mail
+
+
+@shared_task(name="api.send_queued_mail")
+def send_queued_mail_task(limit=100):
+    sent, failed = send_queued_mail(limit=limit)
+    return {"sent": sent, "failed": failed}
+
+
+@shared_task(name="api.expire_memberships")
+def expire_memberships_task(chunk_size=None):
+    expired_ids = CustomMembershipController.expire_retired_tier_memberships(chunk_size=chunk_size)
+    return {"expired": len(expired_ids)}
+
+
+@shared_task(name="api.prune_change_events")
+def prune_change_events_task(retention_days=None, max_rows=None, compact_after_hours=None):
+    return prune_change_events(
+        retention_days=retention_days, max_rows=max_rows, compact_after_hours=compact_after_hours
+    )
@@ -1,3 +1,2033 @@
-from django.test import TestCase
+import base64
+import importlib
+import io
+import json
+import os
+import statistics
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from accounts.models import (
+    Branch, CompletedOnboardingStep, Endpoint, MembershipTier, Onboarding, OnboardingStep, Organization,
+    Role, RoleTemplate, Scope, SubscriptionTier,
+)
+from allauth.account.signals import email_confirmed
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import OperationalError, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import Client, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers as drf_serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from .api_settings import api_settings
+from .async_views import AsyncAPIView
+from .authentication import CachedTokenAuthentication
+from .cache import (
+    CredentialCache, MembershipCache, OnboardingDefinitionCache, RoleCache, TierCatalogCache, TierRoleTemplateCache,
+)
+from .controllers import (
+    ConfigImportError, CustomMembershipController, CustomOnboardingController, CustomRoleController,
+    OrganizationConfigController,
+)
+from .db import CrossTenantError, apply_sqlite_pragmas, retry_on_locked, tenant_database_for, using_tenant
+from .endpoint_index import EndpointPermissionIndex, IndexSnapshot, endpoint_index
+from .events import change_event, events_since, flush_change_events, prune_change_events, record_changes
+from .instrumentation import registry
+from .middleware import EndpointPermissionMiddleware, RequestCacheMiddleware
+from .mail import deliver_or_queue, send_queued_mail
+from .pagination import encode_cursor
+from .permissions import HasEndpointPermission
+from .models import ChangeEvent, OnboardingProgress, QueuedEmail, RoleSignature
+from .renderers import FastJSONRenderer
+from .routers import REPLICA_DB_ALIAS, TenantRouter
+from .serializers import CompletedOnboardingStepSerializer
+from .signals import write_change_events
+from .startup import measure_startup
+from .views import UserRolesView, tenant_organization_ids
+
+# Full-size dataset; API_BENCH_SCALE shrinks it (default 1%) so the suite also runs in CI.
+FULL_DATASET = {
+    "users": 100_000,
+    "roles": 10_000,
+    "organizations": 100,
+    "steps_per_user": 10,
+    "memberships": 10_000,
+}
+BENCH_SCALE = float(os.getenv("API_BENCH_SCALE", "0.01"))
+BENCH_ITERATIONS = int(os.getenv("API_BENCH_ITERATIONS", "20"))
+BENCH_OUTPUT_DIR = Path(os.getenv("API_BENCH_OUTPUT_DIR", settings.BASE_DIR / "bench_results"))
+BATCH_SIZE = 5000
+
+# Queries each endpoint may run on a warm cache, on top of the per-request baseline
+# of the middleware stack (session, user and permission lookups).
+QUERY_BUDGETS = {
+    "user-roles": 1,
+    "assign-role": 12,
+    "assign-role-bulk": 10,
+    "roles-create-or-update": 25,
+    "onboarding-create": 10,
+    "onboarding-step-create": 8,
+    "completed-steps": 4,
+    "onboarding-step-done": 4,
+    "onboarding-step-done-bulk": 4,
+    "onboarding-progress": 2,
+    "onboarding-next-steps": 1,
+    "onboarding-next-steps-bulk": 1,
+    "cancel-membership": 6,
+    "memberships-bulk-status": 8,
+    "assign-membership-roles": 6,
+    "create-membership": 5,
+    "create-subscription-tier": 6,
+    "subscription-tier-catalog": 0,
+    "organization-config-export": 20,
+    "organization-config-import": 40,
+    "user-signup": 30,
+    "change-events": 2,
+    "metrics": 0,
+    "async-user-roles": 1,
+    "async-completed-steps": 4,
+    "async-onboarding-progress": 2,
+    "async-create-membership": 5,
+    "async-assign-membership-roles": 6,
+    "async-user-signup": 30,
+}
+
+
+def scaled(name):
+    return max(1, int(FULL_DATASET[name] * BENCH_SCALE))
+
+
+def seed_dataset():
+    """Bulk-insert an accounts_* dataset shaped like production; returns the row counts."""
+    User = get_user_model()
+    UserRole = User.role.through
+    now = timezone.now()
+
+    organizations = Organization.objects.bulk_create([
+        Organization(name=f"Org {i}", phone="0000000000", email=f"org{i}@example.com", active=True)
+        for i in range(scaled("organizations"))
+    ])
+    branches = Branch.objects.bulk_create([
+        Branch(name=f"Branch {org.pk}", phone="0000000000", email=f"branch{org.pk}@example.com", organization=org)
+        for org in organizations
+    ])
+
+    endpoints = Endpoint.objects.bulk_create([Endpoint(url=f"/api/resource-{i}/") for i in range(50)])
+    scope = Scope.objects.create(name="bench", description="benchmark scope")
+    scope.endpoint.set(endpoints)
+
+    roles = []
+    for start in range(0, scaled("roles"), BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, scaled("roles"))
+        roles += CustomRoleController.bulk_create_roles(
+            [{"name": f"bench-role-{i}", "access_level": "member"} for i in range(start, stop)]
+        )
+    Role.scopes.through.objects.bulk_create(
+        [Role.scopes.through(role_id=role.pk, scope_id=scope.pk) for role in roles], batch_size=BATCH_SIZE
+    )
+
+    users = User.objects.bulk_create(
+        [
+            User(email=f"bench{i}@example.com", password="!", country="US", date_joined=now)
+            for i in range(scaled("users"))
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    UserRole.objects.bulk_create(
+        [UserRole(customuser_id=user.pk, role_id=roles[i % len(roles)].pk) for i, user in enumerate(users)],
+        batch_size=BATCH_SIZE,
+    )
+
+    onboarding = Onboarding.objects.create(name="Default Onboarding", description="benchmark onboarding")
+    steps = OnboardingStep.objects.bulk_create([
+        OnboardingStep(onboarding=onboarding, name=f"Step {i}", level=i // 4 + 1, optional=i % 5 == 4)
+        for i in range(FULL_DATASET["steps_per_user"])
+    ])
+    completed = 0
+    for start in range(0, len(users), BATCH_SIZE // len(steps)):
+        chunk = users[start:start + BATCH_SIZE // len(steps)]
+        CompletedOnboardingStep.objects.bulk_create([
+            CompletedOnboardingStep(user=user, onboarding_step=step, step_status="done", date_completed=now)
+            for user in chunk
+            for step in steps
+        ])
+        completed += len(chunk) * len(steps)
+
+    template = RoleTemplate.objects.create(name="bench-template", access_level="member", role_type="bench")
+    template.scopes.add(scope)
+    tier = SubscriptionTier.objects.create(title="Bench tier", price=0, payment_plans={}, is_active=True)
+    tier.role_templates.add(template)
+    MembershipTier.objects.bulk_create(
+        [
+            MembershipTier(user=user, subscription_tier=tier, subscription_status="active")
+            for user in users[:scaled("memberships")]
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    return {
+        "users": len(users),
+        "roles": len(roles),
+        "organizations": len(organizations),
+        "branches": len(branches),
+        "endpoints": len(endpoints),
+        "onboarding_steps": len(steps),
+        "completed_steps": completed,
+        "memberships": min(len(users), scaled("memberships")),
+    }
+
+
+@tag("benchmark")
+class EndpointBenchmarkTests(TestCase):
+    """
+    Latency (p50/p99) and query counts for every route in api/urls.py against a
+    synthetic dataset. Select with `manage.py test api --tag benchmark`; size with
+    API_BENCH_SCALE (1.0 = 100k users, 10k roles, 1M completed steps).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        started = time.perf_counter()
+        cls.dataset = seed_dataset()
+        cls.seed_seconds = time.perf_counter() - started
+
+        User = get_user_model()
+        cls.user = User.objects.order_by("pk").first()
+        cls.user.is_staff = cls.user.is_superuser = True
+        cls.user.save(update_fields=["is_staff", "is_superuser"])
+        cls.organization = Organization.objects.order_by("pk").first()
+        cls.branch = Branch.objects.order_by("pk").first()
+        cls.tier = SubscriptionTier.objects.get(title="Bench tier")
+        cls.template = RoleTemplate.objects.get(name="bench-template")
+        cls.onboarding = Onboarding.objects.get(name="Default Onboarding")
+        cls.membership = MembershipTier.objects.filter(user=cls.user).first()
+        cls.bulk_user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True)[:10])
+        cls.bulk_membership_ids = list(
+            MembershipTier.objects.exclude(user=cls.user).order_by("pk").values_list("pk", flat=True)[:100]
+        )
+        CustomOnboardingController.rebuild_progress(cls.onboarding)
+        cls.config_ndjson = b"".join(OrganizationConfigController(cls.organization).export_ndjson())
+
+    def setUp(self):
+        cache.clear()
+        OnboardingDefinitionCache.invalidate()
+        self.client.force_login(self.user)
+
+    def routes(self):
+        """(name, method, path, payload factory) for every route in api/urls.py."""
+        onboarding_name = self.onboarding.name
+        return [
+            ("user-roles", "get", "/api/user-roles/", None),
+            ("assign-role", "post", "/api/assign-role/", lambda i: {
+                "role_name": "bench-role-0", "access_level": "member",
+            }),
+            ("assign-role-bulk", "post", "/api/assign-role/bulk/", lambda i: {"assignments": [
+                {"user_id": user_id, "role_name": "bench-role-1", "access_level": "member"}
+                for user_id in self.bulk_user_ids
+            ]}),
+            ("roles-create-or-update", "post", "/api/roles/create-or-update/", lambda i: {
+                "template_name": "bench-template", "access_level": "member", "role_type": "bench",
+                "organization_ids": [self.organization.pk], "use_existing": True,
+            }),
+            ("onboarding-create", "post", "/api/onboarding/create", lambda i: {
+                "onboarding_name": f"bench-onboarding-{i}", "description": "benchmark",
+            }),
+            ("onboarding-step-create", "post", "/api/onboarding-step/create", lambda i: {
+                "onboarding_id": self.onboarding.pk, "step_name": f"bench-step-{i}", "level": 9, "optional": True,
+            }),
+            ("completed-steps", "get", f"/api/completed-steps/?onboarding_name={onboarding_name}", None),
+            ("onboarding-step-done", "post", "/api/onboarding-step/done", lambda i: {
+                "onboarding_name": onboarding_name, "step_name": "Step 0",
+            }),
+            ("onboarding-step-done-bulk", "post", "/api/onboarding-step/done/bulk", lambda i: {
+                "onboarding_name": onboarding_name, "step_names": ["Step 0", "Step 1", "Step 2"],
+            }),
+            ("onboarding-progress", "get", f"/api/onboarding/progress?onboarding_name={onboarding_name}", None),
+            ("onboarding-next-steps", "get", f"/api/onboarding/next-steps?onboarding_name={onboarding_name}", None),
+            ("onboarding-next-steps-bulk", "post", "/api/onboarding/next-steps/bulk", lambda i: {
+                "onboarding_name": onboarding_name, "user_ids": self.bulk_user_ids,
+            }),
+            ("cancel-membership", "post", "/api/cancel-membership/", lambda i: {
+                "membership_id": self.membership.pk,
+            }),
+            ("memberships-bulk-status", "post", "/api/memberships/bulk-status/", lambda i: {
+                "membership_ids": self.bulk_membership_ids, "status": "cancelled" if i % 2 else "active",
+            }),
+            ("assign-membership-roles", "post", "/api/assign-membership-roles/", lambda i: {}),
+            ("create-membership", "post", "/api/create-membership/", lambda i: {
+                "subscription_tier_id": self.tier.pk,
+            }),
+            ("create-subscription-tier", "post", "/api/create-subscription-tier/", lambda i: {
+                "title": f"bench-tier-{i}", "price": 1, "role_template_ids": [self.template.pk],
+            }),
+            ("subscription-tier-catalog", "get", "/api/subscription-tiers/catalog/", None),
+            ("organization-config-export", "get", f"/api/organizations/{self.organization.pk}/config/export/", None),
+            ("organization-config-import", "post", f"/api/organizations/{self.organization.pk}/config/import/",
+             lambda i: self.config_ndjson),
+            ("change-events", "get", "/api/change-events/?cursor=0&limit=100", None),
+            ("metrics", "get", "/api/metrics/", None),
+            ("user-signup", "post", "/api/user-signup/", lambda i: {
+                "email": f"signup{i}@example.com", "password1": "bench-Passw0rd!", "password2": "bench-Passw0rd!",
+            }),
+            ("async-user-roles", "get", "/api/async/user-roles/", None),
+            ("async-completed-steps", "get", f"/api/async/completed-steps/?onboarding_name={onboarding_name}", None),
+            ("async-onboarding-progress", "get",
+             f"/api/async/onboarding/progress?onboarding_name={onboarding_name}", None),
+            ("async-create-membership", "post", "/api/async/create-membership/", lambda i: {
+                "subscription_tier_id": self.tier.pk,
+            }),
+            ("async-assign-membership-roles", "post", "/api/async/assign-membership-roles/", lambda i: {}),
+            ("async-user-signup", "post", "/api/async/user-signup/", lambda i: {
+                "email": f"async-signup{i}@example.com", "password1": "bench-Passw0rd!",
+                "password2": "bench-Passw0rd!",
+            }),
+        ]
+
+    def request(self, method, path, payload):
+        if method == "get":
+            return self.client.get(path)
+        if isinstance(payload, bytes):
+            return self.client.post(path, payload, content_type="application/x-ndjson")
+        return self.client.post(path, payload, content_type="application/json")
+
+    def measure(self, method, path, payload=None):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.request(method, path, payload)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        return response, elapsed, len(queries)
+
+    def test_endpoint_latency_and_query_budgets(self):
+        # Queries the middleware stack spends on any request (the view itself never runs on a 404).
+        _, _, baseline = self.measure("get", "/api/__benchmark-baseline__/")
+
+        results = {}
+        violations = []
+        for name, method, path, payload in self.routes():
+            payload = payload or (lambda i: None)
+            response, _, cold_queries = self.measure(method, path, payload(0))
+            body = getattr(response, "content", b"")[:200]
+            self.assertLess(response.status_code, 500, f"{name}: {response.status_code} {body}")
+
+            latencies = []
+            warm_queries = []
+            for i in range(1, BENCH_ITERATIONS + 1):
+                _, elapsed, query_count = self.measure(method, path, payload(i))
+                latencies.append(elapsed * 1000)
+                warm_queries.append(query_count - baseline)
+
+            latencies.sort()
+            budget = QUERY_BUDGETS[name]
+            results[name] = {
+                "method": method.upper(),
+                "path": path,
+                "p50_ms": round(statistics.median(latencies), 3),
+                "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+                "cold_queries": cold_queries - baseline,
+                "warm_queries": max(warm_queries),
+                "query_budget": budget,
+            }
+            if results[name]["warm_queries"] > budget:
+                violations.append(f"{name}: {results[name]['warm_queries']} queries > budget {budget}")
+
+        self.write_results(baseline, results)
+        self.assertFalse(violations, "Query budget regressions:\n" + "\n".join(violations))
+
+    def write_results(self, baseline, results):
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        report = {
+            "run_at": run_at.isoformat(),
+            "scale": BENCH_SCALE,
+            "iterations": BENCH_ITERATIONS,
+            "database": connection.vendor,
+            "dataset": self.dataset,
+            "seed_seconds": round(self.seed_seconds, 3),
+            "baseline_queries": baseline,
+            "endpoints": results,
+        }
+        path = BENCH_OUTPUT_DIR / f"api-endpoints-{run_at:%Y%m%dT%H%M%S}.json"
+        path.write_text(json.dumps(report, indent=2))
+
+
+@tag("benchmark")
+class EndpointPermissionIndexBenchmarkTests(TestCase):
+    """
+    EndpointPermissionIndex against a naive walk over roles -> scopes -> endpoint
+    urls, with 10k endpoints, 100 scopes and 1k roles (3 scopes each).
+    """
+
+    endpoints = 10_000
+    scopes = 100
+    roles = 1_000
+    checks = 2_000
+
+    @classmethod
+    def setUpTestData(cls):
+        endpoints = Endpoint.objects.bulk_create(
+            [Endpoint(url=f"/api/resource-{i}/") for i in range(cls.endpoints)], batch_size=BATCH_SIZE
+        )
+        scopes = Scope.objects.bulk_create(
+            [Scope(name=f"index-scope-{i}", description="") for i in range(cls.scopes)]
+        )
+        per_scope = cls.endpoints // cls.scopes
+        Scope.endpoint.through.objects.bulk_create(
+            [
+                Scope.endpoint.through(scope_id=scopes[i // per_scope].pk, endpoint_id=endpoint.pk)
+                for i, endpoint in enumerate(endpoints)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        roles = CustomRoleController.bulk_create_roles(
+            [{"name": f"index-role-{i}", "access_level": "member"} for i in range(cls.roles)]
+        )
+        Role.scopes.through.objects.bulk_create(
+            [
+                Role.scopes.through(role_id=role.pk, scope_id=scopes[(i * 7 + k) % cls.scopes].pk)
+                for i, role in enumerate(roles)
+                for k in range(3)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        cls.role_ids = [role.pk for role in roles[:5]]
+
+    def naive_allows(self, role_ids, paths):
+        """Per path, scan every url of every scope of every role (links loaded once up front)."""
+        role_scopes = {}
+        for role_id, scope_id in Role.scopes.through.objects.filter(role_id__in=role_ids).values_list(
+            "role_id", "scope_id"
+        ):
+            role_scopes.setdefault(role_id, []).append(scope_id)
+        scope_urls = {}
+        for scope_id, url in Scope.endpoint.through.objects.values_list("scope_id", "endpoint__url"):
+            scope_urls.setdefault(scope_id, []).append(url)
+        return [
+            any(
+                url == path
+                for role_id in role_ids
+                for scope_id in role_scopes.get(role_id, ())
+                for url in scope_urls[scope_id]
+            )
+            for path in paths
+        ]
+
+    def test_index_matches_naive_walk(self):
+        index = EndpointPermissionIndex()
+        started = time.perf_counter()
+        index.build()
+        build_ms = (time.perf_counter() - started) * 1000
+
+        paths = [f"/api/resource-{(i * 37) % self.endpoints}/" for i in range(self.checks)]
+        started = time.perf_counter()
+        expected = self.naive_allows(self.role_ids, paths)
+        naive_us = (time.perf_counter() - started) / len(paths) * 1e6
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            actual = [bool(index.role_bits(self.role_ids) & index.match(path)) for path in paths]
+            index_us = (time.perf_counter() - started) / len(paths) * 1e6
+
+        self.assertEqual(actual, expected)
+        self.assertTrue(any(actual) and not all(actual))
+        self.assertEqual(len(queries), 0)
+
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        (BENCH_OUTPUT_DIR / f"endpoint-index-{run_at:%Y%m%dT%H%M%S}.json").write_text(json.dumps({
+            "run_at": run_at.isoformat(),
+            "endpoints": self.endpoints,
+            "scopes": self.scopes,
+            "roles": self.roles,
+            "build_ms": round(build_ms, 3),
+            "naive_check_us": round(naive_us, 3),
+            "index_check_us": round(index_us, 3),
+        }, indent=2))
+
+
+@tag("benchmark")
+class SerializationBenchmarkTests(TestCase):
+    """
+    Per-row cost of CompletedOnboardingStepSerializer(many=True) + DRF's JSONRenderer
+    against represent_rows() over .values() rows + FastJSONRenderer.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.counts = seed_dataset()
+        onboarding_controller = CustomOnboardingController()
+        step = CompletedOnboardingStep.objects.order_by("id").first()
+        step.organizations.add(Organization.objects.order_by("id").first())
+        step.branches.add(Branch.objects.order_by("id").first())
+        cls.onboarding_name = "Default Onboarding"
+        cls.limit = min(cls.counts["completed_steps"], 5_000)
+        cls.rows, _ = onboarding_controller.get_completed_steps_page(cls.onboarding_name, limit=cls.limit)
+
+    def test_fast_path_matches_model_serializer(self):
+        instances = list(
+            CustomOnboardingController.completed_steps_queryset(self.onboarding_name)
+            .prefetch_related("organizations", "branches")[:self.limit]
+        )
+
+        started = time.perf_counter()
+        for _ in range(BENCH_ITERATIONS):
+            expected = JSONRenderer().render(CompletedOnboardingStepSerializer(instances, many=True).data)
+        drf_us = (time.perf_counter() - started) / BENCH_ITERATIONS / len(instances) * 1e6
+
+        started = time.perf_counter()
+        for _ in range(BENCH_ITERATIONS):
+            actual = FastJSONRenderer().render(CompletedOnboardingStepSerializer.represent_rows(self.rows))
+        fast_us = (time.perf_counter() - started) / BENCH_ITERATIONS / len(self.rows) * 1e6
+
+        def normalized(body):
+            rows = json.loads(body)
+            for row in rows:
+                row["organizations"].sort()
+                row["branches"].sort()
+            return rows
+
+        self.assertEqual(normalized(actual), normalized(expected))
+
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        (BENCH_OUTPUT_DIR / f"serialization-{run_at:%Y%m%dT%H%M%S}.json").write_text(json.dumps({
+            "run_at": run_at.isoformat(),
+            "rows": len(self.rows),
+            "iterations": BENCH_ITERATIONS,
+            "model_serializer_row_us": round(drf_us, 3),
+            "fast_path_row_us": round(fast_us, 3),
+            "speedup": round(drf_us / fast_us, 2),
+        }, indent=2))
+
+
+@tag("benchmark")
+class StartupBenchmarkTests(TestCase):
+    """Cold start of the full profile against the API-only worker profile (config.settings_api)."""
+
+    def test_api_profile_starts_slimmer(self):
+        full = measure_startup("config.settings")
+        slim = measure_startup("config.settings_api")
+
+        self.assertLess(len(slim["installed_apps"]), len(full["installed_apps"]))
+        for app in ("scraper", "blockchain_auth", "payment", "notification", "com_adaptor", "django_celery_beat"):
+            self.assertNotIn(app, slim["installed_apps"])
+        self.assertIn("api", slim["installed_apps"])
+
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        (BENCH_OUTPUT_DIR / f"startup-{run_at:%Y%m%dT%H%M%S}.json").write_text(json.dumps({
+            "run_at": run_at.isoformat(),
+            "profiles": [
+                {**report, "imports": report["imports"][:25]} for report in (full, slim)
+            ],
+        }, indent=2))
+
+
+@tag("benchmark")
+class ConfigTransferBenchmarkTests(TestCase):
+    """
+    Seeding an organization from a synthetic NDJSON configuration (role templates,
+    tiers, roles and onboarding steps) through OrganizationConfigController, then
+    re-importing it unchanged (update path, catalog included) and exporting it back.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(
+            name="Config Org", phone="0000000000", email="config@example.com", active=True
+        )
+        Branch.objects.create(name="HQ", phone="0000000000", email="hq@example.com", organization=cls.organization)
+        cls.scope = Scope.objects.create(name="config", description="config transfer scope")
+        cls.sizes = {
+            "role_template": max(1, scaled("roles") // 10),
+            "subscription_tier": max(1, scaled("roles") // 100),
+            "role": scaled("roles"),
+            "onboarding": 1,
+            "onboarding_step": scaled("roles"),
+        }
+
+    def template_ref(self, i):
+        return {"name": f"config-template-{i % self.sizes['role_template']}", "access_level": "member"}
+
+    def config_lines(self):
+        sizes = self.sizes
+        yield {"type": "header", "version": OrganizationConfigController.version}
+        for i in range(sizes["role_template"]):
+            yield {"type": "role_template", "name": f"config-template-{i}", "access_level": "member",
+                   "scope_ids": [self.scope.pk]}
+        for i in range(sizes["subscription_tier"]):
+            yield {"type": "subscription_tier", "title": f"config-tier-{i}", "price": "0", "payment_plans": {},
+                   "role_templates": [self.template_ref(i)]}
+        for i in range(sizes["role"]):
+            yield {"type": "role", "name": f"config-role-{i}", "access_level": "member", "branches": ["HQ"],
+                   "template": self.template_ref(i), "scope_ids": [self.scope.pk]}
+        yield {"type": "onboarding", "name": "Config Onboarding"}
+        for i in range(sizes["onboarding_step"]):
+            yield {"type": "onboarding_step", "onboarding": "Config Onboarding", "name": f"config-step-{i}",
+                   "level": i // 100 + 1, "optional": i % 3 == 0}
+
+    def test_import_and_round_trip(self):
+        stream = io.BytesIO(b"".join(json.dumps(record).encode() + b"\n" for record in self.config_lines()))
+
+        def open_lines():
+            stream.seek(0)
+            return stream
+
+        controller = OrganizationConfigController(self.organization)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            created = controller.import_records(open_lines)
+            import_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        updated = OrganizationConfigController(self.organization, overwrite_catalog=True).import_records(open_lines)
+        reimport_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        exported = [json.loads(line) for line in OrganizationConfigController(self.organization).export_ndjson()]
+        export_seconds = time.perf_counter() - started
+
+        for record_type, size in self.sizes.items():
+            self.assertEqual(created[record_type], {"created": size, "updated": 0})
+            self.assertEqual(updated[record_type], {"created": 0, "updated": size})
+            self.assertEqual(sum(record["type"] == record_type for record in exported), size)
+
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        (BENCH_OUTPUT_DIR / f"config-transfer-{run_at:%Y%m%dT%H%M%S}.json").write_text(json.dumps({
+            "run_at": run_at.isoformat(),
+            "records": self.sizes,
+            "chunk_size": controller.chunk_size,
+            "import_seconds": round(import_seconds, 3),
+            "import_queries": len(queries),
+            "reimport_seconds": round(reimport_seconds, 3),
+            "export_seconds": round(export_seconds, 3),
+        }, indent=2))
+
+
+@tag("benchmark")
+class ChangeEventBenchmarkTests(TestCase):
+    """
+    Cost of recording change events (no statement on the write path), of writing
+    a request's outbox and of a batch recorded outside a request (bulk INSERTs of
+    CHANGE_EVENT_BATCH_SIZE after commit), of tailing the log page by page and of
+    pruning it.
+    """
+
+    def test_record_tail_and_prune(self):
+        total = scaled("users")
+        ChangeEvent.objects.all().delete()
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks() as callbacks:
+            for i in range(total // 2):
+                record_changes([change_event("user_roles", i % 100, "assigned", role_ids=[i])])
+        record_us = (time.perf_counter() - started) / (total // 2) * 1e6
+        self.assertEqual(len(queries), 0)
+
+        # Committed inside a request, then written after the response.
+        RequestCacheMiddleware(lambda request: [callback() for callback in callbacks])(APIRequestFactory().get("/"))
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            self.assertEqual(flush_change_events(), total // 2)
+            flush_seconds = time.perf_counter() - started
+        flush_queries = len([query for query in queries if "SAVEPOINT" not in query["sql"]])
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            started = time.perf_counter()
+            record_changes(
+                change_event("user_roles", i % 100, "assigned", role_ids=[i]) for i in range(total // 2, total)
+            )
+        batch_seconds = time.perf_counter() - started
+        batch_queries = len([query for query in queries if "SAVEPOINT" not in query["sql"]])
+
+        cursor, tailed, pages = 0, [], 0
+        started = time.perf_counter()
+        while True:
+            rows, cursor, truncated = events_since(cursor, ["user_roles"])
+            self.assertFalse(truncated)
+            if not rows:
+                break
+            tailed.extend(row["id"] for row in rows)
+            pages += 1
+        tail_seconds = time.perf_counter() - started
+        self.assertEqual(len(tailed), total)
+        self.assertEqual(tailed, sorted(tailed))
+
+        ChangeEvent.objects.update(created_at=timezone.now() - timedelta(days=2))
+        started = time.perf_counter()
+        pruned = prune_change_events(retention_days=30, max_rows=None, compact_after_hours=24)
+        prune_seconds = time.perf_counter() - started
+        self.assertEqual(ChangeEvent.objects.count(), min(total, 100))
+        self.assertEqual(events_since(0)[2], total > 100)
+
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        (BENCH_OUTPUT_DIR / f"change-events-{run_at:%Y%m%dT%H%M%S}.json").write_text(json.dumps({
+            "run_at": run_at.isoformat(),
+            "events": total,
+            "record_us": round(record_us, 3),
+            "flush_seconds": round(flush_seconds, 3),
+            "flush_queries": flush_queries,
+            "batch_seconds": round(batch_seconds, 3),
+            "batch_queries": batch_queries,
+            "tail_pages": pages,
+            "tail_seconds": round(tail_seconds, 3),
+            "pruned": pruned,
+            "prune_seconds": round(prune_seconds, 3),
+        }, indent=2))
+
+
+@tag("benchmark")
+class NextStepsBenchmarkTests(TestCase):
+    """
+    CustomOnboardingController.get_next_steps (cached step layout + completion
+    bitmaps, one query per chunk of users) against a per-user walk over levels
+    and steps, on 3 levels of 4 steps with mixed completions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        users = User.objects.bulk_create(
+            [User(email=f"next{i}@example.com", password="!", country="US") for i in range(scaled("users"))],
+            batch_size=BATCH_SIZE,
+        )
+        cls.onboarding = Onboarding.objects.create(name="Next Steps Onboarding", description="benchmark")
+        steps = OnboardingStep.objects.bulk_create([
+            OnboardingStep(onboarding=cls.onboarding, name=f"Next {i}", level=i // 4 + 1, optional=i % 4 == 3)
+            for i in range(12)
+        ])
+        # User i has done the first i % 13 steps, with every fifth user leaving step 1 pending.
+        CompletedOnboardingStep.objects.bulk_create(
+            [
+                CompletedOnboardingStep(
+                    user=user, onboarding_step=step, date_completed=timezone.now(),
+                    step_status="pending" if index == 1 and i % 5 == 0 else "done",
+                )
+                for i, user in enumerate(users)
+                for index, step in enumerate(steps[:i % 13])
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        cls.user_ids = [user.pk for user in users]
+
+    def naive_next_steps(self, user_id):
+        done = set(CompletedOnboardingStep.objects.filter(
+            user_id=user_id, onboarding_step__onboarding=self.onboarding, step_status="done"
+        ).values_list("onboarding_step_id", flat=True))
+        steps = list(OnboardingStep.objects.filter(onboarding=self.onboarding).order_by("level", "id"))
+        current_level = None
+        for level in sorted({step.level for step in steps}):
+            if any(step.pk not in done for step in steps if step.level == level and not step.optional):
+                current_level = level
+                break
+        open_steps = [
+            step for step in steps
+            if step.pk not in done and (current_level is None or step.level <= current_level)
+        ]
+        return {
+            "current_level": current_level,
+            "next_step_ids": [step.pk for step in open_steps if not step.optional],
+            "optional_step_ids": [step.pk for step in open_steps if step.optional],
+            "remaining_required": sum(1 for step in steps if not step.optional and step.pk not in done),
+        }
+
+    def test_engine_matches_naive_walk(self):
+        OnboardingDefinitionCache.invalidate()
+        controller = CustomOnboardingController()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            positions = controller.get_next_steps(self.onboarding.name, self.user_ids)
+            engine_us = (time.perf_counter() - started) / len(self.user_ids) * 1e6
+        # Definition (onboarding + steps) plus one completion query per chunk of users.
+        chunks = -(-len(self.user_ids) // api_settings.NEXT_STEPS_CHUNK_SIZE)
+        self.assertEqual(len(queries), 2 + chunks)
+
+        sample = self.user_ids[:200]
+        started = time.perf_counter()
+        expected = [self.naive_next_steps(user_id) for user_id in sample]
+        naive_us = (time.perf_counter() - started) / len(sample) * 1e6
+
+        actual = [
+            {
+                "current_level": positions[user_id]["current_level"],
+                "next_step_ids": [step.pk for step in positions[user_id]["next_steps"]],
+                "optional_step_ids": [step.pk for step in positions[user_id]["optional_steps"]],
+                "remaining_required": positions[user_id]["remaining_required"],
+            }
+            for user_id in sample
+        ]
+        self.assertEqual(actual, expected)
+        self.assertTrue(any(position["current_level"] is None for position in positions.values()))
+
+        BENCH_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        run_at = timezone.now()
+        (BENCH_OUTPUT_DIR / f"next-steps-{run_at:%Y%m%dT%H%M%S}.json").write_text(json.dumps({
+            "run_at": run_at.isoformat(),
+            "users": len(self.user_ids),
+            "queries": len(queries),
+            "engine_user_us": round(engine_us, 3),
+            "naive_user_us": round(naive_us, 3),
+        }, indent=2))
+
+
+class RoleCacheInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email="holder@example.com", country="US")
+        self.template = RoleTemplate.objects.create(name="holder-template", access_level="member")
+        self.role = CustomRoleController.bulk_create_roles([{"name": "holder-role", "access_level": "member"}])[0]
+        self.user.role.add(self.role)
+
+    def assert_holder_invalidated(self, update):
+        RoleCache.get_roles(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            update()
+        self.assertIsNone(cache.get(f"{RoleCache.roles_prefix}:{self.user.pk}"))
+
+    def test_full_resync_invalidates_role_holders(self):
+        self.assert_holder_invalidated(lambda: CustomRoleController().update_role_base_on_template(
+            role=self.role, template=self.template, role_name=self.role.name, branches=[],
+        ))
+
+    def test_invalidation_waits_for_commit(self):
+        RoleCache.get_roles(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            CustomRoleController().update_user_roles(self.user, [self.role])
+        self.assertIsNotNone(cache.get(f"{RoleCache.roles_prefix}:{self.user.pk}"))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(cache.get(f"{RoleCache.roles_prefix}:{self.user.pk}"))
+
+    def test_role_links_written_outside_the_controllers_invalidate_holders(self):
+        other = Role.objects.create(name="other-role", access_level="member")
+        for update in (
+            lambda: self.user.role.add(other),
+            lambda: self.user.role.remove(other),
+            lambda: other.customuser_set.add(self.user),
+            lambda: other.customuser_set.clear(),
+            lambda: self.user.role.clear(),
+        ):
+            self.assert_holder_invalidated(update)
+        self.assertEqual(RoleCache.get_roles(self.user), [])
+
+    def test_template_diff_invalidates_role_holders(self):
+        self.template.description = "changed"
+        self.template.save()
+        self.assert_holder_invalidated(lambda: CustomRoleController().apply_template_diff(self.role, self.template))
+
+
+class RoleTemplateDiffTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.scopes = [Scope.objects.create(name=f"diff-scope-{i}", description="") for i in range(4)]
+        cls.template = RoleTemplate.objects.create(name="diff-template", access_level="member", description="v1")
+        cls.template.scopes.set(cls.scopes[:2])
+
+    def setUp(self):
+        cache.clear()
+        self.controller = CustomRoleController()
+
+    def derive(self, name):
+        return self.controller.create_role_base_on_template(template=self.template, role_name=name)
+
+    def scope_links(self, role):
+        return dict(Role.scopes.through.objects.filter(role=role).values_list("scope_id", "pk"))
+
+    def test_template_edits_write_only_the_delta(self):
+        role = self.derive("diff-role")
+        self.template.scopes.set([self.scopes[1], self.scopes[2]])
+        kept_link = self.scope_links(role)[self.scopes[1].pk]
+
+        changes = self.controller.apply_template_diff(role, self.template)
+        self.assertEqual(changes, {"scopes": {"added": 1, "removed": 1}})
+        links = self.scope_links(role)
+        self.assertEqual(set(links), {self.scopes[1].pk, self.scopes[2].pk})
+        self.assertEqual(links[self.scopes[1].pk], kept_link)
+
+    def test_unchanged_roles_write_and_invalidate_nothing(self):
+        role = self.derive("steady-role")
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.controller.apply_template_diff(role, self.template), {})
+        self.assertEqual(callbacks, [])
+        # One diff query per template relation, nothing else.
+        statements = [query["sql"] for query in queries if "SAVEPOINT" not in query["sql"]]
+        self.assertEqual(len(statements), len(CustomRoleController.template_relations))
+        self.assertTrue(all(sql.startswith("SELECT") for sql in statements))
+
+    def test_resync_reverts_customized_roles_to_the_template(self):
+        steady, customized = self.derive("steady-derived"), self.derive("customized-derived")
+        customized.scopes.add(self.scopes[3])
+        customized.scopes.remove(self.scopes[0])
+        Role.objects.filter(pk=customized.pk).update(description="customized")
+        unrelated = Role.objects.create(name="unrelated-role", access_level="admin")
+        unrelated.scopes.add(self.scopes[3])
+        steady_links = self.scope_links(steady)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.controller.resync_roles_from_template(self.template, chunk_size=1)
+
+        self.assertEqual(result, {"roles": 2, "changed": 1})
+        customized.refresh_from_db()
+        self.assertEqual(customized.description, "v1")
+        self.assertEqual(set(self.scope_links(customized)), {self.scopes[0].pk, self.scopes[1].pk})
+        self.assertEqual(self.scope_links(steady), steady_links)
+        self.assertEqual(set(self.scope_links(unrelated)), {self.scopes[3].pk})
+        self.assertEqual(
+            list(ChangeEvent.objects.filter(topic="role", action="updated").values_list("key", flat=True)),
+            [str(customized.pk)],
+        )
+
+
+class EndpointPermissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email="scoped@example.com", country="US")
+        self.role = Role.objects.create(name="scoped-role", access_level="member")
+        self.user.role.add(self.role)
+        self.scope = Scope.objects.create(name="scoped", description="")
+        self.role.scopes.add(self.scope)
+        self.endpoint = Endpoint.objects.create(url="/api/user-roles/")
+        endpoint_index.build()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        endpoint_index.expire()
+
+    def test_registered_endpoints_require_a_scope(self):
+        self.assertEqual(self.client.get("/api/user-roles/").status_code, 403)
+        self.assertEqual(self.client.get("/api/async/user-roles/").status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scope.endpoint.add(self.endpoint)
+        self.assertEqual(self.client.get("/api/user-roles/").status_code, 200)
+
+    def test_index_changes_wait_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.scope.endpoint.add(self.endpoint)
+        self.assertFalse(endpoint_index.allows(self.user, "/api/user-roles/"))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(endpoint_index.allows(self.user, "/api/user-roles/"))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.role.scopes.remove(self.scope)
+        self.assertTrue(endpoint_index.allows(self.user, "/api/user-roles/"))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(endpoint_index.allows(self.user, "/api/user-roles/"))
+
+    def test_rebuilds_swap_in_whole_snapshots(self):
+        matched = endpoint_index.match("/api/user-roles/")
+        seen = []
+        load = IndexSnapshot.load
+
+        def load_while_checking(snapshot):
+            # A request checked while the rebuild loads keeps using the previous, complete snapshot.
+            reader = threading.Thread(target=lambda: seen.append(endpoint_index.match("/api/user-roles/")))
+            reader.start()
+            reader.join()
+            load(snapshot)
+
+        with patch.object(IndexSnapshot, "load", load_while_checking):
+            endpoint_index.build()
+        self.assertEqual(seen, [matched])
+        self.assertEqual(endpoint_index.match("/api/user-roles/"), matched)
+
+    def test_changes_reach_other_processes_through_the_shared_version(self):
+        other_process = EndpointPermissionIndex()
+        self.assertFalse(other_process.allows(self.user, "/api/user-roles/"))
+        snapshot = endpoint_index.snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scope.endpoint.add(self.endpoint)
+        self.assertTrue(other_process.allows(self.user, "/api/user-roles/"))
+        # This process applied the change in place instead of rebuilding.
+        self.assertIs(endpoint_index.snapshot(), snapshot)
+        self.assertTrue(endpoint_index.allows(self.user, "/api/user-roles/"))
+
+    def test_public_views_are_not_guarded(self):
+        Endpoint.objects.create(url="/api/subscription-tiers/catalog/")
+        endpoint_index.build()
+        self.client.logout()
+        self.assertEqual(self.client.get("/api/subscription-tiers/catalog/").status_code, 200)
+
+    @override_settings(MIDDLEWARE=[*settings.MIDDLEWARE, "api.middleware.EndpointPermissionMiddleware"])
+    def test_middleware_leaves_api_views_to_their_own_check(self):
+        with patch.object(HasEndpointPermission, "has_permission", autospec=True, return_value=True) as check:
+            self.assertEqual(self.client.get("/api/user-roles/").status_code, 200)
+        self.assertEqual(check.call_count, 1)
+
+    def test_middleware_guards_other_views(self):
+        middleware = EndpointPermissionMiddleware(lambda request: HttpResponse())
+        request = APIRequestFactory().get("/api/user-roles/")
+        request.user = self.user
+
+        def plain_view(request):
+            return HttpResponse()
+
+        with self.assertRaises(PermissionDenied):
+            middleware.process_view(request, plain_view, (), {})
+        self.assertIsNone(middleware.process_view(request, UserRolesView.as_view(), (), {}))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scope.endpoint.add(self.endpoint)
+        self.assertIsNone(middleware.process_view(request, plain_view, (), {}))
+
+
+class BulkAssignRolesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create(email="bulk-admin@example.com", country="US", is_staff=True)
+        cls.user = User.objects.create(email="bulk-user@example.com", country="US")
+        cls.organization, cls.other_organization = Organization.objects.bulk_create(
+            [Organization(name="Bulk Org"), Organization(name="Other Org")]
+        )
+        cls.role = CustomRoleController.bulk_create_roles([{"name": "bulk-role", "access_level": "member"}])[0]
+        cls.role.organizations.add(cls.organization)
+
+    def assign(self, **item):
+        return CustomRoleController().bulk_assign_roles([{"user_id": self.user.pk, "access_level": "member", **item}])
+
+    def test_reuses_role_with_same_organizations(self):
+        [result] = self.assign(role_name="bulk-role", organization_ids=[self.organization.pk])
+        self.assertEqual(result["role_id"], self.role.pk)
+        self.assertEqual(list(self.user.role.all()), [self.role])
+
+    def test_never_links_another_organization_to_existing_role(self):
+        [result] = self.assign(role_name="bulk-role", organization_ids=[self.other_organization.pk])
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(list(self.role.organizations.all()), [self.organization])
+        self.assertFalse(self.user.role.exists())
+
+    def test_creates_role_with_requested_links(self):
+        [result] = self.assign(role_name="bulk-new-role", organization_ids=[self.other_organization.pk])
+        role = Role.objects.get(pk=result["role_id"])
+        self.assertEqual(list(role.organizations.all()), [self.other_organization])
+        self.assertEqual(
+            CustomRoleController().find_role("bulk-new-role", "member", [self.other_organization.pk], []), role
+        )
+
+    def test_malformed_assignments_are_rejected(self):
+        self.client.force_login(self.admin)
+        for assignments in ({"user_id": 1}, [{"user_id": [1], "role_name": "r", "access_level": "member"}],
+                            [{"user_id": 1, "role_name": "r", "access_level": "member", "organization_ids": [[1]]}]):
+            response = self.client.post(
+                "/api/assign-role/bulk/", {"assignments": assignments}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400, assignments)
+
+
+class TierRoleTemplateCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.scope = Scope.objects.create(name="tier-cache", description="")
+        cls.template = RoleTemplate.objects.create(name="tier-cache-template", access_level="member")
+        cls.tier = SubscriptionTier.objects.create(title="Tier cache", price=0, payment_plans={})
+        cls.tier.role_templates.add(cls.template)
+
+    def setUp(self):
+        cache.clear()
+
+    def cached_template(self):
+        [template] = TierRoleTemplateCache.get(self.tier.pk)
+        return template
+
+    def test_template_field_change_invalidates(self):
+        self.cached_template()
+        self.template.access_level = "admin"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.save()
+        self.assertEqual(self.cached_template()["access_level"], "admin")
+
+    def test_template_relation_changes_invalidate(self):
+        self.cached_template()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.scopes.add(self.scope)
+        self.assertEqual(self.cached_template()["scope_ids"], [self.scope.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scope.roletemplate_set.clear()
+        self.assertEqual(self.cached_template()["scope_ids"], [])
+
+    def test_template_delete_invalidates(self):
+        self.cached_template()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.delete()
+        self.assertEqual(TierRoleTemplateCache.get(self.tier.pk), [])
+
+    def test_roles_from_templates_skip_names_taken_by_groups(self):
+        Group.objects.create(name="taken - group")
+        templates = TierRoleTemplateCache.get(self.tier.pk) * 2
+        roles = CustomRoleController().create_roles_from_templates(templates, ["taken - group", "free - role"])
+        self.assertEqual([role.name for role in roles], ["free - role"])
+        self.assertFalse(Role.objects.filter(name="taken - group").exists())
+
+
+class OnboardingProgressTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email="progress@example.com", country="US")
+        cls.onboarding = Onboarding.objects.create(name="Progress Onboarding")
+        cls.first, cls.second = OnboardingStep.objects.bulk_create([
+            OnboardingStep(onboarding=cls.onboarding, name="First", level=1, optional=False),
+            OnboardingStep(onboarding=cls.onboarding, name="Second", level=2, optional=False),
+        ])
+
+    def setUp(self):
+        OnboardingDefinitionCache.invalidate()
+        self.controller = CustomOnboardingController()
+
+    def progress(self):
+        return OnboardingProgress.objects.get(user=self.user, onboarding=self.onboarding)
+
+    def test_undoing_a_step_lowers_current_level(self):
+        self.controller.set_completed_steps(self.user, [self.first, self.second])
+        self.assertEqual(self.progress().current_level, 2)
+        self.controller.set_completed_steps(self.user, [self.second], status="pending")
+        progress = self.progress()
+        self.assertEqual((progress.current_level, progress.completed_count, progress.required_remaining), (1, 1, 1))
+        self.controller.set_completed_steps(self.user, [self.first], status="pending")
+        self.assertEqual(self.progress().current_level, 0)
+
+    def test_counters_never_go_negative(self):
+        self.controller.set_completed_steps(self.user, [self.first])
+        OnboardingProgress.objects.filter(user=self.user).update(required_remaining=0, completed_count=0)
+        self.controller.set_completed_steps(self.user, [self.second])
+        self.assertEqual(self.progress().required_remaining, 0)
+        self.controller.set_completed_steps(self.user, [self.first, self.second], status="pending")
+        self.assertEqual(self.progress().completed_count, 0)
+
+
+class CompletedStepUpsertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email="upsert@example.com", country="US")
+        cls.organization = Organization.objects.create(name="Upsert Org")
+        cls.onboarding = Onboarding.objects.create(name="Upsert Onboarding")
+        cls.first, cls.second = OnboardingStep.objects.bulk_create([
+            OnboardingStep(onboarding=cls.onboarding, name="First", level=1, optional=False),
+            OnboardingStep(onboarding=cls.onboarding, name="Second", level=1, optional=False),
+        ])
+
+    def setUp(self):
+        cache.clear()
+        OnboardingDefinitionCache.invalidate()
+        self.client.force_login(self.user)
+
+    def rows(self):
+        return CompletedOnboardingStep.objects.filter(user=self.user)
+
+    def test_retried_completions_update_the_existing_row(self):
+        payload = {"onboarding_name": self.onboarding.name, "step_name": "First"}
+        first = self.client.post("/api/onboarding-step/done", payload, content_type="application/json").json()
+        retry = self.client.post(
+            "/api/onboarding-step/done", {**payload, "status": "pending"}, content_type="application/json"
+        ).json()
+        self.assertEqual((first["created"], retry["created"]), (True, False))
+        self.assertEqual(retry["step_id"], first["step_id"])
+        self.assertEqual(list(self.rows().values_list("id", "step_status")), [(first["step_id"], "pending")])
+
+    def test_repeated_steps_in_one_call_write_one_row_each(self):
+        controller = CustomOnboardingController()
+        results = controller.set_completed_steps(self.user, [self.first, self.second, self.first])
+        self.assertEqual([created for _, created in results], [True, True])
+        results = controller.set_completed_steps(self.user, [self.second, self.first])
+        self.assertEqual([created for _, created in results], [False, False])
+        self.assertEqual(self.rows().count(), 2)
+
+    def test_compaction_keeps_the_latest_completion(self):
+        # Rows from before api 0003 added the unique index.
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX IF EXISTS "api_completedstep_user_step_uniq"')
+        now = timezone.now()
+        latest, stale, older = CompletedOnboardingStep.objects.bulk_create([
+            CompletedOnboardingStep(
+                user=self.user, onboarding_step=self.first, step_status=step_status, date_completed=date_completed
+            )
+            for step_status, date_completed in (
+                ("done", now), ("pending", now - timedelta(hours=1)), ("pending", None),
+            )
+        ])
+        stale.organizations.add(self.organization)
+        other = CompletedOnboardingStep.objects.create(
+            user=self.user, onboarding_step=self.second, step_status="done", date_completed=now
+        )
+
+        self.assertEqual(CustomOnboardingController.compact_completed_steps(chunk_size=1), 2)
+        self.assertEqual(sorted(self.rows().values_list("id", flat=True)), sorted([latest.pk, other.pk]))
+        self.assertEqual(list(latest.organizations.all()), [self.organization])
+        self.assertFalse(CompletedOnboardingStep.objects.filter(pk=older.pk).exists())
+
+
+class CompletedStepsPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create(email=f"page-{i}@example.com", country="US") for i in range(4)]
+        cls.onboarding = Onboarding.objects.create(name="Paged Onboarding")
+        cls.steps = [
+            OnboardingStep.objects.create(onboarding=cls.onboarding, name=f"Step {i}", level=1, optional=False)
+            for i in range(2)
+        ]
+        cls.start = timezone.now() - timedelta(days=1)
+        # Two rows per timestamp, so pages also split ties on date_completed.
+        for i, (user, step) in enumerate((user, step) for user in cls.users[:3] for step in cls.steps):
+            cls.complete(user, step, cls.start + timedelta(minutes=i // 2))
+
+    @staticmethod
+    def complete(user, step, date_completed):
+        return CompletedOnboardingStep.objects.create(
+            user=user, onboarding_step=step, step_status="done", date_completed=date_completed
+        )
+
+    def setUp(self):
+        cache.clear()
+        OnboardingDefinitionCache.invalidate()
+        self.client.force_login(self.users[0])
+
+    def page(self, cursor=None, limit=2):
+        params = {"onboarding_name": self.onboarding.name, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = self.client.get("/api/completed-steps/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        return [row["id"] for row in body["completed_steps"]], body["next_cursor"]
+
+    def ordered_ids(self):
+        return list(
+            CompletedOnboardingStep.objects.filter(onboarding_step__onboarding=self.onboarding)
+            .order_by("date_completed", "id").values_list("id", flat=True)
+        )
+
+    def test_pages_cover_every_row_once_and_end_without_a_cursor(self):
+        seen, cursor = [], None
+        while True:
+            ids, cursor = self.page(cursor)
+            seen += ids
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.ordered_ids())
+        ids, cursor = self.page(limit=len(seen))
+        self.assertEqual((ids, cursor), (seen, None))
+
+    def test_cursor_is_stable_across_inserts(self):
+        first, cursor = self.page()
+        before = self.complete(self.users[3], self.steps[0], self.start - timedelta(minutes=5))
+        after = self.complete(self.users[3], self.steps[1], self.start + timedelta(hours=1))
+        rest = []
+        while cursor is not None:
+            ids, cursor = self.page(cursor)
+            rest += ids
+        self.assertNotIn(before.pk, rest)
+        self.assertEqual(first + rest, [pk for pk in self.ordered_ids() if pk != before.pk])
+        self.assertEqual(rest[-1], after.pk)
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ("not-a-cursor", encode_cursor(self.start, 1)[:-4], "bm90LWEtZGF0ZXwx"):
+            response = self.client.get(
+                "/api/completed-steps/", {"onboarding_name": self.onboarding.name, "cursor": cursor}
+            )
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {"error": "Invalid cursor."})
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email="async@example.com", country="US")
+        cls.user.set_password("async-Passw0rd!")
+        cls.user.save()
+        cls.role = Role.objects.create(name="async-role", access_level="member")
+        cls.user.role.add(cls.role)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.tier = SubscriptionTier.objects.create(title="Async Tier", price=0)
+
+    def setUp(self):
+        cache.clear()
+        CredentialCache.clear_local()
+
+    def test_token_clients_are_authenticated(self):
+        with patch.object(AsyncAPIView, "authentication_classes", [CachedTokenAuthentication]):
+            response = self.client.get("/api/async/user-roles/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["role_ids"], [self.role.pk])
+
+            anonymous = self.client.get("/api/async/user-roles/")
+            self.assertEqual(anonymous.status_code, 401)
+            self.assertEqual(anonymous["WWW-Authenticate"], "Token")
+            invalid = self.client.get("/api/async/user-roles/", HTTP_AUTHORIZATION="Token invalid")
+            self.assertEqual(invalid.status_code, 401)
+
+    def test_configured_authentication_classes_are_used(self):
+        self.assertEqual(AsyncAPIView.authentication_classes, APIView.authentication_classes)
+        credentials = base64.b64encode(b"async@example.com:async-Passw0rd!").decode()
+        response = self.client.get("/api/async/user-roles/", HTTP_AUTHORIZATION=f"Basic {credentials}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/api/async/user-roles/").status_code, 403)
+
+    def test_session_writes_need_a_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(
+            "/api/async/create-membership/", {"subscription_tier_id": self.tier.pk}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("CSRF", response.json()["detail"])
+
+    def test_bodies_go_through_the_api_parsers(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            "/api/async/create-membership/", {"subscription_tier_id": self.tier.pk}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(MembershipTier.objects.filter(user=self.user, subscription_tier=self.tier).exists())
+
+        malformed = self.client.post("/api/async/create-membership/", b"{", content_type="application/json")
+        self.assertEqual(malformed.status_code, 400)
+        self.assertIn("JSON parse error", malformed.json()["detail"])
+        unsupported = self.client.post("/api/async/create-membership/", b"x", content_type="text/plain")
+        self.assertEqual(unsupported.status_code, 415)
+
+    def test_reads_match_the_sync_views(self):
+        onboarding = Onboarding.objects.create(name="Async Onboarding")
+        step = OnboardingStep.objects.create(onboarding=onboarding, name="First", level=1, optional=False)
+        CustomOnboardingController().set_completed_steps(self.user, [step])
+        self.client.force_login(self.user)
+        for path in ("completed-steps/", "onboarding/progress"):
+            sync = self.client.get(f"/api/{path}", {"onboarding_name": onboarding.name})
+            asynchronous = self.client.get(f"/api/async/{path}", {"onboarding_name": onboarding.name})
+            self.assertEqual(asynchronous.status_code, 200, path)
+            self.assertEqual(asynchronous.json(), sync.json(), path)
+
+
+class OnboardingDefinitionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.onboarding = Onboarding.objects.create(name="Definition Onboarding")
+        OnboardingStep.objects.create(onboarding=cls.onboarding, name="First", level=1, optional=False)
+
+    def setUp(self):
+        OnboardingDefinitionCache.invalidate()
+
+    def test_new_steps_reach_other_processes_once_committed(self):
+        self.assertEqual([step.name for step in OnboardingDefinitionCache.get(self.onboarding.name).steps], ["First"])
+        # Another process keeps its own entries; only the shared version tells it to reload.
+        other_process = dict(OnboardingDefinitionCache._definitions)
+        with self.captureOnCommitCallbacks() as callbacks:
+            CustomOnboardingController().create_onboarding_step(self.onboarding, "Second", "", 2, False)
+        OnboardingDefinitionCache._definitions.update(other_process)
+        self.assertEqual([step.name for step in OnboardingDefinitionCache.get(self.onboarding.name).steps], ["First"])
+
+        for callback in callbacks:
+            callback()
+        steps = OnboardingDefinitionCache.get(self.onboarding.name).steps
+        self.assertEqual([step.name for step in steps], ["First", "Second"])
+
+
+INSTRUMENTATION_MIDDLEWARE = "api.middleware.QueryInstrumentationMiddleware"
+
+
+@override_settings(
+    MIDDLEWARE=[INSTRUMENTATION_MIDDLEWARE, *(m for m in settings.MIDDLEWARE if m != INSTRUMENTATION_MIDDLEWARE)],
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, "INSTRUMENTATION_ENABLED": True},
+)
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create(email="metrics-admin@example.com", country="US", is_staff=True)
+        cls.user = User.objects.create(email="metrics-user@example.com", country="US")
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    def test_requests_record_query_count_and_time(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get("/api/user-roles/").status_code, 200)
+        metrics = registry.snapshot()["UserRolesView"]
+        self.assertEqual(metrics["latency_ms"]["count"], 1)
+        self.assertEqual((metrics["queries"]["count"], metrics["queries"]["max"]), (1, len(queries)))
+        self.assertEqual(metrics["query_time_ms"]["count"], 1)
+
+    def test_repeated_sql_and_slow_queries_are_reported(self):
+        self.client.force_login(self.user)
+        slow = {"INSTRUMENTATION_SLOW_QUERY_MS": 0, "INSTRUMENTATION_SLOW_QUERY_SAMPLE_RATE": 1.0}
+        with override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK, "INSTRUMENTATION_ENABLED": True, "INSTRUMENTATION_N_PLUS_ONE_THRESHOLD": 0,
+            **slow,
+        }), self.assertLogs("api.slow_queries", "WARNING") as logs:
+            self.client.get("/api/user-roles/")
+        self.assertIn("in UserRolesView from", logs.output[0])
+        self.assertTrue(registry.snapshot()["UserRolesView"]["n_plus_one"])
+
+    def test_metrics_endpoint_is_admin_only(self):
+        self.assertIn(self.client.get("/api/metrics/").status_code, (401, 403))
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+        self.client.force_login(self.admin)
+        self.client.get("/api/user-roles/")
+        response = self.client.get("/api/metrics/", {"reset": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("UserRolesView", response.json()["views"])
+        # The metrics request itself is recorded after the reset.
+        self.assertEqual(list(registry.snapshot()), ["MetricsView"])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError("mail server down")
+
+
+@override_settings(EMAIL_BACKEND="api.mail.QueuedEmailBackend")
+class MailQueueTests(TestCase):
+    def delivering_with(self, backend):
+        return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "EMAIL_DELIVERY_BACKEND": backend})
+
+    def test_mail_is_queued_in_database_by_default(self):
+        mail.send_mail("Subject", "Body", "from@example.com", ["to@example.com"])
+        self.assertEqual(QueuedEmail.objects.filter(sent_at__isnull=True).count(), 1)
+        self.assertEqual(mail.outbox, [])
+
+        with self.delivering_with("django.core.mail.backends.locmem.EmailBackend"):
+            self.assertEqual(send_queued_mail(), (1, 0))
+        self.assertEqual([message.subject for message in mail.outbox], ["Subject"])
+        self.assertFalse(QueuedEmail.objects.filter(sent_at__isnull=True).exists())
+
+    def test_failed_deliveries_stay_queued(self):
+        mail.send_mail("Subject", "Body", "from@example.com", ["to@example.com"])
+        with self.delivering_with("api.tests.FailingEmailBackend"):
+            self.assertEqual(send_queued_mail(), (0, 1))
+        queued = QueuedEmail.objects.get()
+        self.assertEqual((queued.attempts, queued.sent_at), (1, None))
+        self.assertIn("mail server down", queued.last_error)
+
+    def test_failed_memory_delivery_moves_to_database(self):
+        message = mail.EmailMessage("Subject", "Body", "from@example.com", ["to@example.com"])
+        with self.delivering_with("api.tests.FailingEmailBackend"), self.assertLogs("api.mail", "ERROR"):
+            deliver_or_queue([message])
+        self.assertEqual(QueuedEmail.objects.filter(sent_at__isnull=True).count(), 1)
+
+
+class SignUpSerializer(drf_serializers.Serializer):
+    """Stand-in REGISTER_SERIALIZER: creates the user from an email alone."""
+
+    email = drf_serializers.EmailField()
+
+    def save(self, request):
+        return get_user_model().objects.create(email=self.validated_data["email"], country="US")
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "REGISTER_SERIALIZER": "api.tests.SignUpSerializer"})
+class SignupOnboardingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.onboarding = Onboarding.objects.create(name=CustomOnboardingController.signup_onboarding_name)
+
+    def setUp(self):
+        OnboardingDefinitionCache.invalidate()
+
+    def sign_up(self, email, path="/api/user-signup/"):
+        response = self.client.post(path, {"email": email}, content_type="application/json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return get_user_model().objects.get(email=email), response.json()["step"]
+
+    def completions(self, user):
+        return list(
+            CompletedOnboardingStep.objects.filter(user=user).values_list("onboarding_step__name", "step_status")
+        )
+
+    def test_signups_record_a_pending_step_on_one_shared_step(self):
+        first, step = self.sign_up("first@example.com")
+        second, _ = self.sign_up("second@example.com", path="/api/async/user-signup/")
+        self.assertEqual(OnboardingStep.objects.filter(onboarding=self.onboarding).count(), 1)
+        self.assertEqual(step["name"], "Verify Email")
+        for user in (first, second):
+            self.assertEqual(self.completions(user), [("Verify Email", "pending")])
+
+    def test_email_confirmation_marks_the_step_done(self):
+        user, _ = self.sign_up("confirm@example.com")
+        email_confirmed.send(sender=None, request=None, email_address=SimpleNamespace(user=user))
+        self.assertEqual(self.completions(user), [("Verify Email", "done")])
+        progress = CustomOnboardingController().get_progress(user, self.onboarding.name)
+        self.assertEqual((progress.completed_count, progress.required_remaining), (1, 0))
+
+    def test_signup_without_onboarding_creates_no_user(self):
+        self.onboarding.delete()
+        with self.assertRaises(Onboarding.DoesNotExist):
+            self.client.post("/api/user-signup/", {"email": "orphan@example.com"}, content_type="application/json")
+        self.assertFalse(get_user_model().objects.filter(email="orphan@example.com").exists())
+
+
+class RoleSignatureTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name="Signed Org")
+        # Created without the controller, like roles that predate RoleSignature.
+        cls.role = CustomRoleController.bulk_create_roles([{"name": "unsigned-role", "access_level": "member"}])[0]
+        cls.role.organizations.add(cls.organization)
+
+    def test_find_role_signs_roles_without_signature(self):
+        controller = CustomRoleController()
+        self.assertEqual(controller.find_role("unsigned-role", "member", [self.organization.pk], []), self.role)
+        self.assertTrue(RoleSignature.objects.filter(role=self.role).exists())
+        self.assertIsNone(controller.find_role("unsigned-role", "member", [], []))
+
+    def test_roles_changed_outside_the_controller_are_resigned(self):
+        controller = CustomRoleController()
+        other = Organization.objects.create(name="Other Signed Org")
+        branch = Branch.objects.create(name="Signed Branch", organization=self.organization)
+        CustomRoleController.save_role_signatures([self.role])
+
+        def find(name, organization_ids, branch_ids):
+            # Signed roles are found by the signature lookup alone.
+            with self.assertNumQueries(1):
+                return controller.find_role(name, "member", organization_ids, branch_ids)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.organizations.add(other)
+            branch.role_set.add(self.role)
+        self.assertEqual(find("unsigned-role", [self.organization.pk, other.pk], [branch.pk]), self.role)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.role_set.clear()
+            self.role.name = "renamed-role"
+            self.role.save()
+        self.assertEqual(find("renamed-role", [self.organization.pk], [branch.pk]), self.role)
+        self.assertIsNone(controller.find_role("unsigned-role", "member", [self.organization.pk], [branch.pk]))
+
+    def test_backfill_migration_matches_controller_signatures(self):
+        migration = importlib.import_module("api.migrations.0009_backfill_role_signatures")
+        migration.backfill_role_signatures(apps, None)
+        self.assertEqual(
+            RoleSignature.objects.get(role=self.role).signature,
+            CustomRoleController.role_signature("unsigned-role", "member", [self.organization.pk], []),
+        )
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DB_WRITE_RETRY_BASE_DELAY": 0})
+class RetryOnLockedTests(TransactionTestCase):
+    def locked_once(self, error="database is locked"):
+        attempts = []
+
+        @retry_on_locked
+        def write():
+            attempts.append(Organization.objects.create(name=f"Retry {len(attempts)}"))
+            if len(attempts) == 1:
+                raise OperationalError(error)
+
+        return write, attempts
+
+    def test_retry_rolls_back_the_failed_attempt(self):
+        write, attempts = self.locked_once()
+        write()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(list(Organization.objects.values_list("name", flat=True)), ["Retry 1"])
+
+    def test_other_errors_are_not_retried(self):
+        write, attempts = self.locked_once("no such table")
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(attempts), 1)
+        self.assertFalse(Organization.objects.exists())
+
+    def test_calls_inside_a_transaction_are_left_to_its_owner(self):
+        write, attempts = self.locked_once()
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write()
+        self.assertEqual(len(attempts), 1)
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "CREDENTIAL_SHARED_CACHE": True})
+class CredentialCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        CredentialCache.clear_local()
+        self.verified = []
+
+    def verify(self, credential):
+        self.verified.append(credential)
+        if credential.startswith("bad"):
+            return None
+        return {"credential": credential, "tags": ["user:1", "organization:2"]}, None
+
+    def lookup(self, credential):
+        return CredentialCache.get_or_verify("test", credential, self.verify)
+
+    def test_other_processes_share_verified_entries(self):
+        self.lookup("good")
+        CredentialCache.clear_local()
+        self.assertEqual(self.lookup("good")["credential"], "good")
+        self.assertEqual(self.verified, ["good"])
+
+    def test_invalidating_a_tag_drops_shared_entries_after_commit(self):
+        self.lookup("good")
+        self.lookup("other")
+        with self.captureOnCommitCallbacks() as callbacks:
+            CredentialCache.invalidate("organization:2")
+        CredentialCache.clear_local()
+        self.lookup("good")
+        self.assertEqual(self.verified, ["good", "other"])
+
+        for callback in callbacks:
+            callback()
+        CredentialCache.clear_local()
+        self.lookup("good")
+        self.lookup("other")
+        self.assertEqual(self.verified, ["good", "other", "good", "other"])
+
+    def test_invalid_credentials_stay_out_of_the_entry_cache(self):
+        self.lookup("good")
+        for i in range(10):
+            self.assertIsNone(self.lookup(f"bad{i}"))
+        self.assertIsNone(self.lookup("bad0"))
+        self.assertEqual(len(CredentialCache._local._entries), 1)
+        self.assertEqual(self.verified.count("bad0"), 1)
+        self.assertIsNone(cache.get(f"{CredentialCache.prefix}:{CredentialCache.digest('test', 'bad0')}"))
+
+
+class MembershipCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(email="member@example.com", country="US")
+        cls.tier = SubscriptionTier.objects.create(title="Member tier", price=0, payment_plans={})
+
+    def setUp(self):
+        cache.clear()
+        self.membership = MembershipTier.objects.create(
+            user=self.user, subscription_tier=self.tier, subscription_status="active"
+        )
+
+    def test_saving_outside_the_controller_invalidates_after_commit(self):
+        self.assertEqual(MembershipCache.get(self.user), self.membership)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.membership.subscription_status = "cancelled"
+            self.membership.save()
+        self.assertEqual(MembershipCache.get(self.user), self.membership)
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(MembershipCache.get(self.user))
+
+    def test_deleting_invalidates(self):
+        MembershipCache.get(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.membership.delete()
+        self.assertIsNone(MembershipCache.get(self.user))
+
+    def test_bulk_status_updates_invalidate(self):
+        MembershipCache.get(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomMembershipController.bulk_update_status([self.membership.pk], "cancelled")
+        self.assertIsNone(MembershipCache.get(self.user))
+
+
+class MembershipBulkStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create(email=f"bulk-member{i}@example.com", country="US") for i in range(5)]
+        cls.admin = User.objects.create(email="bulk-status-admin@example.com", country="US", is_staff=True)
+        cls.tier = SubscriptionTier.objects.create(title="Bulk tier", price=0, payment_plans={})
+        cls.other_tier = SubscriptionTier.objects.create(title="Other tier", price=0, payment_plans={})
+
+    def setUp(self):
+        cache.clear()
+        self.memberships = [
+            MembershipTier.objects.create(user=user, subscription_tier=self.tier, subscription_status="active")
+            for user in self.users
+        ]
+
+    def statuses(self):
+        memberships = MembershipTier.objects.filter(user__in=self.users).order_by("pk")
+        return list(memberships.values_list("subscription_status", flat=True))
+
+    def status_updates(self, queries):
+        return [q["sql"] for q in queries if q["sql"].startswith("UPDATE") and "subscription_status" in q["sql"]]
+
+    def test_transitions_run_in_chunks_in_pk_order(self):
+        with CaptureQueriesContext(connection) as queries:
+            changed = CustomMembershipController.bulk_update_status(
+                [m.pk for m in reversed(self.memberships)], "cancelled", chunk_size=2
+            )
+        self.assertEqual(changed, [m.pk for m in self.memberships])
+        self.assertEqual(self.statuses(), ["cancelled"] * 5)
+        # One status-only UPDATE per chunk: 2 + 2 + 1.
+        self.assertEqual(len(self.status_updates(queries)), 3)
+
+    def test_from_statuses_and_current_status_limit_the_transition(self):
+        MembershipTier.objects.filter(pk=self.memberships[0].pk).update(subscription_status="cancelled")
+        MembershipTier.objects.filter(pk=self.memberships[1].pk).update(subscription_status="paused")
+
+        changed = CustomMembershipController.bulk_update_status(
+            MembershipTier.objects.filter(subscription_tier=self.tier), "cancelled",
+            from_statuses=["active", "cancelled"],
+        )
+        self.assertEqual(changed, [m.pk for m in self.memberships[2:]])
+        self.assertEqual(self.statuses(), ["cancelled", "paused", "cancelled", "cancelled", "cancelled"])
+
+        self.assertEqual(
+            CustomMembershipController.bulk_update_status([m.pk for m in self.memberships], "cancelled", ["active"]), []
+        )
+
+    def test_only_affected_users_are_invalidated(self):
+        for user in self.users:
+            MembershipCache.get(user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomMembershipController.bulk_update_status(
+                [m.pk for m in self.memberships[:2]], "cancelled", chunk_size=1
+            )
+
+        for user in self.users[:2]:
+            self.assertIsNone(MembershipCache.get(user))
+        with self.assertNumQueries(0):
+            for user, membership in zip(self.users[2:], self.memberships[2:]):
+                self.assertEqual(MembershipCache.get(user), membership)
+
+    def test_sweeper_expires_active_memberships_of_retired_tiers(self):
+        deleted_tier = SubscriptionTier.objects.create(title="Deleted tier", price=0, payment_plans={})
+        SubscriptionTier.objects.filter(pk=self.tier.pk).update(is_active=False)
+        SubscriptionTier.objects.filter(pk=deleted_tier.pk).update(is_deleted=True)
+        # Already cancelled on a retired tier, and active on a live one: both left alone.
+        MembershipTier.objects.filter(pk=self.memberships[0].pk).update(subscription_status="cancelled")
+        MembershipTier.objects.filter(pk=self.memberships[1].pk).update(subscription_tier=self.other_tier)
+        MembershipTier.objects.filter(pk=self.memberships[2].pk).update(subscription_tier=deleted_tier)
+
+        with CaptureQueriesContext(connection) as queries:
+            expired = CustomMembershipController.expire_retired_tier_memberships(chunk_size=2)
+
+        self.assertEqual(expired, [m.pk for m in self.memberships[2:]])
+        expired_status = api_settings.MEMBERSHIP_EXPIRED_STATUS
+        self.assertEqual(self.statuses(), ["cancelled", "active", expired_status, expired_status, expired_status])
+        self.assertEqual(len(self.status_updates(queries)), 2)
+        # A second sweep finds nothing left to expire.
+        self.assertEqual(CustomMembershipController.expire_retired_tier_memberships(chunk_size=2), [])
+
+    def test_expire_memberships_command(self):
+        SubscriptionTier.objects.filter(pk=self.tier.pk).update(is_active=False)
+        out = io.StringIO()
+        call_command("expire_memberships", "--chunk-size", "2", stdout=out)
+        self.assertIn("Expired 5 membership(s).", out.getvalue())
+        self.assertEqual(self.statuses(), [api_settings.MEMBERSHIP_EXPIRED_STATUS] * 5)
+
+    def test_bulk_status_view(self):
+        url = "/api/memberships/bulk-status/"
+        payload = {"subscription_tier_id": self.tier.pk, "status": "paused", "from_statuses": ["active"]}
+
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.post(url, payload, content_type="application/json").status_code, 403)
+
+        self.client.force_login(self.admin)
+        response = self.client.post(url, payload, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["updated_ids"], [m.pk for m in self.memberships])
+        self.assertEqual(self.statuses(), ["paused"] * 5)
+
+        response = self.client.post(url, {"status": "paused"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class TierCatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tier = SubscriptionTier.objects.create(title="Catalog tier", price=0, payment_plans={})
+        cls.template = RoleTemplate.objects.create(name="catalog-template", access_level="member")
+
+    def setUp(self):
+        cache.clear()
+
+    def catalog(self):
+        return json.loads(TierCatalogCache.get()[1])["tiers"]
+
+    def test_tier_changes_rebuild_the_catalog_after_commit(self):
+        self.catalog()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.tier.title = "Renamed tier"
+            self.tier.save()
+        self.assertEqual([tier["title"] for tier in self.catalog()], ["Catalog tier"])
+        for callback in callbacks:
+            callback()
+        self.assertEqual([tier["title"] for tier in self.catalog()], ["Renamed tier"])
+
+    def test_template_links_rebuild_the_catalog(self):
+        self.catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tier.role_templates.add(self.template)
+        self.assertEqual([template["name"] for template in self.catalog()[0]["role_templates"]], ["catalog-template"])
+
+
+# A tenant alias configured through TENANT_DB_ALIASES; the moving tests need one.
+TENANT_ALIAS = next((alias for alias in settings.DATABASES if alias not in ("default", REPLICA_DB_ALIAS)), None)
+
+
+def tenant_databases_setting(mapping):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "TENANT_DATABASES": mapping})
+
+
+class TenantRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name="Tenant Org")
+        cls.user = get_user_model().objects.create(email="tenant@example.com", country="US")
+        role = CustomRoleController.bulk_create_roles([{"name": "tenant-role", "access_level": "member"}])[0]
+        role.organizations.add(cls.organization)
+        cls.user.role.add(role)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unmapped_organizations_leave_routing_to_the_other_routers(self):
+        self.assertIsNone(tenant_database_for([self.organization.pk]))
+        with using_tenant([self.organization.pk]):
+            self.assertIsNone(TenantRouter().db_for_read(CompletedOnboardingStep))
+
+    def test_shared_rows_reached_from_tenant_rows_come_from_default(self):
+        completed_step = CompletedOnboardingStep()
+        completed_step._state.db = "tenant-a"
+        with tenant_databases_setting({str(self.organization.pk): "tenant-a"}):
+            tenant_router = TenantRouter()
+            self.assertEqual(tenant_router.db_for_read(get_user_model(), instance=completed_step), "default")
+            self.assertEqual(tenant_router.db_for_read(Organization, instance=completed_step), "default")
+            self.assertEqual(tenant_router.db_for_read(OnboardingStep, instance=completed_step), "tenant-a")
+
+    def test_only_onboarding_data_is_partitioned(self):
+        tenant_models = [
+            Onboarding, Onboarding.organizations.through, OnboardingStep, CompletedOnboardingStep,
+            CompletedOnboardingStep.organizations.through, OnboardingProgress,
+        ]
+        shared_models = [
+            get_user_model(), get_user_model().role.through, Organization, Role, Role.organizations.through,
+            Role.scopes.through, MembershipTier, RoleTemplate, SubscriptionTier, Endpoint, Scope, ChangeEvent,
+        ]
+        with tenant_databases_setting({str(self.organization.pk): "tenant-a"}), using_tenant([self.organization.pk]):
+            tenant_router = TenantRouter()
+            for model in tenant_models:
+                self.assertEqual(tenant_router.db_for_write(model), "tenant-a", model)
+            for model in shared_models:
+                self.assertIsNone(tenant_router.db_for_write(model), model)
+                self.assertIsNone(tenant_router.db_for_read(model), model)
+
+    def test_requests_without_organization_route_by_the_user_roles(self):
+        request = Request(APIRequestFactory().get("/api/onboarding/progress"))
+        request.user = self.user
+        self.assertEqual(tenant_organization_ids(request), [])
+        with tenant_databases_setting({str(self.organization.pk): "tenant-a"}):
+            self.assertEqual(tenant_organization_ids(request), [self.organization.pk])
+            request = Request(APIRequestFactory().get("/api/onboarding/progress", {"organization_id": "7"}))
+            request.user = self.user
+            self.assertEqual(tenant_organization_ids(request), ["7"])
+
+
+@skipUnless(TENANT_ALIAS, "needs a tenant database alias (TENANT_DB_ALIASES)")
+class TenantMoveTests(TransactionTestCase):
+    # Not TestCase: its constraint check would flag the tenant rows' references to shared rows.
+    databases = {"default", TENANT_ALIAS} if TENANT_ALIAS else {"default"}
+
+    def setUp(self):
+        self.organization = Organization.objects.create(name="Moving Org")
+        self.user = get_user_model().objects.create(email="moving@example.com", country="US")
+        self.onboarding = Onboarding.objects.create(name="Moving Onboarding")
+        self.onboarding.organizations.add(self.organization)
+        self.step = OnboardingStep.objects.create(onboarding=self.onboarding, name="Only", level=1, optional=False)
+        OnboardingDefinitionCache.invalidate()
+        CustomOnboardingController().set_completed_steps(self.user, [self.step])
+        mapping = tenant_databases_setting({str(self.organization.pk): TENANT_ALIAS})
+        mapping.enable()
+        self.addCleanup(mapping.disable)
+        # The test connection predates the mapping; give it the tenant pragmas (no foreign key checks).
+        connections[TENANT_ALIAS].ensure_connection()
+        apply_sqlite_pragmas(None, connections[TENANT_ALIAS])
+
+    def test_moved_rows_are_read_from_the_tenant_alias(self):
+        moved = CustomOnboardingController.move_to_tenant([self.organization.pk], TENANT_ALIAS)
+        self.assertEqual(moved["accounts.CompletedOnboardingStep"], 1)
+        self.assertFalse(Onboarding.objects.filter(pk=self.onboarding.pk).exists())
+
+        with using_tenant([self.organization.pk]):
+            completed_step = CompletedOnboardingStep.objects.select_related("onboarding_step").get()
+            self.assertEqual(completed_step._state.db, TENANT_ALIAS)
+            self.assertEqual(completed_step.user, self.user)
+            self.assertEqual(completed_step.onboarding_step.onboarding.name, "Moving Onboarding")
+            progress = CustomOnboardingController().get_progress(self.user, "Moving Onboarding")
+            self.assertEqual(progress.completed_count, 1)
+
+    def test_onboardings_shared_with_other_organizations_stay(self):
+        self.onboarding.organizations.add(Organization.objects.create(name="Staying Org"))
+        with self.assertRaises(CrossTenantError):
+            CustomOnboardingController.move_to_tenant([self.organization.pk], TENANT_ALIAS)
+        self.assertTrue(Onboarding.objects.filter(pk=self.onboarding.pk).exists())
+
+
+class OrganizationConfigImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organization = Organization.objects.create(name="Importing Org")
+        cls.other = Organization.objects.create(name="Other Org")
+        cls.branch = Branch.objects.create(name="HQ", organization=cls.organization)
+        cls.other_branch = Branch.objects.create(name="Remote", organization=cls.other)
+        cls.template = RoleTemplate.objects.create(name="import-template", access_level="member")
+        cls.extra_template = RoleTemplate.objects.create(name="extra-template", access_level="member")
+        cls.tier = SubscriptionTier.objects.create(title="Import tier", price=10)
+        cls.tier.role_templates.add(cls.template, cls.extra_template)
+        # No RoleSignature, and linked to a second organization.
+        cls.role = CustomRoleController.bulk_create_roles([{"name": "import-role", "access_level": "member"}])[0]
+        cls.role.organizations.add(cls.organization, cls.other)
+        cls.role.branches.add(cls.branch, cls.other_branch)
+
+    def import_config(self, records, **kwargs):
+        stream = io.BytesIO(b"".join(json.dumps(record).encode() + b"\n" for record in records))
+
+        def open_lines():
+            stream.seek(0)
+            return stream
+
+        return OrganizationConfigController(self.organization, **kwargs).import_records(open_lines)
+
+    def test_reimporting_own_roles_updates_them(self):
+        result = self.import_config([
+            {"type": "role", "name": "import-role", "access_level": "member", "description": "imported",
+             "branches": []},
+        ])
+        self.assertEqual(result["role"], {"created": 0, "updated": 1})
+        self.role.refresh_from_db()
+        self.assertEqual(self.role.description, "imported")
+        self.assertEqual(set(self.role.organizations.all()), {self.organization, self.other})
+        self.assertEqual(list(self.role.branches.all()), [self.other_branch])
+
+    def test_role_names_of_other_organizations_are_rejected(self):
+        foreign = CustomRoleController.bulk_create_roles([{"name": "foreign-role", "access_level": "member"}])[0]
+        foreign.organizations.add(self.other)
+        with self.assertRaises(ConfigImportError) as raised:
+            self.import_config([{"type": "role", "name": "foreign-role", "access_level": "member"}])
+        self.assertIn("foreign-role", raised.exception.errors[0]["error"])
+
+    def test_existing_catalog_is_only_overwritten_on_request(self):
+        records = [
+            {"type": "role_template", "name": "import-template", "access_level": "member", "description": "imported"},
+            {"type": "subscription_tier", "title": "Import tier", "price": "99",
+             "role_templates": [{"name": "import-template", "access_level": "member"}]},
+        ]
+        result = self.import_config(records)
+        self.assertEqual(result["subscription_tier"], {"created": 0, "updated": 0})
+        self.tier.refresh_from_db()
+        self.assertEqual(self.tier.price, 10)
+        self.assertEqual(self.tier.role_templates.count(), 2)
+        self.assertNotEqual(RoleTemplate.objects.get(pk=self.template.pk).description, "imported")
+
+        self.import_config(records, overwrite_catalog=True)
+        self.tier.refresh_from_db()
+        self.assertEqual(self.tier.price, 99)
+        self.assertEqual(list(self.tier.role_templates.all()), [self.template])
+        self.assertEqual(RoleTemplate.objects.get(pk=self.template.pk).description, "imported")
+
+    def test_templates_sharing_a_name_round_trip(self):
+        admin_template = RoleTemplate.objects.create(name="import-template", access_level="admin", description="admin")
+        self.tier.role_templates.set([admin_template])
+        role = CustomRoleController.bulk_create_roles([{"name": "admin-role", "access_level": "admin"}])[0]
+        role.organizations.add(self.organization)
+        CustomRoleController.save_role_signatures([role], template_ids={role.pk: admin_template.pk})
+        CustomRoleController.save_role_signatures([self.role], template_ids={self.role.pk: self.template.pk})
+
+        exported = [json.loads(line) for line in OrganizationConfigController(self.organization).export_ndjson()]
+        templates = [record for record in exported if record["type"] == "role_template"]
+        self.assertEqual(
+            sorted((record["name"], record["access_level"]) for record in templates),
+            [("import-template", "admin"), ("import-template", "member")],
+        )
+        admin_ref = {"name": "import-template", "access_level": "admin", "role_type": admin_template.role_type}
+        tier = next(record for record in exported if record["type"] == "subscription_tier")
+        self.assertEqual(tier["role_templates"], [admin_ref])
+        roles = {record["name"]: record for record in exported if record["type"] == "role"}
+        self.assertEqual(roles["admin-role"]["template"], admin_ref)
+        # Only this organization's branches: the import resolves branch names within it.
+        self.assertEqual(roles["import-role"]["branches"], ["HQ"])
+
+        for template in templates:
+            template["description"] = f"re-imported {template['access_level']}"
+        result = self.import_config(exported, overwrite_catalog=True)
+        self.assertEqual(result["role_template"], {"created": 0, "updated": 2})
+        self.assertEqual(RoleTemplate.objects.filter(name="import-template").count(), 2)
+        admin_template.refresh_from_db()
+        self.assertEqual(admin_template.description, "re-imported admin")
+        self.assertEqual(RoleTemplate.objects.get(pk=self.template.pk).description, "re-imported member")
+        self.assertEqual(list(self.tier.role_templates.all()), [admin_template])
+        self.assertEqual(RoleSignature.objects.get(role=role).template_id, admin_template.pk)
+        self.assertEqual(RoleSignature.objects.get(role=self.role).template_id, self.template.pk)
+
+
+class ChangeEventLogTests(TestCase):
+    def test_events_are_written_once_their_writes_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                record_changes([change_event("role", 1, "created")])
+                self.assertEqual(ChangeEvent.objects.count(), 0)
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                record_changes([change_event("role", 2, "created")])
+                raise RuntimeError
+        self.assertEqual(list(ChangeEvent.objects.values_list("key", flat=True)), ["1"])
+
+    def test_the_write_path_issues_no_statement_for_events(self):
+        user = get_user_model().objects.create(email="outbox@example.com", country="US")
+        tier = SubscriptionTier.objects.create(title="Outbox tier", price=0, payment_plans={})
+        memberships = [
+            MembershipTier.objects.create(user=user, subscription_tier=tier, subscription_status="active")
+            for _ in range(2)
+        ]
+
+        def write(membership, new_status):
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks() as callbacks:
+                CustomMembershipController.bulk_update_status([membership.pk], new_status)
+            return [query["sql"] for query in queries if "SAVEPOINT" not in query["sql"]], callbacks
+
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "CHANGE_EVENTS_ENABLED": False}):
+            baseline, _ = write(memberships[0], "paused")
+        statements, callbacks = write(memberships[1], "paused")
+        self.assertEqual(len(statements), len(baseline))
+        self.assertFalse(any(ChangeEvent._meta.db_table in sql for sql in statements))
+
+        # Committed inside a request: the events wait for request_finished.
+        RequestCacheMiddleware(lambda request: [callback() for callback in callbacks])(APIRequestFactory().get("/"))
+        self.assertEqual(ChangeEvent.objects.count(), 0)
+        with self.assertNumQueries(1):
+            write_change_events(sender=None)
+        self.assertEqual(
+            list(ChangeEvent.objects.values_list("topic", "key", "action")),
+            [("membership", str(memberships[1].pk), "status_changed")],
+        )
+        self.assertEqual(flush_change_events(), 0)
+
+    def test_compaction_keeps_the_latest_event_by_created_at(self):
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            record_changes([
+                change_event("role", 1, "updated", version="latest"),
+                change_event("role", 1, "updated", version="earlier"),
+                change_event("role", 2, "created"),
+            ])
+        latest, earlier, _ = ChangeEvent.objects.order_by("pk")
+        ChangeEvent.objects.filter(pk=latest.pk).update(created_at=now - timedelta(days=2))
+        ChangeEvent.objects.filter(pk=earlier.pk).update(created_at=now - timedelta(days=3))
+        pruned = prune_change_events(retention_days=None, max_rows=None, compact_after_hours=24)
+        self.assertEqual(pruned["compacted"], 1)
+        self.assertTrue(ChangeEvent.objects.filter(pk=latest.pk).exists())
@@ -1,19 +1,42 @@
 from django.urls import path
-from .views import UserRolesView, AssignRoleView, CreateOrUpdateRoleView, CreateOnboardingView, CreateOnboardingStepView, CompletedOnboardingStepsView, SetOnboardingStepDoneView, CancelMembershipView, AssignMembershipRolesView, CreateMembershipView, CreateSubscriptionTierView, UserSignupWithOnboardingView
+from .async_views import (
+    AsyncAssignMembershipRolesView, AsyncCompletedOnboardingStepsView, AsyncCreateMembershipView,
+    AsyncOnboardingProgressView, AsyncUserRolesView, AsyncUserSignupWithOnboardingView,
+)
+from .views import UserRolesView, AssignRoleView, BulkAssignRoleView, CreateOrUpdateRoleView, CreateOnboardingView, CreateOnboardingStepView, CompletedOnboardingStepsView, SetOnboardingStepDoneView, BulkSetOnboardingStepsDoneView, OnboardingProgressView, NextOnboardingStepsView, BulkNextOnboardingStepsView, CancelMembershipView, BulkMembershipStatusView, AssignMembershipRolesView, CreateMembershipView, CreateSubscriptionTierView, SubscriptionTierCatalogView, OrganizationConfigExportView, OrganizationConfigImportView, ChangeEventsView, UserSignupWithOnboardingView, MetricsView
 
 urlpatterns = [
     path("user-roles/", UserRolesView.as_view()),
     path("assign-role/", AssignRoleView.as_view()),
+    path("assign-role/bulk/", BulkAssignRoleView.as_view()),
     path('roles/create-or-update/', CreateOrUpdateRoleView.as_view()),
     path("onboarding/create", CreateOnboardingView.as_view()),
     path("onboarding-step/create", CreateOnboardingStepView.as_view()),
     path("completed-steps/", CompletedOnboardingStepsView.as_view()),
     path("onboarding-step/done", SetOnboardingStepDoneView.as_view()),
+    path("onboarding-step/done/bulk", BulkSetOnboardingStepsDoneView.as_view()),
+    path("onboarding/progress", OnboardingProgressView.as_view()),
+    path("onboarding/next-steps", NextOnboardingStepsView.as_view()),
+    path("onboarding/next-steps/bulk", BulkNextOnboardingStepsView.as_view()),
     path("cancel-membership/", CancelMembershipView.as_view()),
+    path("memberships/bulk-status/", BulkMembershipStatusView.as_view()),
     path("assign-membership-roles/", AssignMembershipRolesView.as_view()),
     path("create-membership/", CreateMembershipView.as_view()),
     path("create-subscription-tier/", CreateSubscriptionTierView.as_view()),
+    path("subscription-tiers/catalog/", SubscriptionTierCatalogView.as_view()),
+    path("organizations/<int:organization_id>/config/export/", OrganizationConfigExportView.as_view()),
+    path("organizations/<int:organization_id>/config/import/", OrganizationConfigImportView.as_view()),
+    path("change-events/", ChangeEventsView.as_view()),
     path("user-signup/", UserSignupWithOnboardingView.as_view()),
+    path("metrics/", MetricsView.as_view()),
+
+    # Async-native variants for ASGI deployments (config/asgi.py).
+    path("async/user-roles/", AsyncUserRolesView.as_view()),
+    path("async/completed-steps/", AsyncCompletedOnboardingStepsView.as_view()),
+    path("async/onboarding/progress", AsyncOnboardingProgressView.as_view()),
+    path("async/create-membership/", AsyncCreateMembershipView.as_view()),
+    path("async/assign-membership-roles/", AsyncAssignMembershipRolesView.as_view()),
+    path("async/user-signup/", AsyncUserSignupWithOnboardingView.as_view()),
 
 
 
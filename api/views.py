@@ -1,6 +1,12 @@
+import functools
+import shutil
+from tempfile import SpooledTemporaryFile
+
 from django.utils import timezone
 from django.shortcuts import render
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework import status
 from allauth.account.utils import complete_signup
 from api.api_settings import api_settings
@@ -14,20 +20,74 @@ from rest_framework.response import Response
 from accounts.controllers import RoleController, OnboardingController, UserController, MembershipController
 from .serializers import CompletedOnboardingStepSerializer
 
-from .controllers import CustomMembershipController
+from .cache import OnboardingDefinitionCache, RoleCache, TierCatalogCache
+from .db import CrossTenantError, ReadReplicaMixin, iter_with_routing, using_tenant
+from .events import events_since, latest_cursor
+from .instrumentation import registry
+from .controllers import (
+    ConfigImportError, CustomMembershipController, CustomOnboardingController, CustomRoleController,
+    OrganizationConfigController,
+)
+from .pagination import decode_cursor, encode_cursor, stream_json_list
+from .permissions import HasEndpointPermission, HasOrganizationAPIKey
+
+
+class BaseAPIView(APIView):
+    """
+    Base of every api view: orjson-backed JSON by default (API_RENDERER_CLASSES,
+    API_PARSER_CLASSES), and HasEndpointPermission after the view's own permissions
+    unless the view is public (AllowAny).
+    """
+
+    renderer_classes = api_settings.API_RENDERER_CLASSES
+    parser_classes = api_settings.API_PARSER_CLASSES
+
+    def get_permissions(self):
+        permissions = super().get_permissions()
+        return [*permissions, HasEndpointPermission()] if HasEndpointPermission.guards(self) else permissions
+
+
+def organization_ids_of(request):
+    """Organizations a request is scoped to: "organization_id" query parameters and/or "organization_ids" in the body."""
+    organization_ids = request.query_params.getlist("organization_id")
+    body_ids = request.data.get("organization_ids", []) if isinstance(request.data, dict) else []
+    return organization_ids + (body_ids if isinstance(body_ids, list) else [body_ids])
+
+
+def tenant_organization_ids(request):
+    """
+    organization_ids_of(request); when the request names none and tenant databases
+    are configured, the organizations of the user's roles, as CreateOnboardingView does.
+    """
+    organization_ids = organization_ids_of(request)
+    if organization_ids or not api_settings.TENANT_DATABASES or not request.user.is_authenticated:
+        return organization_ids
+    return CustomRoleController.user_organization_ids(request.user)
 
 
+def tenant_routed(handler):
+    """Run a view handler inside api.db.using_tenant() for the organizations of its request."""
 
-class UserRolesView(APIView):
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        try:
+            with using_tenant(tenant_organization_ids(request)):
+                return handler(self, request, *args, **kwargs)
+        except CrossTenantError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return wrapper
+
+
+class UserRolesView(ReadReplicaMixin, BaseAPIView):
     def get(self, request, *args, **kwargs):
         user = request.user
-        role_controller = RoleController()
-        user_roles = role_controller.get_user_roles(user)
-        return Response({"roles": [r.name for r in user_roles], 
-                        "role_ids": [r.id for r in user_roles]}, 
+        user_roles = RoleCache.get_roles(user)
+        return Response({"roles": [name for _, name in user_roles], 
+                        "role_ids": [role_id for role_id, _ in user_roles]}, 
                         status=status.HTTP_200_OK)
     
-class AssignRoleView(APIView):
+class AssignRoleView(BaseAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -41,7 +101,7 @@ class AssignRoleView(APIView):
         organizations = Organization.objects.filter(id__in=org_ids)
         branches = Branch.objects.filter(id__in=branch_ids)
 
-        controller = RoleController()
+        controller = CustomRoleController()
         role = controller.get_or_create_role(role_name, access_level, organizations, branches)
 
         controller.update_user_roles(user, [role])
@@ -51,14 +111,65 @@ class AssignRoleView(APIView):
             "role_id": role.id,
             "role_name": role.name
         })   
+
+
+def assignment_error(item):
+    """Why a bulk role assignment is malformed, or None."""
+    if not isinstance(item, dict):
+        return "must be an object."
+    for field in ("user_id", "role_name", "access_level"):
+        value = item.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, str))):
+            return f"'{field}' must be a string or an integer."
+    for field in ("organization_ids", "branch_ids"):
+        ids = item.get(field)
+        if ids is not None and (
+            not isinstance(ids, list) or any(isinstance(pk, bool) or not isinstance(pk, int) for pk in ids)
+        ):
+            return f"'{field}' must be a list of integer ids."
+    return None
+
+
+class BulkAssignRoleView(BaseAPIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        assignments = request.data.get("assignments")
+        if not isinstance(assignments, list) or not assignments:
+            return Response(
+                {"error": "'assignments' must be a non-empty list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(assignments) > api_settings.BULK_ASSIGN_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {api_settings.BULK_ASSIGN_MAX_ITEMS} assignments per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        for index, item in enumerate(assignments):
+            error = assignment_error(item)
+            if error:
+                return Response({"error": f"Assignment {index}: {error}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            results = CustomRoleController().bulk_assign_roles(assignments)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        assigned = sum(1 for result in results if result["status"] == "assigned")
+        return Response({
+            "message": "Bulk role assignment finished",
+            "assigned": assigned,
+            "failed": len(results) - assigned,
+            "results": results,
+        }, status=status.HTTP_200_OK)
     
 
-class CreateOrUpdateRoleView(APIView):
+class CreateOrUpdateRoleView(BaseAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         data = request.data
-        role_controller = RoleController()
+        role_controller = CustomRoleController()
 
         try:
             # Step 1: Get or create template
@@ -68,22 +179,22 @@ class CreateOrUpdateRoleView(APIView):
                 role_type=data["role_type"],
             )
 
-            # Step 2: Get organizations and branches
-            organizations = Organization.objects.filter(id__in=data.get("organization_ids", []))
-            branches = Branch.objects.filter(id__in=data.get("branch_ids", []))
+            # Step 2: Get organizations and branches (evaluated once)
+            organizations = list(Organization.objects.filter(id__in=data.get("organization_ids", [])).order_by("id"))
+            branches = list(Branch.objects.filter(id__in=data.get("branch_ids", [])))
 
             # Step 3: Generate role name
             role_name = role_controller.role_name_generator(template, organizations[0]) if organizations else data["template_name"]
             
-            # Step 4: Check if role exists
-            existing_role = role_controller.get_role(
+            # Step 4: Check if role exists (single indexed signature lookup)
+            existing_role = role_controller.find_role(
                 name=role_name,
                 access_level=template.access_level,
-                organizations=organizations,
-                branches=branches,
+                organization_ids=[organization.id for organization in organizations],
+                branch_ids=[branch.id for branch in branches],
             )
            
-            if existing_role and data.get("use_existing", False):
+            if existing_role and data.get("use_existing", False) and data.get("full_resync", False):
                 role = role_controller.update_role_base_on_template(
                     role=existing_role,
                     template=template,
@@ -92,6 +203,16 @@ class CreateOrUpdateRoleView(APIView):
                     branches=branches,
                 )
                 message = "Role updated"
+            elif existing_role and data.get("use_existing", False):
+                changes = role_controller.apply_template_diff(
+                    role=existing_role,
+                    template=template,
+                    role_name=role_name,
+                    organizations=organizations,
+                    branches=branches,
+                )
+                role = existing_role
+                message = "Role updated" if changes else "Role unchanged"
             else:
             
                 role = role_controller.create_role_base_on_template(
@@ -109,7 +230,7 @@ class CreateOrUpdateRoleView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)    
         
-class CreateOnboardingView(APIView):
+class CreateOnboardingView(BaseAPIView):
     def post(self, request):
 
         role_controller = RoleController()
@@ -127,7 +248,9 @@ class CreateOnboardingView(APIView):
 
             user_role = user_roles.first()
 
-            onboarding_instance = onboarding_controller.create_onboarding(name, description, user_role)
+            # The onboarding lives in the tenant database of the role's organizations.
+            with using_tenant(user_role.organizations.values_list("pk", flat=True)):
+                onboarding_instance = onboarding_controller.create_onboarding(name, description, user_role)
 
             return Response({
                 "message": "Onboarding instance created successfully",
@@ -136,15 +259,18 @@ class CreateOnboardingView(APIView):
             })   
         except KeyError as e:
             return Response({"error": f"Missing field: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        except CrossTenantError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)  
 
 
-class CreateOnboardingStepView(APIView):
+class CreateOnboardingStepView(BaseAPIView):
     permission_classes = [IsAuthenticated]
 
+    @tenant_routed
     def post(self, request):
-        onboarding_controller = OnboardingController()
+        onboarding_controller = CustomOnboardingController()
         data = request.data
 
         try:
@@ -187,12 +313,13 @@ class CreateOnboardingStepView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)    
         
 
-class CompletedOnboardingStepsView(APIView):
+class CompletedOnboardingStepsView(ReadReplicaMixin, BaseAPIView):
     permission_classes = [IsAuthenticated]
 
+    @tenant_routed
     def get(self, request):
         onboarding_name = request.query_params.get("onboarding_name")
-        onboarding_controller = OnboardingController()
+        onboarding_controller = CustomOnboardingController()
 
         if not onboarding_name:
             return Response(
@@ -201,20 +328,37 @@ class CompletedOnboardingStepsView(APIView):
             )
 
         try:
-            completed_steps = onboarding_controller.get_all_completed_steps(onboarding_name)
+            cursor = request.query_params.get("cursor")
+            cursor = decode_cursor(cursor) if cursor else None
+            limit = int(request.query_params.get("limit", api_settings.COMPLETED_STEPS_PAGE_SIZE))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, api_settings.COMPLETED_STEPS_MAX_PAGE_SIZE))
 
-            # You need a serializer to represent these steps — assumed here
-            serialized = CompletedOnboardingStepSerializer(completed_steps, many=True)
+        try:
+            if request.query_params.get("stream") in ("1", "true"):
+                chunks = iter_with_routing(onboarding_controller.iter_completed_steps(
+                    onboarding_name, cursor, chunk_size=api_settings.COMPLETED_STEPS_STREAM_CHUNK_SIZE
+                ))
+                rendered = (CompletedOnboardingStepSerializer.represent_rows(rows) for rows in chunks)
+                return StreamingHttpResponse(
+                    stream_json_list("completed_steps", rendered), content_type="application/json"
+                )
 
-            return Response({"completed_steps": serialized.data}, status=status.HTTP_200_OK)
+            rows, next_cursor = onboarding_controller.get_completed_steps_page(onboarding_name, cursor, limit)
+            return Response({
+                "completed_steps": CompletedOnboardingStepSerializer.represent_rows(rows),
+                "next_cursor": encode_cursor(*next_cursor) if next_cursor else None,
+            }, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)        
         
 
-class SetOnboardingStepDoneView(APIView):
+class SetOnboardingStepDoneView(BaseAPIView):
     permission_classes = [IsAuthenticated]
 
+    @tenant_routed
     def post(self, request):
         user = request.user
         data = request.data
@@ -227,28 +371,206 @@ class SetOnboardingStepDoneView(APIView):
                 "error": "onboarding_name and step_name are required."
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        onboarding_controller = OnboardingController()
+        onboarding_controller = CustomOnboardingController()
 
         try:
             onboarding = onboarding_controller.get_onboarding(onboarding_name)
             onboarding_step = onboarding_controller.get_onboarding_step_by_name(onboarding, step_name)
-            completed_step = onboarding_controller.set_completed_step(
+            [(completed_step, created)] = onboarding_controller.set_completed_steps(
                 user=user,
-                onboarding_step=onboarding_step,
+                onboarding_steps=[onboarding_step],
                 status=status_value
             )
 
             return Response({
                 "message": "Step marked as completed.",
                 "step_id": completed_step.id,
-                "step_status": completed_step.step_status
+                "step_status": completed_step.step_status,
+                "created": created,
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)        
+
+
+class BulkSetOnboardingStepsDoneView(BaseAPIView):
+    permission_classes = [IsAuthenticated]
+
+    @tenant_routed
+    def post(self, request):
+        data = request.data
+        onboarding_name = data.get("onboarding_name")
+        step_names = data.get("step_names")
+        status_value = data.get("status", "done")
+
+        if not onboarding_name or not isinstance(step_names, list) or not step_names:
+            return Response({
+                "error": "onboarding_name and a non-empty step_names list are required."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        onboarding_controller = CustomOnboardingController()
+
+        try:
+            onboarding = onboarding_controller.get_onboarding(onboarding_name)
+            steps, missing = [], []
+            for step_name in step_names:
+                try:
+                    steps.append(onboarding_controller.get_onboarding_step_by_name(onboarding, step_name))
+                except OnboardingStep.DoesNotExist:
+                    missing.append(step_name)
+            if missing:
+                return Response({
+                    "error": "Unknown onboarding steps.",
+                    "missing_steps": missing,
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            results = onboarding_controller.set_completed_steps(request.user, steps, status_value)
+
+            return Response({
+                "message": "Steps marked as completed.",
+                "steps": [
+                    {
+                        "step_name": completed_step.onboarding_step.name,
+                        "step_id": completed_step.id,
+                        "step_status": completed_step.step_status,
+                        "created": created,
+                    }
+                    for completed_step, created in results
+                ],
+            }, status=status.HTTP_200_OK)
+
+        except Onboarding.DoesNotExist:
+            return Response({"error": "Onboarding not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
 
-class CancelMembershipView(APIView):
+class OnboardingProgressView(BaseAPIView):
+    permission_classes = [IsAuthenticated]
+
+    @tenant_routed
+    def get(self, request):
+        onboarding_name = request.query_params.get("onboarding_name")
+        if not onboarding_name:
+            return Response(
+                {"error": "Missing required query parameter: 'onboarding_name'"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            progress = CustomOnboardingController().get_progress(request.user, onboarding_name)
+        except Onboarding.DoesNotExist:
+            return Response({"error": "Onboarding not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "onboarding_name": onboarding_name,
+            "completed_count": progress.completed_count,
+            "required_remaining": progress.required_remaining,
+            "total_steps": progress.total_steps,
+            "current_level": progress.current_level,
+            "percent": progress.percent,
+        }, status=status.HTTP_200_OK)
+
+
+class NextOnboardingStepsView(BaseAPIView):
+    """The steps the current user can work on next in an onboarding."""
+
+    permission_classes = [IsAuthenticated]
+
+    @tenant_routed
+    def get(self, request):
+        onboarding_name = request.query_params.get("onboarding_name")
+        if not onboarding_name:
+            return Response(
+                {"error": "Missing required query parameter: 'onboarding_name'"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            position = CustomOnboardingController().get_next_steps(onboarding_name, [request.user.pk])[request.user.pk]
+        except Onboarding.DoesNotExist:
+            return Response({"error": "Onboarding not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "onboarding_name": onboarding_name,
+            "current_level": position["current_level"],
+            "completed": position["current_level"] is None,
+            "remaining_required": position["remaining_required"],
+            "next_steps": [self.represent_step(step) for step in position["next_steps"]],
+            "optional_steps": [self.represent_step(step) for step in position["optional_steps"]],
+        }, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def represent_step(step):
+        return {
+            "id": step.id,
+            "name": step.name,
+            "description": step.description,
+            "level": step.level,
+            "optional": step.optional,
+        }
+
+
+class BulkNextOnboardingStepsView(ReadReplicaMixin, BaseAPIView):
+    """
+    Next steps of many users at once (dashboards): the onboarding's steps are
+    listed once and each user's entry refers to them by id.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @tenant_routed
+    def post(self, request):
+        onboarding_name = request.data.get("onboarding_name")
+        user_ids = request.data.get("user_ids")
+        if (
+            not onboarding_name
+            or not isinstance(user_ids, list)
+            or not user_ids
+            or not all(isinstance(user_id, int) for user_id in user_ids)
+        ):
+            return Response({
+                "error": "onboarding_name and a non-empty user_ids list of integers are required."
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > api_settings.NEXT_STEPS_BATCH_MAX_USERS:
+            return Response({
+                "error": f"At most {api_settings.NEXT_STEPS_BATCH_MAX_USERS} users per request."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        onboarding_controller = CustomOnboardingController()
+        try:
+            positions = onboarding_controller.get_next_steps(onboarding_name, user_ids)
+            steps = OnboardingDefinitionCache.get(onboarding_name).steps
+        except Onboarding.DoesNotExist:
+            return Response({"error": "Onboarding not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "onboarding_name": onboarding_name,
+            "steps": [
+                {"id": step.id, "name": step.name, "level": step.level, "optional": step.optional}
+                for step in steps
+            ],
+            "users": [
+                {
+                    "user_id": user_id,
+                    "current_level": position["current_level"],
+                    "completed": position["current_level"] is None,
+                    "remaining_required": position["remaining_required"],
+                    "next_step_ids": [step.id for step in position["next_steps"]],
+                    "optional_step_ids": [step.id for step in position["optional_steps"]],
+                }
+                for user_id, position in positions.items()
+            ],
+        }, status=status.HTTP_200_OK)
+
+
+class CancelMembershipView(BaseAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -261,14 +583,64 @@ class CancelMembershipView(APIView):
 
         try:
             membership = MembershipTier.objects.get(id=membership_id)
-            MembershipController.cancel_membership(membership)
+            CustomMembershipController.cancel_membership(membership)
             return Response({"message": "Membership cancelled successfully."}, status=status.HTTP_200_OK)
         except MembershipTier.DoesNotExist:
             return Response({"error": "Membership not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)        
         
-class CreateMembershipView(APIView):
+class BulkMembershipStatusView(BaseAPIView):
+    """
+    Move many memberships to a new status at once: the given membership_ids, or
+    every membership of subscription_tier_id. Optional from_statuses restricts the
+    transition to memberships currently in one of those statuses.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        membership_ids = request.data.get("membership_ids")
+        tier_id = request.data.get("subscription_tier_id")
+        new_status = request.data.get("status", api_settings.MEMBERSHIP_CANCELLED_STATUS)
+        from_statuses = request.data.get("from_statuses")
+
+        if (membership_ids is None) == (tier_id is None):
+            return Response(
+                {"error": "Provide exactly one of 'membership_ids' or 'subscription_tier_id'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if membership_ids is not None and (not isinstance(membership_ids, list) or not membership_ids):
+            return Response({"error": "'membership_ids' must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if membership_ids is not None and len(membership_ids) > api_settings.MEMBERSHIP_BULK_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {api_settings.MEMBERSHIP_BULK_MAX_ITEMS} memberships per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not new_status or (from_statuses is not None and not isinstance(from_statuses, list)):
+            return Response(
+                {"error": "'status' is required and 'from_statuses' must be a list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            memberships = (
+                membership_ids if membership_ids is not None
+                else MembershipTier.objects.filter(subscription_tier_id=tier_id)
+            )
+            updated_ids = CustomMembershipController.bulk_update_status(memberships, new_status, from_statuses)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "message": "Membership statuses updated",
+            "status": new_status,
+            "updated": len(updated_ids),
+            "updated_ids": updated_ids,
+        }, status=status.HTTP_200_OK)
+
+
+class CreateMembershipView(BaseAPIView):
     def post(self, request):
         user = request.user
         tier_id = request.data.get("subscription_tier_id")
@@ -286,17 +658,17 @@ class CreateMembershipView(APIView):
         }, status=201)        
     
 
-class AssignMembershipRolesView(APIView):
+class AssignMembershipRolesView(BaseAPIView):
     def post(self, request):
         user = request.user
         membership = CustomMembershipController.get_active_membership(user)
         if not membership:
             return Response({"error": "No active membership"}, status=400)
 
-        MembershipController.assign_roles_from_tier(membership)
+        CustomMembershipController.assign_roles_from_tier(membership)
         return Response({"message": "Roles assigned successfully"})    
     
-class CreateSubscriptionTierView(APIView):
+class CreateSubscriptionTierView(BaseAPIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -323,7 +695,98 @@ class CreateSubscriptionTierView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)    
         
 
-class UserSignupWithOnboardingView(APIView):
+class SubscriptionTierCatalogView(BaseAPIView):
+    """
+    Active subscription tiers with their role templates and payment plans, served
+    from the pre-rendered TierCatalogCache snapshot with a strong ETag. Requests
+    whose If-None-Match matches get a 304 without a body.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            etag, body = TierCatalogCache.get()
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if_none_match = request.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+class OrganizationConfigExportView(BaseAPIView):
+    """
+    Stream an organization's role templates, tiers, roles and onboardings as
+    NDJSON, for admins or with an API key of that organization.
+    """
+
+    permission_classes = [IsAdminUser | HasOrganizationAPIKey]
+
+    def get(self, request, organization_id):
+        try:
+            organization = Organization.objects.get(id=organization_id)
+        except Organization.DoesNotExist:
+            return Response({"error": "Organization not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(
+            iter_with_routing(OrganizationConfigController(organization).export_ndjson()),
+            content_type="application/x-ndjson",
+        )
+        response["Content-Disposition"] = f'attachment; filename="organization-{organization.pk}.ndjson"'
+        return response
+
+
+class OrganizationConfigImportView(BaseAPIView):
+    """
+    Import an NDJSON configuration stream (as produced by the export) into an
+    organization. The body is spooled to a temporary file, validated as a whole,
+    then written in bulk; ?dry_run=1 stops after validation. Existing role
+    templates and tiers are shared and only updated with ?overwrite_catalog=1.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, organization_id):
+        try:
+            organization = Organization.objects.get(id=organization_id)
+        except Organization.DoesNotExist:
+            return Response({"error": "Organization not found"}, status=status.HTTP_404_NOT_FOUND)
+        if request.stream is None:
+            return Response({"error": "Empty configuration stream."}, status=status.HTTP_400_BAD_REQUEST)
+
+        controller = OrganizationConfigController(
+            organization, overwrite_catalog=request.query_params.get("overwrite_catalog") in ("1", "true")
+        )
+        with SpooledTemporaryFile(max_size=api_settings.CONFIG_IMPORT_SPOOL_MAX_MEMORY) as spool:
+            shutil.copyfileobj(request.stream, spool)
+
+            def open_lines():
+                spool.seek(0)
+                return spool
+
+            try:
+                if request.query_params.get("dry_run") in ("1", "true"):
+                    return Response({
+                        "message": "Configuration is valid",
+                        "records": controller.validate(open_lines()),
+                    }, status=status.HTTP_200_OK)
+                result = controller.import_records(open_lines)
+            except ConfigImportError as e:
+                return Response({"error": str(e), "errors": e.errors}, status=status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({"message": "Configuration imported", "records": result}, status=status.HTTP_200_OK)
+
+
+class UserSignupWithOnboardingView(BaseAPIView):
     """
     Custom Signup API with onboarding integration.
     """
@@ -331,44 +794,37 @@ class UserSignupWithOnboardingView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
-        onboarding_controller = OnboardingController()
+        onboarding_controller = CustomOnboardingController()
         # 1️⃣ Validate & register user using existing REGISTER_SERIALIZER
         serializer = api_settings.REGISTER_SERIALIZER(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.save(request)
-
-        # 2️⃣ If needed, create tokens (JWT or DRF Token)
-        tokens = None
-        # if api_settings.USE_JWT:
-        #     access_token, refresh_token = jwt_encode(user)
-        #     tokens = {
-        #         "access": access_token,
-        #         "refresh": refresh_token,
-        #     }
-        # elif TokenModel:
-        #     token, created = TokenModel.objects.get_or_create(user=user)
-        #     tokens = {
-        #         "token": token.key,
-        #     }
-
-        # 3️⃣ Trigger the email confirmation
-        complete_signup(
-            request._request,
-            user,
-            allauth_account_settings.EMAIL_VERIFICATION,
-            None
-        )
-        onboarding = Onboarding.objects.get(name="Default Onboarding")
-
-        # 4️⃣ Initialize onboarding step if needed
-        # Example: assuming you have an OnboardingStatus model
-        step = onboarding_controller.create_onboarding_step(
-            onboarding=onboarding,
-            step_name="Verify Email",
-            description="Please verify your email to activate your account.",
-            level=1,
-            optional=False,
-        )
+        with transaction.atomic():
+            user = serializer.save(request)
+
+            # 2️⃣ If needed, create tokens (JWT or DRF Token)
+            tokens = None
+            # if api_settings.USE_JWT:
+            #     access_token, refresh_token = jwt_encode(user)
+            #     tokens = {
+            #         "access": access_token,
+            #         "refresh": refresh_token,
+            #     }
+            # elif TokenModel:
+            #     token, created = TokenModel.objects.get_or_create(user=user)
+            #     tokens = {
+            #         "token": token.key,
+            #     }
+
+            # 3️⃣ Trigger the email confirmation
+            complete_signup(
+                request._request,
+                user,
+                allauth_account_settings.EMAIL_VERIFICATION,
+                None
+            )
+
+            # 4️⃣ Record the user's pending "Verify Email" step (api.signals marks it done on confirmation)
+            step = onboarding_controller.start_signup_onboarding(user)
 
         # 5️⃣ Return response
         response_data = {
@@ -388,3 +844,43 @@ class UserSignupWithOnboardingView(APIView):
 
         return Response(response_data, status=status.HTTP_201_CREATED)
 
+
+class ChangeEventsView(BaseAPIView):
+    """
+    Tail the change-event log: events after ?cursor=<id> (all topics, or those
+    given with ?topic=), in id order. ?cursor=latest returns the current head
+    without events, for consumers that only want changes from now on.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        cursor = request.query_params.get("cursor", "0")
+        try:
+            if cursor == "latest":
+                return Response(
+                    {"events": [], "next_cursor": latest_cursor(), "truncated": False}, status=status.HTTP_200_OK
+                )
+            cursor = int(cursor)
+            limit = int(request.query_params.get("limit", api_settings.CHANGE_EVENT_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "cursor and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, api_settings.CHANGE_EVENT_MAX_PAGE_SIZE))
+
+        try:
+            events, next_cursor, truncated = events_since(cursor, request.query_params.getlist("topic"), limit)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(
+            {"events": events, "next_cursor": next_cursor, "truncated": truncated}, status=status.HTTP_200_OK
+        )
+
+
+class MetricsView(BaseAPIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        snapshot = registry.snapshot()
+        if request.query_params.get("reset") in ("1", "true"):
+            registry.reset()
+        return Response({"views": snapshot}, status=status.HTTP_200_OK)
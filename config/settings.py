@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 
 from dotenv import load_dotenv
@@ -64,6 +65,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.RequestCacheMiddleware",
+    "api.middleware.QueryInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -72,7 +75,8 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 
-    'accounts.middleware.AccountsPermissionMiddleware',
+    # Endpoint permissions from api.endpoint_index; api views check them after their own authentication.
+    "api.middleware.EndpointPermissionMiddleware",
     "allauth.account.middleware.AccountMiddleware",
 ]
 
@@ -100,11 +104,73 @@ WSGI_APPLICATION = "config.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Connections are persistent (DB_CONN_MAX_AGE seconds) and api.db applies the
+# SQLITE_PRAGMAS api setting (WAL, synchronous=NORMAL, busy_timeout, cache_size)
+# when they open. "replica" serves the read-only views through
+# api.routers.ReadReplicaRouter: a read-only connection to the same file
+# locally, or a real replica via DB_REPLICA_NAME.
+
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "600"))
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+    },
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv("DB_REPLICA_NAME", f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro"),
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+# Tenant partitions: every alias in TENANT_DB_ALIASES gets its own SQLite file and
+# TENANT_DATABASES (JSON, organization id -> alias) places that organization's
+# onboarding data there through api.routers.TenantRouter, so tenants stop sharing
+# one writer. Run `migrate --database <alias>` for each; unmapped organizations
+# stay in "default". Users, roles, memberships and the catalog are not partitioned:
+# they stay in "default" for every organization (see api.routers.TENANT_MODELS).
+# Mapping an organization hides its existing onboarding rows in "default": move
+# them first with `move_tenant_onboarding <organization id> --database <alias>`.
+
+for alias in filter(None, (alias.strip() for alias in os.getenv("TENANT_DB_ALIASES", "").split(","))):
+    DATABASES[alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"db_{alias}.sqlite3",
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
     }
+
+DATABASE_ROUTERS = ["api.routers.TenantRouter", "api.routers.ReadReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Point CACHE_BACKEND/CACHE_LOCATION at a shared backend (e.g. redis) so role
+# resolution is cached across worker processes.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Token auth goes through api.authentication.CachedTokenAuthentication, which
+# verifies each token once per api.cache.CredentialCache entry. Also read by
+# api.api_settings for the api knobs.
+
+REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+        "api.authentication.CachedTokenAuthentication",
+    ],
+    "TENANT_DATABASES": json.loads(os.getenv("TENANT_DATABASES", "{}")),
 }
 
 
@@ -217,8 +283,9 @@ ACCOUNT_USER_MODEL_USERNAME_FIELD = None
 
 
 
-# Use standard SMTP settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Mail is queued (api.mail.QueuedEmailBackend) and delivered over SMTP with the
+# settings below, either from a background thread or by send_queued_mail.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'api.mail.QueuedEmailBackend')
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587  # For SSL (use 587 for TLS)
@@ -0,0 +1,52 @@
+"""
+Settings profile for API-only workers (DJANGO_SETTINGS_MODULE=config.settings_api).
+
+Same configuration as config.settings, but only the apps that api.views and the
+account flows it drives need are installed, and the URLconf serves /api/ and
+/accounts/ only. The admin, scraper, blockchain_auth, payment, notification,
+com_adaptor, the social login providers and django_celery_beat stay out of these
+processes; run them (and celery beat) with config.settings.
+
+API_WORKER_EXTRA_APPS (comma separated) adds apps back without editing this file.
+Check the cost with `manage.py startup_report --profile config.settings_api`.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import MIDDLEWARE, TEMPLATES
+
+INSTALLED_APPS = [
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+
+    "rest_framework",
+    "rest_framework.authtoken",
+    # dj_rest_auth's registration serializers import the socialaccount models.
+    "allauth",
+    "allauth.account",
+    "allauth.socialaccount",
+    "rest_framework_api_key",
+    "accounts",
+    "api",
+] + [app.strip() for app in os.getenv("API_WORKER_EXTRA_APPS", "").split(",") if app.strip()]
+
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if middleware != "django.contrib.messages.middleware.MessageMiddleware"
+]
+
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "OPTIONS": {
+            "context_processors": [
+                processor for processor in TEMPLATES[0]["OPTIONS"]["context_processors"]
+                if processor != "django.contrib.messages.context_processors.messages"
+            ],
+        },
+    },
+]
+
+ROOT_URLCONF = "config.urls_api"
@@ -0,0 +1,13 @@
+"""
+URL configuration for API-only workers (config.settings_api).
+
+Serves the api app plus the account routes its signup flow redirects to and
+links from confirmation emails; everything else is served by config.urls.
+"""
+
+from django.urls import path, include
+
+urlpatterns = [
+    path('accounts/', include('accounts.urls')),
+    path("api/", include("api.urls"))
+]